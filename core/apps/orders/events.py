@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import weakref
+from typing import Any, Dict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Push-уведомления о статусе заказа/платежа через Redis pub/sub.
+#   events:cart:<cart_id>  — канал корзины: смена статуса Payment и оформление заказа
+# Публикуют сервисы (после коммита), слушает SSE-вьюха (apps/payments/views.py).
+# Pub/sub ничего не хранит: подписчик сначала подписывается, потом читает
+# текущее состояние из БД — так между снимком и событиями ничего не теряется.
+
+
+def cart_channel(cart_id) -> str:
+    return ":".join([settings.CACHE_KEY_PREFIX, "events", "cart", str(cart_id)])
+
+
+def publish_cart_event(cart_id, event: Dict[str, Any]) -> None:
+    """Отправить событие подписчикам корзины. Redis недоступен — событие теряется,
+    клиент увидит состояние при следующем подключении."""
+    if not cart_id:
+        return
+    try:
+        conn = get_redis_connection("default")
+        conn.publish(cart_channel(cart_id), json.dumps({"cart_id": cart_id, **event}))
+    except Exception as e:
+        logger.warning("publish_cart_event failed: %s", e)
+
+
+# -----------------------------
+# приём событий в ASGI-процессе
+# -----------------------------
+# На процесс (event loop) — одно pub/sub-соединение с Redis и одна читающая
+# задача; подписчики получают события через свои asyncio.Queue. Тысячи открытых
+# SSE-потоков стоят по очереди в памяти, а не по соединению с Redis.
+
+_hubs: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EventHub]" = weakref.WeakKeyDictionary()
+
+
+def _async_redis():
+    import redis.asyncio as aioredis  # только для ASGI-развёртываний
+
+    return aioredis.Redis.from_url(
+        settings.CACHES["default"]["LOCATION"], decode_responses=True
+    )
+
+
+class EventHub:
+    def __init__(self, redis) -> None:
+        self._redis = redis
+        self._pubsub = None
+        self._queues: Dict[str, set] = {}
+        self._reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, channel: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.ORDER_EVENTS["QUEUE_SIZE"])
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = self._redis.pubsub()
+            if channel not in self._queues:
+                await self._pubsub.subscribe(channel)
+                self._queues[channel] = set()
+            self._queues[channel].add(queue)
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+        return queue
+
+    async def unsubscribe(self, channel: str, queue: asyncio.Queue) -> None:
+        async with self._lock:
+            queues = self._queues.get(channel)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._queues[channel]
+                try:
+                    await self._pubsub.unsubscribe(channel)
+                except Exception as e:
+                    logger.warning("event hub unsubscribe failed: %s", e)
+
+    async def _read(self) -> None:
+        while self._queues:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except Exception as e:
+                # обрыв соединения: redis-py переподключится и восстановит подписки
+                logger.warning("event hub read failed: %s", e)
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message.get("type") != "message":
+                continue
+            try:
+                event = json.loads(message["data"])
+            except (TypeError, ValueError):
+                continue
+            for queue in tuple(self._queues.get(message["channel"], ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # медленный клиент: пропущенное он увидит в снимке при переподключении
+                    pass
+
+
+def event_hub() -> EventHub:
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = EventHub(_async_redis())
+        _hubs[loop] = hub
+    return hub
@@ -0,0 +1,15 @@
+from apps.orders.recalc import reconcile_cart_totals
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Сверить cart_total_sum черновых корзин с позициями (страховка для дельт)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "cart_ids", nargs="*", type=int, help="id корзин; по умолчанию — все черновые"
+        )
+
+    def handle(self, *args, **options):
+        fixed = reconcile_cart_totals(options["cart_ids"] or None)
+        self.stdout.write(f"fixed={fixed}")
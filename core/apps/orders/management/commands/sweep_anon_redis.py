@@ -0,0 +1,94 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+
+def _families():
+    """(имя, алиас кэша, шаблон SCAN, TTL) — ключи анонимных посетителей."""
+    return [
+        ("cart:a", "cart", "cart:a:*", settings.ANON_CART["TTL_SECONDS"]),
+        ("rv:a", "recently_viewed", "rv:a:*", settings.RECENTLY_VIEWED["TTL_SECONDS"]),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Обойти ключи анонимных корзин и недавно просмотренных (SCAN, пачками): "
+        "память по семействам, TTL для «вечных» ключей, удаление давно неиспользуемых"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=500, help="COUNT для SCAN")
+        parser.add_argument(
+            "--pause-ms", type=int, default=0, help="пауза между пачками, мс"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="только отчёт, без изменений"
+        )
+
+    def handle(self, *args, **options):
+        for name, alias, pattern, ttl in _families():
+            stats = self._sweep(
+                get_redis_connection(alias),
+                pattern,
+                ttl,
+                batch=options["batch"],
+                pause=options["pause_ms"] / 1000,
+                dry_run=options["dry_run"],
+            )
+            avg = stats["bytes"] // stats["sized"] if stats["sized"] else 0
+            self.stdout.write(
+                f"{name}: keys={stats['keys']} bytes={stats['bytes']} avg={avg} "
+                f"no_ttl={stats['no_ttl']} expired={stats['expired']} "
+                f"deleted={stats['deleted']}"
+            )
+
+    def _sweep(self, conn, pattern, ttl, *, batch, pause, dry_run) -> dict:
+        stats = {"keys": 0, "bytes": 0, "sized": 0, "no_ttl": 0, "expired": 0, "deleted": 0}
+        cursor = 0
+        while True:
+            # SCAN отдаёт небольшие порции и не блокирует Redis, в отличие от KEYS
+            cursor, keys = conn.scan(cursor=cursor, match=pattern, count=batch)
+            if keys:
+                self._process(conn, keys, ttl, stats, dry_run)
+            if cursor == 0:
+                return stats
+            if pause:
+                time.sleep(pause)
+
+    def _process(self, conn, keys, ttl, stats, dry_run) -> None:
+        pipe = conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+            pipe.memory_usage(key)
+            pipe.object("idletime", key)
+        # MEMORY/OBJECT могут быть недоступны (managed Redis) — тогда просто без них
+        results = pipe.execute(raise_on_error=False)
+
+        orphans = []
+        for i, key in enumerate(keys):
+            key_ttl, size, idle = results[3 * i : 3 * i + 3]
+            if key_ttl == -2:
+                continue  # истёк между SCAN и проверкой
+            stats["keys"] += 1
+            if isinstance(size, int):
+                stats["bytes"] += size
+                stats["sized"] += 1
+            if key_ttl == -1:
+                orphans.append((key, idle if isinstance(idle, int) else 0))
+
+        stats["no_ttl"] += len(orphans)
+        if dry_run or not orphans:
+            return
+        pipe = conn.pipeline(transaction=False)
+        for key, idle in orphans:
+            if idle >= ttl:
+                # UNLINK освобождает память в фоне
+                pipe.unlink(key)
+                stats["deleted"] += 1
+            else:
+                pipe.expire(key, ttl - idle)
+                stats["expired"] += 1
+        pipe.execute()
@@ -57,6 +57,12 @@ class Cart(models.Model):
         verbose_name='Адрес доставки',
         null=True,
         )
+    # растёт при каждом изменении позиций — ключ кэша отрисованной корзины
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        default=1,
+        editable=False,
+    )
     
     def __str__(self):
         return f'Заказ №{self.pk}' if self.is_ordered else f'Корзина №{self.pk}'
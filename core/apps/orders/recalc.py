@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Iterable
+
+from apps.orders.models import Cart
+from apps.orders.summary import bump_cart_summaries
+from apps.products.services import update_carts
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Coalesce
+
+# Реестр «грязных» корзин в пределах транзакции.
+# Сигналы CartItem только отмечают корзину, а пересчёт итога выполняется один раз
+# на корзину при коммите (одним UPDATE ... FROM, см. products.services.update_carts).
+# Вне транзакции on_commit срабатывает сразу — поведение как раньше.
+
+_state = threading.local()
+
+
+def _dirty() -> set[int]:
+    if not hasattr(_state, "dirty"):
+        _state.dirty = set()
+        _state.suppressed = 0
+        _state.delta = 0
+    return _state.dirty
+
+
+def _reset_dirty(**kwargs) -> None:
+    # отметки откатившейся транзакции (on_commit не сработал) не должны
+    # достаться следующему запросу этого потока
+    _state.__dict__.clear()
+
+
+request_started.connect(_reset_dirty, dispatch_uid="orders_recalc_reset_dirty")
+
+
+def flush_dirty_carts() -> int:
+    """Пересчитывает все отмеченные корзины; повторный вызов в том же коммите — no-op."""
+    dirty = _dirty()
+    if not dirty:
+        return 0
+    ids = list(dirty)
+    dirty.clear()
+    Cart.objects.filter(pk__in=ids).update(version=F("version") + 1)
+    updated = update_carts(ids)
+    bump_cart_summaries(ids)
+    return updated
+
+
+def mark_carts_dirty(cart_ids: Iterable[int]) -> None:
+    dirty = _dirty()
+    if _state.delta:
+        # итог уже поправлен дельтой (apply_cart_delta) — полный пересчёт не нужен
+        return
+    ids = {int(cid) for cid in cart_ids if cid}
+    if not ids:
+        return
+    dirty.update(ids)
+    if _state.suppressed:
+        # внутри suppress_cart_recalc: пересчёт запланирует выход из контекста
+        return
+    # колбэк на каждую отметку дешёвый, а первый же flush забирает весь набор;
+    # так пересчёт переживает и откат savepoint'а, в котором был зарегистрирован
+    transaction.on_commit(flush_dirty_carts)
+
+
+def mark_cart_dirty(cart_id: int) -> None:
+    mark_carts_dirty([cart_id])
+
+
+@contextmanager
+def suppress_cart_recalc():
+    """
+    Для массовых операций (копирование заказа, merge корзин): сигналы CartItem
+    внутри блока ничего не планируют, а все затронутые корзины пересчитываются
+    одним проходом при коммите.
+    """
+    _dirty()
+    _state.suppressed += 1
+    try:
+        yield
+    finally:
+        _state.suppressed -= 1
+        if not _state.suppressed and _state.dirty:
+            transaction.on_commit(flush_dirty_carts)
+
+
+# -----------------------------
+# Инкрементальные итоги
+# -----------------------------
+
+
+@contextmanager
+def delta_cart_totals():
+    """
+    Блок, в котором сервис сам поддерживает cart_total_sum дельтами
+    (apply_cart_delta): сигналы CartItem в нём корзину не отмечают.
+    """
+    _dirty()
+    _state.delta += 1
+    try:
+        yield
+    finally:
+        _state.delta -= 1
+
+
+def apply_cart_delta(cart_id: int, amount) -> None:
+    """
+    cart_total_sum += amount и version += 1 одним UPDATE, без перечитывания позиций.
+    Вызывается на каждое изменение позиции, даже с нулевой суммой.
+    """
+    Cart.objects.filter(pk=cart_id).update(
+        cart_total_sum=Coalesce(
+            F("cart_total_sum"),
+            Value(0, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        )
+        + amount,
+        version=F("version") + 1,
+    )
+    transaction.on_commit(lambda: bump_cart_summaries([cart_id]))
+
+
+def reconcile_cart_totals(cart_ids: Iterable[int] | None = None) -> int:
+    """
+    Страховка для дельт: полный пересчёт черновых корзин (по умолчанию — всех).
+    Пишутся только расходящиеся итоги. Возвращает число исправленных.
+    """
+    if cart_ids is None:
+        cart_ids = Cart.objects.exclude(is_ordered=True).values_list("id", flat=True)
+    return update_carts(cart_ids)
@@ -23,6 +23,16 @@ def get_or_create_draft_cart(client) -> Cart:
     )
 
 
+def get_draft_cart_stamp(client) -> tuple[int, int] | None:
+    """(id, version) текущей черновой корзины без создания — для чтения."""
+    return (
+        Cart.objects.filter(client=client, is_ordered=False)
+        .order_by("-id")
+        .values_list("id", "version")
+        .first()
+    )
+
+
 def cart_items_qs(cart: Cart):
     return CartItem.objects.select_related(
         "product_variant",
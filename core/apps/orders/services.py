@@ -1,24 +1,47 @@
+import json
+import logging
+import weakref
 from decimal import Decimal
 from typing import Any, Dict, Optional
 
 from apps.customers.models import Bonus
 from apps.payments.clients import TBankClient
 from apps.payments.models import Payment
+from apps.products.cache import catalog_version_key
+from apps.products.cards import variant_cards
 from apps.products.models import ProductVariant
 from apps.products.selectors import base_products_qs
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Case, IntegerField, When
+from django.db.models import Case, IntegerField, Sum, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django_redis import get_redis_connection
 
+from .events import publish_cart_event
 from .models import Cart, CartItem
-from .selectors import cart_items_qs, get_or_create_draft_cart
+from .recalc import (
+    apply_cart_delta,
+    delta_cart_totals,
+    mark_cart_dirty,
+    suppress_cart_recalc,
+)
+from .selectors import cart_items_qs, get_draft_cart_stamp, get_or_create_draft_cart
+from .summary import bump_anon_cart_summary, cached_cart_summary
 
 DEC_100 = Decimal("100")
 
+logger = logging.getLogger(__name__)
+
 # Redis (анонимная корзина)
 
 
+def _publish_order_event(cart: Cart) -> None:
+    """Заказ оформлен — уведомить подписчиков корзины (SSE), когда коммит пройдёт."""
+    event = {"type": "order", "status": cart.status, "is_ordered": cart.is_ordered}
+    transaction.on_commit(lambda: publish_cart_event(cart.pk, event))
+
+
 @transaction.atomic
 def mark_cart_paid(cart: Cart):
     """
@@ -40,6 +63,7 @@ def mark_cart_paid(cart: Cart):
     cart.status = "not_completed"
     cart.ordered_at = timezone.now().date()
     cart.save(update_fields=["is_ordered", "status", "ordered_at", "cart_total_sum"])
+    _publish_order_event(cart)
 
     # начисляем бонусы (идемпотентность должна быть внутри Bonus.create_from_order)
     try:
@@ -66,22 +90,75 @@ def _cart_key(*, user_id=None, anon_id=None):
     return None
 
 
-def anon_cart_add(*, anon_id: str, variant_id: int, qty: int) -> None:
+class CartLineLimitExceeded(Exception):
+    """В анонимной корзине не больше settings.ANON_CART["MAX_LINES"] позиций."""
+
+
+# Пачка изменений анонимной корзины за один round-trip:
+#   KEYS[1] — хэш корзины; ARGV: ttl, max_lines, затем пары variant_id, qty (qty <= 0 — удалить)
+# Если новых строк больше, чем позволяет лимит, ничего не меняется и возвращается nil.
+# Иначе — HGETALL результата; TTL продлевается при каждой записи.
+_ANON_CART_APPLY_LUA = """
+local key = KEYS[1]
+local added, removed = 0, 0
+for i = 3, #ARGV, 2 do
+    local exists = redis.call('HEXISTS', key, ARGV[i]) == 1
+    if tonumber(ARGV[i + 1]) > 0 then
+        if not exists then added = added + 1 end
+    elseif exists then
+        removed = removed + 1
+    end
+end
+if added > 0 and redis.call('HLEN', key) - removed + added > tonumber(ARGV[2]) then
+    return false
+end
+for i = 3, #ARGV, 2 do
+    if tonumber(ARGV[i + 1]) > 0 then
+        redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+    else
+        redis.call('HDEL', key, ARGV[i])
+    end
+end
+redis.call('EXPIRE', key, ARGV[1])
+return redis.call('HGETALL', key)
+"""
+
+# Script (SHA скрипта) создаётся один раз на соединение, а не на каждую операцию
+_anon_cart_scripts: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _anon_cart_apply_script(conn):
+    script = _anon_cart_scripts.get(conn)
+    if script is None:
+        script = _anon_cart_scripts[conn] = conn.register_script(_ANON_CART_APPLY_LUA)
+    return script
+
+
+def anon_cart_apply_ops(*, anon_id: str, ops: dict[int, int]) -> dict[int, int]:
+    """
+    Пачка {variant_id: qty} атомарно одним Lua-скриптом (qty <= 0 — удалить строку);
+    возвращает итоговое содержимое корзины. Превышение MAX_LINES — CartLineLimitExceeded.
+    """
     key = _cart_key(user_id=None, anon_id=anon_id)
     if not key:
-        return
-    conn = _cart_conn()
-    if qty <= 0:
-        conn.hdel(key, str(variant_id))
-    else:
-        conn.hset(key, str(variant_id), int(qty))
+        return {}
+    cfg = settings.ANON_CART
+    args = [cfg["TTL_SECONDS"], cfg["MAX_LINES"]]
+    for vid, qty in ops.items():
+        args += [int(vid), max(int(qty), 0)]
+    raw = _anon_cart_apply_script(_cart_conn())(keys=[key], args=args)
+    if raw is None:
+        raise CartLineLimitExceeded(cfg["MAX_LINES"])
+    bump_anon_cart_summary(anon_id)
+    return _decode_qty_map(dict(zip(raw[::2], raw[1::2])))
+
+
+def anon_cart_add(*, anon_id: str, variant_id: int, qty: int) -> None:
+    anon_cart_apply_ops(anon_id=anon_id, ops={variant_id: qty})
 
 
 def anon_cart_remove(*, anon_id: str, variant_id: int) -> None:
-    key = _cart_key(user_id=None, anon_id=anon_id)
-    if not key:
-        return
-    _cart_conn().hdel(key, str(variant_id))
+    anon_cart_apply_ops(anon_id=anon_id, ops={variant_id: 0})
 
 
 def anon_cart_clear(*, user_id=None, anon_id=None) -> None:
@@ -89,13 +166,23 @@ def anon_cart_clear(*, user_id=None, anon_id=None) -> None:
     if not key:
         return
     _cart_conn().delete(key)
+    if anon_id:
+        bump_anon_cart_summary(anon_id)
 
 
 def anon_cart_items(*, user_id=None, anon_id=None) -> dict[int, int]:
     key = _cart_key(user_id=user_id, anon_id=anon_id)
     if not key:
         return {}
-    raw = _cart_conn().hgetall(key)
+    pipe = _cart_conn().pipeline(transaction=False)
+    pipe.hgetall(key)
+    if anon_id:
+        # скользящий TTL: чтение корзины тоже продлевает ей жизнь
+        pipe.expire(key, settings.ANON_CART["TTL_SECONDS"])
+    return _decode_qty_map(pipe.execute()[0])
+
+
+def _decode_qty_map(raw) -> dict[int, int]:
     out = {}
     for k, v in raw.items():
         try:
@@ -110,50 +197,53 @@ def anon_cart_items(*, user_id=None, anon_id=None) -> dict[int, int]:
 # Преобразование корзины в ответ
 
 
+def cart_item_from_card(card: dict, qty: int) -> tuple[dict, Decimal]:
+    """Позиция корзины/заказа из карточки варианта (apps/products/cards.py)."""
+    price = Decimal(card["current_price"] or "0")
+    line_total = price * qty
+    p = card["product"]
+    item = {
+        "variant_id": card["id"],
+        "qty": qty,
+        "price": f"{price:.2f}",
+        "line_total": f"{line_total:.2f}",
+        "variant": {
+            "size_type": card["size_type"],
+            "size_value": card["size_value"],
+            "color": card["color"],
+            "in_stock": card["in_stock"],
+            "is_order": card["is_order"],
+        },
+        "product": {
+            "slug": p["slug"],
+            "name": p["name"],
+            "image": p["image"],
+            "brand": p["brand"],
+            "category": p["category"],
+        },
+    }
+    return item, line_total
+
+
 def build_cart_response_from_ids(qty_map: dict[int, int]) -> tuple[list[dict], str]:
     if not qty_map:
         return [], "0.00"
 
-    variants = ProductVariant.objects.select_related(
-        "product", "product__brand", "product__category"
-    ).filter(pk__in=list(qty_map.keys()))
+    cards = variant_cards(qty_map.keys())
 
     items = []
     total = Decimal("0")
-    for v in variants:
-        p = v.product
-        if not p.is_active:
+    for vid in sorted(cards):
+        card = cards[vid]
+        if not card["product"]["is_active"]:
             continue
-        qty = int(qty_map.get(v.id, 0))
+        qty = int(qty_map.get(vid, 0))
         if qty <= 0:
             continue
 
-        price = v.current_price or Decimal("0")
-        line_total = price * qty
+        item, line_total = cart_item_from_card(card, qty)
         total += line_total
-
-        items.append(
-            {
-                "variant_id": v.id,
-                "qty": qty,
-                "price": f"{price:.2f}",
-                "line_total": f"{line_total:.2f}",
-                "variant": {
-                    "size_type": v.size_type,
-                    "size_value": v.size_value,
-                    "color": v.color,
-                    "in_stock": v.is_active,
-                    "is_order": v.is_order,
-                },
-                "product": {
-                    "slug": p.slug,
-                    "name": p.name,
-                    "image": (p.image.url if getattr(p, "image", None) else None),
-                    "brand": (p.brand.name if p.brand else None),
-                    "category": (p.category.name if p.category else None),
-                },
-            }
-        )
+        items.append(item)
 
     return items, f"{total:.2f}"
 
@@ -161,96 +251,276 @@ def build_cart_response_from_ids(qty_map: dict[int, int]) -> tuple[list[dict], s
 # БД корзина (авторизованный клиент)
 
 
-def db_cart_add_or_set(client, *, variant_id: int, qty: int) -> None:
-    cart = get_or_create_draft_cart(client)
-    if qty <= 0:
-        CartItem.objects.filter(cart=cart, product_variant_id=variant_id).delete()
-        cart_recalculate(cart)
-        return
+def _lock_cart(cart) -> None:
+    """Параллельные изменения одной корзины идут по очереди (порядок блокировок:
+    сначала корзина, потом позиции)."""
+    Cart.objects.select_for_update().filter(pk=cart.pk).first()
 
-    variant = (
-        ProductVariant.objects.select_related("product").filter(pk=variant_id).first()
+
+def _cart_line_for_update(cart, variant_id: int):
+    # без блокировки корзины два первых добавления одного варианта оба не видят
+    # позицию, создают по строке и оба прибавляют полную дельту к итогу
+    _lock_cart(cart)
+    return (
+        CartItem.objects.select_for_update()
+        .filter(cart=cart, product_variant_id=variant_id)
+        .select_related("product_variant")
+        .first()
     )
-    if not variant or not variant.product.is_active:
+
+
+def _delete_cart_line(cart, variant_id: int) -> None:
+    item = _cart_line_for_update(cart, variant_id)
+    if item is None:
         return
+    price = item.product_variant.current_price or Decimal("0")
+    CartItem.objects.filter(cart=cart, product_variant_id=variant_id).delete()
+    apply_cart_delta(cart.pk, -price * item.quantity)
 
-    obj, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=variant.product,
-        product_variant=variant,
-        defaults={"quantity": qty},
-    )
-    if not created:
-        obj.quantity = qty
-        obj.save(update_fields=["quantity"])
 
-    cart_recalculate(cart)
+@transaction.atomic
+def db_cart_add_or_set(client, *, variant_id: int, qty: int) -> None:
+    """
+    Итог корзины правим дельтой price * (новое − старое количество):
+    одна строка CartItem и один UPDATE корзины, без пересчёта всех позиций.
+    """
+    cart = get_or_create_draft_cart(client)
+    with delta_cart_totals():
+        if qty <= 0:
+            _delete_cart_line(cart, variant_id)
+            return
 
+        variant = (
+            ProductVariant.objects.select_related("product").filter(pk=variant_id).first()
+        )
+        if not variant or not variant.product.is_active:
+            return
+
+        item = _cart_line_for_update(cart, variant_id)
+        old_qty = item.quantity if item else 0
+        if item is not None and old_qty == qty:
+            return
+        if item is None:
+            CartItem.objects.create(
+                cart=cart,
+                product=variant.product,
+                product_variant=variant,
+                quantity=qty,
+            )
+        else:
+            item.quantity = qty
+            item.save(update_fields=["quantity"])
 
+        price = variant.current_price or Decimal("0")
+        apply_cart_delta(cart.pk, price * (qty - old_qty))
+
+
+@transaction.atomic
 def db_cart_remove(client, *, variant_id: int) -> None:
     cart = get_or_create_draft_cart(client)
-    CartItem.objects.filter(cart=cart, product_variant_id=variant_id).delete()
-    cart_recalculate(cart)
+    with delta_cart_totals():
+        _delete_cart_line(cart, variant_id)
 
 
-def build_db_cart_response(client) -> dict:
+@transaction.atomic
+def db_cart_apply_ops(client, ops: dict[int, int]) -> None:
+    """
+    Пачка {variant_id: qty} в черновую корзину одной транзакцией (qty <= 0 — удалить).
+    Итог и версия корзины пересчитываются один раз при коммите.
+    """
     cart = get_or_create_draft_cart(client)
-    items_qs = cart_items_qs(cart)
+    removed = [vid for vid, qty in ops.items() if qty <= 0]
+    with suppress_cart_recalc():
+        bulk_merge_into_cart(
+            cart, {vid: qty for vid, qty in ops.items() if qty > 0}, strategy="set"
+        )
+        if removed:
+            CartItem.objects.filter(cart=cart, product_variant_id__in=removed).delete()
+
+
+def _cart_view_key(cart_id: int) -> str:
+    return f"{settings.CACHE_KEY_PREFIX}:cartview:{cart_id}"
+
+
+def _render_db_cart(cart_id: int) -> dict:
+    lines = list(
+        CartItem.objects.filter(cart_id=cart_id).values_list(
+            "product_variant_id", "quantity"
+        )
+    )
+    cards = variant_cards(vid for vid, _ in lines)
 
     items = []
     total = Decimal("0")
-    for ci in items_qs:
-        v = ci.product_variant
-        p = v.product
-        price = v.current_price or Decimal("0")
-        line_total = price * ci.quantity
+    for vid, qty in lines:
+        card = cards.get(vid)
+        if card is None:
+            continue
+        item, line_total = cart_item_from_card(card, qty)
         total += line_total
-        items.append(
-            {
-                "variant_id": v.id,
-                "qty": ci.quantity,
-                "price": f"{price:.2f}",
-                "line_total": f"{line_total:.2f}",
-                "variant": {
-                    "size_type": v.size_type,
-                    "size_value": v.size_value,
-                    "color": v.color,
-                    "in_stock": v.is_active,
-                    "is_order": v.is_order,
-                },
-                "product": {
-                    "slug": p.slug,
-                    "name": p.name,
-                    "image": (p.image.url if getattr(p, "image", None) else None),
-                    "brand": (p.brand.name if p.brand else None),
-                    "category": (p.category.name if p.category else None),
-                },
-            }
+        items.append(item)
+    return {"items": items, "total": f"{total:.2f}"}
+
+
+def build_db_cart_response(client) -> dict:
+    """
+    Только чтение: ничего не создаёт и не пишет в БД (бейдж корзины опрашивается
+    постоянно). Отрисованная корзина лежит в Redis вместе с версией корзины
+    и версией каталога (цены/названия) — оба сверяются одним MGET.
+    """
+    stamp = get_draft_cart_stamp(client)
+    if stamp is None:
+        return {"items": [], "total": "0.00"}
+    cart_id, version = stamp
+
+    try:
+        conn = get_redis_connection("default")
+        raw, catalog_version = conn.mget([_cart_view_key(cart_id), catalog_version_key()])
+    except Exception as e:
+        logger.warning("cart view cache unavailable: %s", e)
+        return _render_db_cart(cart_id)
+
+    catalog_version = int(catalog_version or 0)
+    if raw is not None:
+        cached = json.loads(raw)
+        if cached["v"] == version and cached["c"] == catalog_version:
+            return cached["data"]
+
+    data = _render_db_cart(cart_id)
+    try:
+        conn.set(
+            _cart_view_key(cart_id),
+            json.dumps({"v": version, "c": catalog_version, "data": data}),
+            ex=settings.CATALOG_CACHE["TIMEOUT"],
         )
+    except Exception as e:
+        logger.warning("cart view cache set failed: %s", e)
+    return data
 
-    # держим сумму в модели актуальной
-    cart.cart_total_sum = total
-    cart.save(update_fields=["cart_total_sum"])
 
-    return {"items": items, "total": f"{total:.2f}"}
+# Сводка для бейджа (apps/orders/summary.py)
+
+EMPTY_CART_SUMMARY = {"count": 0, "total": "0.00", "version": 0}
+
+
+def client_cart_summary(client) -> dict:
+    """Промах — один агрегирующий запрос; итог берём из поддерживаемого cart_total_sum."""
+
+    def compute(_counter: int) -> dict:
+        row = (
+            Cart.objects.filter(client=client, is_ordered=False)
+            .order_by("-id")
+            .annotate(count=Coalesce(Sum("cart_items__quantity"), 0))
+            .values_list("version", "cart_total_sum", "count")
+            .first()
+        )
+        if row is None:
+            return dict(EMPTY_CART_SUMMARY)
+        version, total, count = row
+        return {"count": count, "total": f"{total or 0:.2f}", "version": version}
+
+    return cached_cart_summary("c", client.pk, compute)
+
+
+def anon_cart_summary(anon_id: str | None) -> dict:
+    """Промах считается без БД: позиции из Redis, цены из карточек вариантов."""
+    if not anon_id:
+        return dict(EMPTY_CART_SUMMARY)
+
+    def compute(counter: int) -> dict:
+        items, total = build_cart_response_from_ids(anon_cart_items(anon_id=anon_id))
+        return {
+            "count": sum(it["qty"] for it in items),
+            "total": total,
+            "version": counter,
+        }
+
+    return cached_cart_summary("a", anon_id, compute)
 
 
 # Merge анонимной корзины в БД
 
+CART_MERGE_STRATEGIES = ("max", "sum", "set", "replace")
+
 
-def merge_anon_cart_into_db_cart(*, client, anon_id: str) -> None:
+def _merge_qty(strategy: str, current: int, incoming: int) -> int:
+    if strategy == "sum":
+        return current + incoming
+    if strategy in ("set", "replace"):
+        return incoming
+    return max(current, incoming)
+
+
+def bulk_merge_into_cart(cart: Cart, qty_map: dict[int, int], *, strategy: str = "max") -> int:
+    """
+    Слить {variant_id: qty} в черновую корзину пачкой:
+    варианты проверяются одним запросом (не в наличии и неактивные товары
+    пропускаются), позиции пишутся bulk_create/bulk_update,
+    итог и версия корзины пересчитываются один раз при коммите.
+    set — количества из qty_map перезаписывают совпадающие позиции;
+    replace — корзина становится ровно qty_map (прочие позиции удаляются).
+    Вызывать внутри transaction.atomic. Возвращает число записанных позиций.
+    """
+    if strategy not in CART_MERGE_STRATEGIES:
+        raise ValueError(f"unknown merge strategy: {strategy}")
+
+    qty_map = {int(vid): int(qty) for vid, qty in qty_map.items() if int(qty) > 0}
+    # блокируем корзину: параллельные merge/repeat одного клиента идут по очереди
+    _lock_cart(cart)
+
+    variants = dict(
+        ProductVariant.objects.filter(
+            pk__in=qty_map.keys(), is_active=True, product__is_active=True
+        ).values_list("id", "product_id")
+    )
+    existing = {ci.product_variant_id: ci for ci in CartItem.objects.filter(cart=cart)}
+
+    to_create, to_update = [], []
+    for vid, qty in qty_map.items():
+        if vid not in variants:
+            continue
+        item = existing.get(vid)
+        if item is None:
+            to_create.append(
+                CartItem(
+                    cart=cart,
+                    product_id=variants[vid],
+                    product_variant_id=vid,
+                    quantity=qty,
+                )
+            )
+            continue
+        final_qty = _merge_qty(strategy, item.quantity, qty)
+        if final_qty != item.quantity:
+            item.quantity = final_qty
+            to_update.append(item)
+
+    stale = []
+    if strategy == "replace":
+        stale = [ci.pk for vid, ci in existing.items() if vid not in qty_map]
+
+    if not (to_create or to_update or stale):
+        return 0
+    if stale:
+        CartItem.objects.filter(pk__in=stale).delete()
+    CartItem.objects.bulk_create(to_create)
+    CartItem.objects.bulk_update(to_update, ["quantity"])
+    # bulk-операции сигналов не шлют — отмечаем корзину сами
+    mark_cart_dirty(cart.pk)
+    return len(to_create) + len(to_update)
+
+
+@transaction.atomic
+def merge_anon_cart_into_db_cart(*, client, anon_id: str, strategy: str = "max") -> int:
     anon_map = anon_cart_items(user_id=None, anon_id=anon_id)
     if not anon_map:
-        return
+        return 0
     cart = get_or_create_draft_cart(client)
-    existing = {ci.product_variant_id: ci.quantity for ci in cart_items_qs(cart)}
-
-    for vid, qty in anon_map.items():
-        final_qty = max(existing.get(vid, 0), int(qty))
-        if final_qty > 0:
-            db_cart_add_or_set(client, variant_id=vid, qty=final_qty)
-
-    anon_cart_clear(user_id=None, anon_id=anon_id)
+    with suppress_cart_recalc():
+        merged = bulk_merge_into_cart(cart, anon_map, strategy=strategy)
+    # гостевую корзину удаляем, только если позиции действительно попали в БД
+    transaction.on_commit(lambda: anon_cart_clear(user_id=None, anon_id=anon_id))
+    return merged
 
 
 # Оформление / бонусы / пересчёт
@@ -287,6 +557,7 @@ def order_mark_paid_by_id(cart_id: int) -> None:
     cart.is_ordered = True
     cart.ordered_at = timezone.now().date()  # DateField
     cart.save(update_fields=["status", "is_ordered", "ordered_at", "cart_total_sum"])
+    _publish_order_event(cart)
 
     try:
         Bonus.create_from_order(cart)
@@ -298,38 +569,35 @@ def order_mark_paid_by_id(cart_id: int) -> None:
         )
 
 
+@transaction.atomic
 def repeat_order_into_draft(
     client, *, from_cart_id: int, merge_strategy: str = "max"
-) -> int:
-    src = (
-        Cart.objects.select_for_update()
-        .filter(pk=from_cart_id, client=client, is_ordered=True)
-        .first()
-    )
-    if not src:
-        return 0
+) -> tuple[int, int] | None:
+    """
+    Перенести позиции оформленного заказа в черновую корзину клиента.
+    Число запросов не зависит от размера заказа: позиции читаются одним запросом
+    (неактивные товары и варианты не в наличии отсеиваются в нём же) и пишутся
+    через bulk_merge_into_cart.
+    Возвращает (id черновой корзины, moved) или None, если такого заказа у клиента нет.
+    moved — число вариантов заказа, которые есть в черновике после переноса
+    (включая позиции, где количество уже совпадало), а не число записанных строк.
+    """
+    if not Cart.objects.filter(pk=from_cart_id, client=client, is_ordered=True).exists():
+        return None
+
+    qty_map: dict[int, int] = {}
+    lines = CartItem.objects.filter(
+        cart_id=from_cart_id,
+        product_variant__is_active=True,
+        product_variant__product__is_active=True,
+    ).values_list("product_variant_id", "quantity")
+    for vid, qty in lines:
+        qty_map[vid] = qty_map.get(vid, 0) + qty
 
     dst = get_or_create_draft_cart(client)
-
-    if merge_strategy == "replace":
-        CartItem.objects.filter(cart=dst).delete()
-        existing = {}
-    else:
-        existing = {ci.product_variant_id: ci.quantity for ci in cart_items_qs(dst)}
-
-    moved = 0
-    for it in CartItem.objects.filter(cart=src).select_related("product_variant"):
-        vid = it.product_variant_id
-        if merge_strategy == "sum":
-            final_qty = existing.get(vid, 0) + it.quantity
-        else:
-            final_qty = max(existing.get(vid, 0), it.quantity)
-
-        if final_qty > 0:
-            db_cart_add_or_set(client, variant_id=vid, qty=final_qty)
-            moved += 1
-
-    return moved
+    with suppress_cart_recalc():
+        bulk_merge_into_cart(dst, qty_map, strategy=merge_strategy)
+    return dst.pk, len(qty_map)
 
 
 @transaction.atomic
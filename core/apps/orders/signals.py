@@ -3,7 +3,9 @@ from django.dispatch import receiver
 from django.db import transaction
 
 from .models import Cart, CartItem
-from .services import cart_recalculate, order_mark_paid_by_id
+from .recalc import mark_cart_dirty
+from .services import order_mark_paid_by_id
+from .summary import bump_client_cart_summaries
 
 
 @receiver(pre_save, sender=Cart)
@@ -37,13 +39,18 @@ def cart_post_save_status_transition(sender, instance: Cart, created: bool, **kw
         and not instance.is_ordered
     ):
         transaction.on_commit(lambda cid=instance.pk: order_mark_paid_by_id(cid))
+
+    # создание/оформление меняет «текущую» корзину клиента — сводка для бейджа устарела
+    transaction.on_commit(
+        lambda client_id=instance.client_id: bump_client_cart_summaries([client_id])
+    )
         
+# Позиции корзины только отмечают её «грязной»: итог пересчитывается один раз
+# на корзину при коммите транзакции (см. apps/orders/recalc.py)
 @receiver(post_save, sender=CartItem)
 def cart_item_post_save_recalc(sender, instance: CartItem, created: bool, **kwargs):
-    cart = instance.cart
-    transaction.on_commit(lambda: cart_recalculate(cart))
+    mark_cart_dirty(instance.cart_id)
 
 @receiver(post_delete, sender=CartItem)
 def cart_item_post_delete_recalc(sender, instance: CartItem, **kwargs):
-    cart = instance.cart
-    transaction.on_commit(lambda: cart_recalculate(cart))
\ No newline at end of file
+    mark_cart_dirty(instance.cart_id)
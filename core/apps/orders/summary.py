@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Callable, Iterable
+
+from apps.orders.models import Cart
+from apps.products.cache import catalog_version_key
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Сводка корзины для бейджа в шапке: {count, total, version}.
+#   cartsum:c:<client_id>     — запись сводки (JSON)
+#   cartsum:c:<client_id>:v   — счётчик изменений корзин клиента
+#   cartsum:a:<anon_id>[:v]   — то же для анонимной корзины
+# Запись валидна, пока совпадают счётчик и версия каталога (цены) — проверяется
+# одним MGET. Счётчик увеличивают мутации корзины (после коммита), поэтому запись,
+# посчитанная по устаревшим данным, сразу оказывается невалидной.
+
+
+def _conn():
+    try:
+        return get_redis_connection("default")
+    except Exception as e:
+        logger.warning("cart summary redis unavailable: %s", e)
+        return None
+
+
+def _key(kind: str, owner_id, *suffix) -> str:
+    return ":".join([settings.CACHE_KEY_PREFIX, "cartsum", kind, str(owner_id), *suffix])
+
+
+def _bump(keys: list[str], *, ttl: int | None = None) -> None:
+    if not keys:
+        return
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        pipe = conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(key)
+            if ttl:
+                pipe.expire(key, ttl)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("cart summary bump failed: %s", e)
+
+
+def bump_client_cart_summaries(client_ids: Iterable[int]) -> None:
+    _bump([_key("c", cid, "v") for cid in set(client_ids) if cid])
+
+
+def bump_cart_summaries(cart_ids: Iterable[int]) -> None:
+    """Для мутаций, где известны только id корзин (вызывать после коммита)."""
+    ids = list(cart_ids)
+    if not ids:
+        return
+    client_ids = Cart.objects.filter(pk__in=ids).values_list("client_id", flat=True)
+    bump_client_cart_summaries(client_ids)
+
+
+def bump_anon_cart_summary(anon_id: str) -> None:
+    # живёт столько же, сколько сама анонимная корзина
+    _bump([_key("a", anon_id, "v")], ttl=settings.ANON_CART["TTL_SECONDS"])
+
+
+def cached_cart_summary(kind: str, owner_id, compute: Callable[[int], dict]) -> dict:
+    """
+    kind: "c" — клиент, "a" — анонимная корзина. compute(counter) считает сводку
+    по данным (вызывается только при промахе или без Redis).
+    """
+    conn = _conn()
+    if conn is None:
+        return compute(0)
+    record_key, counter_key = _key(kind, owner_id), _key(kind, owner_id, "v")
+    try:
+        raw, counter, catalog = conn.mget([record_key, counter_key, catalog_version_key()])
+    except Exception as e:
+        logger.warning("cart summary get failed: %s", e)
+        return compute(0)
+
+    stamp = [int(counter or 0), int(catalog or 0)]
+    if raw is not None:
+        record = json.loads(raw)
+        if record["s"] == stamp:
+            return record["data"]
+
+    # счётчик прочитан до данных: если корзину изменят сейчас, запись не пройдёт проверку
+    data = compute(stamp[0])
+    try:
+        conn.set(
+            record_key,
+            json.dumps({"s": stamp, "data": data}),
+            ex=settings.CATALOG_CACHE["TIMEOUT"],
+        )
+    except Exception as e:
+        logger.warning("cart summary set failed: %s", e)
+    return data
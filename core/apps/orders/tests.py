@@ -1,3 +1,508 @@
-from django.test import TestCase
+import datetime
+import threading
+import uuid
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from apps.customers.models import Client
+from apps.orders.models import Cart, CartItem
+from apps.orders import recalc
+from apps.orders.recalc import reconcile_cart_totals, suppress_cart_recalc
+from apps.orders.selectors import get_or_create_draft_cart
+from apps.orders.views import CART_BATCH_MAX_OPS
+from apps.orders.services import (
+    CartLineLimitExceeded,
+    _cart_conn,
+    _cart_key,
+    anon_cart_add,
+    anon_cart_apply_ops,
+    anon_cart_items,
+    anon_cart_summary,
+    build_db_cart_response,
+    bulk_merge_into_cart,
+    client_cart_summary,
+    db_cart_add_or_set,
+    db_cart_apply_ops,
+    db_cart_remove,
+    repeat_order_into_draft,
+)
+from apps.products.cache import bump_catalog_version
+from apps.products.models import Brand, Category, Product, ProductVariant
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+
+def _make_client(email: str, phone: str) -> Client:
+    user = User.objects.create_user(username=email, password="pw")
+    return Client.objects.create(
+        user=user,
+        surname="Иванов",
+        name="Иван",
+        phone_number=phone,
+        birthday=datetime.date(1990, 1, 1),
+    )
+
+
+def _make_variants(*prices) -> list[ProductVariant]:
+    product = Product.objects.create(
+        name="Перчатки",
+        category=Category.objects.create(name="Перчатки"),
+        brand=Brand.objects.create(name="Bauer"),
+    )
+    return [
+        ProductVariant.objects.create(
+            product=product, size_value=str(10 + i), base_price=Decimal(price)
+        )
+        for i, price in enumerate(prices)
+    ]
+
+
+def _cart_lines(cart_id) -> dict[int, int]:
+    return dict(
+        CartItem.objects.filter(cart_id=cart_id).values_list("product_variant_id", "quantity")
+    )
+
+
+class IsolatedRedisMixin:
+    """
+    Свой CACHE_KEY_PREFIX на тест (сводки, карточки, версии) и уникальный anon_id;
+    ключи теста удаляются после него.
+    """
+
+    def setUp(self):
+        super().setUp()
+        prefix = f"test-{uuid.uuid4().hex[:12]}"
+        override = override_settings(CACHE_KEY_PREFIX=prefix)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self._drop_keys, prefix)
+        self.anon_id = uuid.uuid4().hex
+        anon_key = _cart_key(user_id=None, anon_id=self.anon_id)
+        self.addCleanup(lambda: _cart_conn().delete(anon_key))
+
+    @staticmethod
+    def _drop_keys(prefix: str) -> None:
+        conn = get_redis_connection("default")
+        keys = list(conn.scan_iter(match=f"{prefix}:*"))
+        if keys:
+            conn.delete(*keys)
+
+
+@override_settings(ANON_CART={"TTL_SECONDS": 1000, "MAX_LINES": 3})
+class AnonCartLimitsTest(IsolatedRedisMixin, SimpleTestCase):
+    """Анонимная корзина: не больше MAX_LINES строк, скользящий TTL."""
+
+    def _key(self):
+        return _cart_key(user_id=None, anon_id=self.anon_id)
+
+    def test_line_limit(self):
+        anon_cart_apply_ops(anon_id=self.anon_id, ops={1: 1, 2: 1, 3: 1})
+        with self.assertRaises(CartLineLimitExceeded):
+            anon_cart_add(anon_id=self.anon_id, variant_id=4, qty=1)
+        # отказ ничего не меняет
+        self.assertEqual(anon_cart_items(anon_id=self.anon_id), {1: 1, 2: 1, 3: 1})
+
+    def test_limit_counts_only_new_lines(self):
+        anon_cart_apply_ops(anon_id=self.anon_id, ops={1: 1, 2: 1, 3: 1})
+        # изменить количество существующей строки можно и на лимите
+        anon_cart_add(anon_id=self.anon_id, variant_id=3, qty=5)
+        # удаление и добавление в одной пачке укладываются в лимит
+        items = anon_cart_apply_ops(anon_id=self.anon_id, ops={1: 0, 4: 2})
+        self.assertEqual(items, {2: 1, 3: 5, 4: 2})
+
+    def test_batch_over_limit_is_rejected_whole(self):
+        with self.assertRaises(CartLineLimitExceeded):
+            anon_cart_apply_ops(anon_id=self.anon_id, ops={1: 1, 2: 1, 3: 1, 4: 1})
+        self.assertEqual(anon_cart_items(anon_id=self.anon_id), {})
+
+    def test_ttl_is_set_on_write_and_refreshed_on_read(self):
+        anon_cart_add(anon_id=self.anon_id, variant_id=1, qty=1)
+        conn = _cart_conn()
+        self.assertGreater(conn.ttl(self._key()), 990)
+
+        conn.expire(self._key(), 10)
+        anon_cart_items(anon_id=self.anon_id)
+        self.assertGreater(conn.ttl(self._key()), 990)
+
+
+class CartSummaryInvalidationTest(IsolatedRedisMixin, TestCase):
+    """Сводка для бейджа кэшируется и сбрасывается мутациями корзины и сменой цен."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username="sum@example.com", password="pw")
+        cls.client_obj = Client.objects.create(
+            user=user,
+            surname="Иванов",
+            name="Иван",
+            phone_number="+79990000201",
+            birthday=datetime.date(1990, 1, 1),
+        )
+        product = Product.objects.create(
+            name="Клюшка",
+            category=Category.objects.create(name="Клюшки"),
+            brand=Brand.objects.create(name="Bauer"),
+        )
+        cls.variant = ProductVariant.objects.create(
+            product=product, size_value="S", base_price=Decimal("1500")
+        )
+
+    def _add(self, qty):
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.variant.id, qty=qty)
+
+    def test_client_summary_is_cached(self):
+        self._add(2)
+        self.assertEqual(client_cart_summary(self.client_obj)["count"], 2)
+        with self.assertNumQueries(0):
+            summary = client_cart_summary(self.client_obj)
+        self.assertEqual(summary["count"], 2)
+        self.assertEqual(summary["total"], "3000.00")
+
+    def test_cart_change_resets_client_summary(self):
+        self._add(2)
+        client_cart_summary(self.client_obj)
+        self._add(3)
+        summary = client_cart_summary(self.client_obj)
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["total"], "4500.00")
+
+    def test_catalog_change_resets_summary(self):
+        self._add(1)
+        client_cart_summary(self.client_obj)
+        bump_catalog_version()
+        with self.assertNumQueries(1):
+            client_cart_summary(self.client_obj)
+
+    def test_anon_cart_change_resets_anon_summary(self):
+        anon_cart_add(anon_id=self.anon_id, variant_id=self.variant.id, qty=1)
+        self.assertEqual(anon_cart_summary(self.anon_id)["count"], 1)
+        with self.assertNumQueries(0):
+            anon_cart_summary(self.anon_id)
+
+        anon_cart_add(anon_id=self.anon_id, variant_id=self.variant.id, qty=4)
+        summary = anon_cart_summary(self.anon_id)
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["total"], "6000.00")
+
+
+class RepeatOrderTest(TestCase):
+    """Повтор заказа: варианты не в наличии не переносятся, moved — число вариантов в черновике."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username="rep@example.com", password="pw")
+        cls.client_obj = Client.objects.create(
+            user=user,
+            surname="Петров",
+            name="Пётр",
+            phone_number="+79990000301",
+            birthday=datetime.date(1990, 1, 1),
+        )
+        product = Product.objects.create(
+            name="Коньки",
+            category=Category.objects.create(name="Коньки"),
+            brand=Brand.objects.create(name="CCM"),
+        )
+        cls.v1, cls.v2, cls.gone = (
+            ProductVariant.objects.create(
+                product=product, size_value=size, base_price=Decimal("1000")
+            )
+            for size in ("40", "41", "42")
+        )
+        cls.order = Cart.objects.create(client=cls.client_obj, is_ordered=True)
+        for variant, qty in ((cls.v1, 1), (cls.v2, 2), (cls.gone, 1)):
+            CartItem.objects.create(
+                cart=cls.order, product=product, product_variant=variant, quantity=qty
+            )
+        ProductVariant.objects.filter(pk=cls.gone.pk).update(is_active=False)
+
+    def test_repeat_skips_inactive_variants_and_counts_present_lines(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=1)
+            draft_id, moved = repeat_order_into_draft(
+                self.client_obj, from_cart_id=self.order.pk, merge_strategy="replace"
+            )
+        self.assertEqual(moved, 2)
+        items = dict(
+            CartItem.objects.filter(cart_id=draft_id).values_list(
+                "product_variant_id", "quantity"
+            )
+        )
+        self.assertEqual(items, {self.v1.id: 1, self.v2.id: 2})
+
+    def test_repeat_unknown_order(self):
+        self.assertIsNone(
+            repeat_order_into_draft(self.client_obj, from_cart_id=self.order.pk + 1000)
+        )
+
+
+class BulkMergeStrategiesTest(IsolatedRedisMixin, TestCase):
+    """
+    bulk_merge_into_cart поверх корзины с позициями v1=2, v2=5, v4=1;
+    входящие v1=3, v2=1, v3=1 и вариант не в наличии.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = _make_client("merge@example.com", "+79990000401")
+        cls.v1, cls.v2, cls.v3, cls.v4, cls.gone = _make_variants(100, 200, 300, 400, 500)
+        ProductVariant.objects.filter(pk=cls.gone.pk).update(is_active=False)
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            for variant, qty in ((self.v1, 2), (self.v2, 5), (self.v4, 1)):
+                db_cart_add_or_set(self.client_obj, variant_id=variant.id, qty=qty)
+        self.cart = get_or_create_draft_cart(self.client_obj)
+
+    def _merge(self, strategy):
+        incoming = {self.v1.id: 3, self.v2.id: 1, self.v3.id: 1, self.gone.id: 2}
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                written = bulk_merge_into_cart(self.cart, incoming, strategy=strategy)
+        self.cart.refresh_from_db()
+        return written, _cart_lines(self.cart.pk)
+
+    def _total(self, lines):
+        prices = {v.id: v.base_price for v in (self.v1, self.v2, self.v3, self.v4)}
+        return sum(prices[vid] * qty for vid, qty in lines.items())
+
+    def test_max(self):
+        written, lines = self._merge("max")
+        self.assertEqual(lines, {self.v1.id: 3, self.v2.id: 5, self.v3.id: 1, self.v4.id: 1})
+        self.assertEqual(written, 2)
+        self.assertEqual(self.cart.cart_total_sum, self._total(lines))
+
+    def test_sum(self):
+        written, lines = self._merge("sum")
+        self.assertEqual(lines, {self.v1.id: 5, self.v2.id: 6, self.v3.id: 1, self.v4.id: 1})
+        self.assertEqual(written, 3)
+        self.assertEqual(self.cart.cart_total_sum, self._total(lines))
+
+    def test_set(self):
+        written, lines = self._merge("set")
+        self.assertEqual(lines, {self.v1.id: 3, self.v2.id: 1, self.v3.id: 1, self.v4.id: 1})
+        self.assertEqual(written, 3)
+        self.assertEqual(self.cart.cart_total_sum, self._total(lines))
+
+    def test_replace_removes_other_lines(self):
+        written, lines = self._merge("replace")
+        self.assertEqual(lines, {self.v1.id: 3, self.v2.id: 1, self.v3.id: 1})
+        self.assertEqual(written, 3)
+        self.assertEqual(self.cart.cart_total_sum, self._total(lines))
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            bulk_merge_into_cart(self.cart, {self.v1.id: 1}, strategy="min")
+
+
+class CartDeltaTotalsTest(IsolatedRedisMixin, TestCase):
+    """Итог, поправленный дельтами, совпадает с полным пересчётом; reconcile чинит расхождение."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = _make_client("delta@example.com", "+79990000501")
+        cls.v1, cls.v2 = _make_variants("150.50", "99.90")
+
+    def _cart(self):
+        return get_or_create_draft_cart(self.client_obj)
+
+    def assertMatchesRecompute(self, expected):
+        cart = self._cart()
+        self.assertEqual(cart.cart_total_sum, Decimal(expected))
+        # полный пересчёт не находит, что исправлять
+        self.assertEqual(reconcile_cart_totals([cart.pk]), 0)
+
+    def test_add_change_remove(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=2)
+            db_cart_add_or_set(self.client_obj, variant_id=self.v2.id, qty=1)
+        self.assertMatchesRecompute("400.90")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=5)
+        self.assertMatchesRecompute("852.40")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_remove(self.client_obj, variant_id=self.v2.id)
+        self.assertMatchesRecompute("752.50")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=0)
+        self.assertMatchesRecompute("0.00")
+
+    def test_reconcile_repairs_drift(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=2)
+        cart = self._cart()
+        Cart.objects.filter(pk=cart.pk).update(cart_total_sum=Decimal("1.00"))
+
+        # по умолчанию проверяются все черновые корзины
+        self.assertEqual(reconcile_cart_totals(), 1)
+        cart.refresh_from_db()
+        self.assertEqual(cart.cart_total_sum, Decimal("301.00"))
+
+
+class CartBatchPatchTest(IsolatedRedisMixin, TestCase):
+    """PATCH /api/orders/items/: пачка операций применяется целиком или не применяется."""
+
+    URL = "/api/orders/items/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = _make_client("batch@example.com", "+79990000601")
+        cls.v1, cls.v2, cls.v3 = _make_variants("100", "250", "40")
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=1)
+            db_cart_add_or_set(self.client_obj, variant_id=self.v2.id, qty=2)
+        self.cart = get_or_create_draft_cart(self.client_obj)
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def _patch(self, ops):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.patch(self.URL, ops, format="json")
+
+    def test_ops_and_totals(self):
+        response = self._patch(
+            [
+                {"variant_id": self.v1.id, "qty": 3},
+                {"variant_id": self.v2.id, "qty": 0},
+                {"variant_id": self.v3.id, "qty": 5},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total"], "500.00")
+        self.assertEqual(
+            {it["variant_id"]: it["qty"] for it in response.json()["items"]},
+            {self.v1.id: 3, self.v3.id: 5},
+        )
+        self.assertEqual(_cart_lines(self.cart.pk), {self.v1.id: 3, self.v3.id: 5})
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.cart_total_sum, Decimal("500.00"))
+
+    def test_too_many_ops(self):
+        ops = [{"variant_id": self.v3.id, "qty": 1}] * (CART_BATCH_MAX_OPS + 1)
+        self.assertEqual(self._patch(ops).status_code, 400)
+        self.assertEqual(self._patch(ops[:CART_BATCH_MAX_OPS]).status_code, 200)
+
+    def test_invalid_op_rejects_whole_batch(self):
+        response = self._patch(
+            [{"variant_id": self.v3.id, "qty": 5}, {"variant_id": self.v1.id, "qty": "x"}]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(_cart_lines(self.cart.pk), {self.v1.id: 1, self.v2.id: 2})
+
+    def test_failure_mid_batch_rolls_back(self):
+        with mock.patch(
+            "apps.orders.services.mark_cart_dirty", side_effect=RuntimeError("boom")
+        ), self.assertRaises(RuntimeError):
+            db_cart_apply_ops(self.client_obj, {self.v3.id: 5, self.v2.id: 0})
+        self.assertEqual(_cart_lines(self.cart.pk), {self.v1.id: 1, self.v2.id: 2})
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.cart_total_sum, Decimal("600.00"))
+
+
+class DirtyCartRegistryTest(TestCase):
+    """Сигналы CartItem только отмечают корзину; пересчёт — один на корзину при коммите."""
+
+    @classmethod
+    def setUpTestData(cls):
+        client_obj = _make_client("dirty@example.com", "+79990000801")
+        cls.variants = _make_variants("10", "20", "30")
+        cls.product = cls.variants[0].product
+        cls.carts = [Cart.objects.create(client=client_obj) for _ in range(2)]
+
+    def _add_lines(self):
+        for cart in self.carts:
+            for variant in self.variants:
+                CartItem.objects.create(
+                    cart=cart, product=self.product, product_variant=variant, quantity=1
+                )
+
+    def test_bulk_block_recalculates_once_per_cart(self):
+        with mock.patch.object(recalc, "update_carts", wraps=recalc.update_carts) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                with suppress_cart_recalc():
+                    self._add_lines()
+                    CartItem.objects.get(cart=self.carts[0], product_variant=self.variants[0]).delete()
+                # до выхода из блока ничего не пересчитано
+                update.assert_not_called()
+        update.assert_called_once()
+        self.assertEqual(sorted(update.call_args.args[0]), [c.pk for c in self.carts])
+        totals = [Cart.objects.get(pk=c.pk).cart_total_sum for c in self.carts]
+        self.assertEqual(totals, [Decimal("50.00"), Decimal("60.00")])
+
+    def test_signals_without_block_also_coalesce(self):
+        with mock.patch.object(recalc, "update_carts", wraps=recalc.update_carts) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                self._add_lines()
+        update.assert_called_once()
+
+    def test_registry_is_per_thread(self):
+        seen = []
+        with suppress_cart_recalc():
+            self._add_lines()
+            worker = threading.Thread(target=lambda: seen.append(set(recalc._dirty())))
+            worker.start()
+            worker.join()
+            self.assertEqual(recalc._dirty(), {c.pk for c in self.carts})
+        self.assertEqual(seen, [set()])
+
+    def test_rolled_back_marks_do_not_reach_next_request(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            with suppress_cart_recalc():
+                self._add_lines()
+                raise RuntimeError("rollback")
+        self.assertTrue(recalc._dirty())
+        # любой запрос (request_started) начинает с чистого реестра
+        self.client.get("/__no_such_page__/")
+        self.assertEqual(recalc._dirty(), set())
+
+
+class CartViewCacheTest(IsolatedRedisMixin, TestCase):
+    """GET корзины ничего не пишет и отдаётся из Redis, пока версии корзины и каталога те же."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = _make_client("view@example.com", "+79990000901")
+        cls.v1, cls.v2 = _make_variants("100", "70")
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v1.id, qty=2)
+
+    def test_cached_read_is_one_query(self):
+        self.assertEqual(build_db_cart_response(self.client_obj)["total"], "200.00")
+        # только версия корзины; ни записи, ни пересборки
+        with self.assertNumQueries(1):
+            self.assertEqual(build_db_cart_response(self.client_obj)["total"], "200.00")
+
+    def test_cart_change_invalidates(self):
+        build_db_cart_response(self.client_obj)
+        with self.captureOnCommitCallbacks(execute=True):
+            db_cart_add_or_set(self.client_obj, variant_id=self.v2.id, qty=1)
+        data = build_db_cart_response(self.client_obj)
+        self.assertEqual(data["total"], "270.00")
+        self.assertEqual(len(data["items"]), 2)
+
+    def test_catalog_price_change_invalidates(self):
+        build_db_cart_response(self.client_obj)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.v1.base_price = Decimal("120")
+            self.v1.save()
+        self.assertEqual(build_db_cart_response(self.client_obj)["total"], "240.00")
+
+    def test_catalog_version_bump_invalidates(self):
+        build_db_cart_response(self.client_obj)
+        bump_catalog_version()
+        with self.assertNumQueries(2):
+            build_db_cart_response(self.client_obj)
@@ -6,20 +6,24 @@ from .views import (
     CartMergeView,
     CartRepeatView,
     CartRetrieveView,
+    CartSummaryView,
     OrderDetailView,
     OrderHistoryView,
+    OrderRepeatView,
 )
 
 app_name = "orders"
 
 urlpatterns = [
     path("", CartRetrieveView.as_view(), name="cart_retrieve"),
+    path("summary/", CartSummaryView.as_view(), name="cart_summary"),
     path("items/", CartItemSetView.as_view(), name="cart_item_set"),
     path(
         "items/<int:variant_id>/", CartItemDeleteView.as_view(), name="cart_item_delete"
     ),
     path("merge/", CartMergeView.as_view(), name="cart_merge"),
     path("cart/repeat/<int:order_id>/", CartRepeatView.as_view(), name="cart_repeat"),
+    path("repeat/<int:order_id>/", OrderRepeatView.as_view(), name="order_repeat"),
     path("history/", OrderHistoryView.as_view(), name="order_history"),
     path(
         "history/<int:order_id>/",
@@ -1,6 +1,8 @@
 from decimal import Decimal
 
 from apps.orders.models import Cart, CartItem
+from apps.products.cards import variant_cards
+from apps.products.pagination import KeysetPagination, keyset_requested
 from apps.products.services import get_request_client_or_raise
 from django.conf import settings
 from drf_yasg import openapi
@@ -11,20 +13,27 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .selectors import cart_items_qs, get_or_create_draft_cart
 from .services import (
+    CART_MERGE_STRATEGIES,
+    CartLineLimitExceeded,
     anon_cart_add,
+    anon_cart_apply_ops,
     anon_cart_items,
     anon_cart_remove,
+    anon_cart_summary,
     build_cart_response_from_ids,
     build_db_cart_response,
-    cart_recalculate,
+    cart_item_from_card,
+    client_cart_summary,
     db_cart_add_or_set,
+    db_cart_apply_ops,
     db_cart_remove,
     merge_anon_cart_into_db_cart,
     repeat_order_into_draft,
 )
 
+CART_BATCH_MAX_OPS = 100
+
 
 def _anon_header_name() -> str:
     cfg = getattr(settings, "RECENTLY_VIEWED", None)
@@ -46,6 +55,23 @@ class CartRetrieveView(APIView):
         return Response({"items": items, "total": total}, status=status.HTTP_200_OK)
 
 
+class CartSummaryView(APIView):
+    """
+    Бейдж в шапке: {count, total, version} без построения списка позиций.
+    Обычно — один MGET в Redis (см. apps/orders/summary.py).
+    """
+
+    permission_classes = [AllowAny]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request):
+        if request.user.is_authenticated and hasattr(request.user, "client"):
+            data = client_cart_summary(request.user.client)
+        else:
+            data = anon_cart_summary(request.headers.get(_anon_header_name()))
+        return Response(data, status=status.HTTP_200_OK)
+
+
 class CartItemSetView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = [JWTAuthentication]
@@ -91,6 +117,11 @@ class CartItemSetView(APIView):
                 qty_map = anon_cart_items(user_id=None, anon_id=anon_id)
                 items, total = build_cart_response_from_ids(qty_map)
                 data = {"items": items, "total": total}
+        except CartLineLimitExceeded:
+            return Response(
+                {"detail": f"cart_lines_limit: {settings.ANON_CART['MAX_LINES']}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         except Exception as e:
             import logging
 
@@ -102,6 +133,67 @@ class CartItemSetView(APIView):
 
         return Response(data, status=status.HTTP_200_OK)
 
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                required=["variant_id", "qty"],
+                properties={
+                    "variant_id": openapi.Schema(type=openapi.TYPE_INTEGER, example=42),
+                    "qty": openapi.Schema(type=openapi.TYPE_INTEGER, example=2),
+                },
+            ),
+        )
+    )
+    def patch(self, request):
+        """
+        Пачка операций [{variant_id, qty}, ...] одним запросом (qty = 0 — удалить).
+        Применяется атомарно, в ответе — итоговая корзина.
+        """
+        ops = request.data.get("items") if isinstance(request.data, dict) else request.data
+        if not isinstance(ops, list) or not ops:
+            return Response(
+                {"detail": "list of {variant_id, qty} required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ops) > CART_BATCH_MAX_OPS:
+            return Response(
+                {"detail": f"at most {CART_BATCH_MAX_OPS} operations per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        qty_by_variant: dict[int, int] = {}
+        try:
+            for op in ops:
+                # повтор одного variant_id — побеждает последняя операция
+                qty_by_variant[int(op["variant_id"])] = max(int(op["qty"]), 0)
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {"detail": "variant_id and qty must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        client = getattr(request.user, "client", None)
+        if request.user.is_authenticated and client is not None:
+            db_cart_apply_ops(client, qty_by_variant)
+            return Response(build_db_cart_response(client), status=status.HTTP_200_OK)
+
+        anon_id = request.headers.get(_anon_header_name())
+        if not anon_id:
+            return Response(
+                {"detail": f"header {_anon_header_name()} required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            qty_map = anon_cart_apply_ops(anon_id=anon_id, ops=qty_by_variant)
+        except CartLineLimitExceeded:
+            return Response(
+                {"detail": f"cart_lines_limit: {settings.ANON_CART['MAX_LINES']}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        items, total = build_cart_response_from_ids(qty_map)
+        return Response({"items": items, "total": total}, status=status.HTTP_200_OK)
+
 
 class CartItemDeleteView(APIView):
     permission_classes = [AllowAny]
@@ -132,7 +224,15 @@ class CartMergeView(APIView):
             return Response(
                 {"detail": f"header {_anon_header_name()} required"}, status=400
             )
-        merge_anon_cart_into_db_cart(client=request.user.client, anon_id=anon_id)
+        strategy = request.data.get("strategy") or "max"
+        if strategy not in CART_MERGE_STRATEGIES:
+            return Response(
+                {"detail": f"strategy must be one of {', '.join(CART_MERGE_STRATEGIES)}"},
+                status=400,
+            )
+        merge_anon_cart_into_db_cart(
+            client=request.user.client, anon_id=anon_id, strategy=strategy
+        )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -156,11 +256,12 @@ class CartRepeatView(APIView):
         if not client:
             return Response({"detail": "client profile required"}, status=409)
 
-        moved = repeat_order_into_draft(
+        result = repeat_order_into_draft(
             client,
             from_cart_id=order_id,
             merge_strategy="replace",
         )
+        moved = result[1] if result else 0
         return Response({"moved": moved}, status=status.HTTP_200_OK)
 
 
@@ -180,6 +281,12 @@ class OrderHistoryView(APIView):
             "-ordered_at", "-pk"
         )
 
+        # ?pagination=cursor — keyset-страницы без COUNT(*); иначе весь список, как раньше
+        paginator = None
+        if keyset_requested(request):
+            paginator = KeysetPagination()
+            carts = paginator.paginate_queryset(carts, request, view=self)
+
         data = []
         for c in carts:
             data.append(
@@ -191,6 +298,8 @@ class OrderHistoryView(APIView):
                 }
             )
 
+        if paginator is not None:
+            return paginator.get_paginated_response(data)
         return Response(data, status=status.HTTP_200_OK)
 
 
@@ -232,39 +341,25 @@ class OrderDetailView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        # собираем позиции заказа
+        # собираем позиции заказа: фрагменты вариантов — из кэша карточек одним MGET
+        lines = list(
+            CartItem.objects.filter(cart=cart).values_list(
+                "product_variant_id", "quantity"
+            )
+        )
+        cards = variant_cards(vid for vid, _ in lines)
+
         items_data = []
         total = Decimal("0.00")
-
-        for ci in cart_items_qs(cart):
-            v = ci.product_variant
-            p = v.product
-
-            price = v.current_price or v.price or Decimal("0")
-            line_total = price * Decimal(ci.quantity or 0)
+        for vid, qty in lines:
+            card = cards.get(vid)
+            if card is None:
+                continue
+            item, line_total = cart_item_from_card(card, qty or 0)
+            # в деталях заказа категория не отдавалась
+            item["product"].pop("category", None)
             total += line_total
-
-            items_data.append(
-                {
-                    "variant_id": v.id,
-                    "qty": ci.quantity,
-                    "price": f"{price:.2f}",
-                    "line_total": f"{line_total:.2f}",
-                    "variant": {
-                        "size_type": v.size_type,
-                        "size_value": v.size_value,
-                        "color": v.color,
-                        "in_stock": v.is_active,
-                        "is_order": getattr(v, "is_order", False),
-                    },
-                    "product": {
-                        "slug": p.slug,
-                        "name": p.name,
-                        "image": (p.image.url if getattr(p, "image", None) else None),
-                        "brand": (p.brand.name if p.brand_id else None),
-                    },
-                }
-            )
+            items_data.append(item)
 
         # если cart_total_sum не заполнено — берём посчитанный total
         cart_total = cart.cart_total_sum or total
@@ -295,40 +390,20 @@ class OrderRepeatView(APIView):
     def post(self, request, order_id, *args, **kwargs):
         client = get_request_client_or_raise(request)
 
-        try:
-            source_cart = Cart.objects.get(
-                pk=order_id,
-                client=client,
-                is_ordered=True,
-            )
-        except Cart.DoesNotExist:
+        # черновая корзина очищается и заполняется позициями заказа
+        result = repeat_order_into_draft(
+            client,
+            from_cart_id=order_id,
+            merge_strategy="replace",
+        )
+        if result is None:
             return Response(
                 {"detail": "order_not_found"},
                 status=status.HTTP_404_NOT_FOUND,
             )
-
-        # берём / создаём черновую корзину
-        draft = get_or_create_draft_cart(client)
-
-        # ОЧИЩАЕМ черновую корзину, чтобы не мешались старые товары
-        CartItem.objects.filter(cart=draft).delete()
-        draft.promo_code = None
-        draft.bonus_spent = Decimal("0")
-        draft.cart_total_sum = Decimal("0")
-        draft.save(update_fields=["promo_code", "bonus_spent", "cart_total_sum"])
-
-        # копируем позиции из оформленного заказа
-        for item in CartItem.objects.filter(cart=source_cart):
-            CartItem.objects.create(
-                cart=draft,
-                product_variant=item.product_variant,
-                quantity=item.quantity,
-            )
-
-        # пересчитываем сумму черновой корзины
-        cart_recalculate(draft)
+        draft_id, _ = result
 
         return Response(
-            {"cart_id": draft.id},
+            {"cart_id": draft_id},
             status=status.HTTP_200_OK,
         )
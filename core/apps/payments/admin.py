@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.admin import DateFieldListFilter
-from .models import Payment
+from .models import Payment, WebhookInbox
 
 
 @admin.register(Payment)
@@ -30,3 +30,40 @@ class PaymentAdmin(admin.ModelAdmin):
         "created_at",
         "updated_at",
     )
+
+
+@admin.register(WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "payment_id",
+        "received_at",
+        "processed_at",
+        "attempts",
+        "next_attempt_at",
+        "failed_at",
+    )
+    search_fields = ("payment_id",)
+    list_filter = (
+        ("received_at", DateFieldListFilter),
+        ("failed_at", admin.EmptyFieldListFilter),
+    )
+    readonly_fields = (
+        "id",
+        "payload",
+        "dedup_hash",
+        "payment_id",
+        "received_at",
+        "processed_at",
+        "attempts",
+        "next_attempt_at",
+        "failed_at",
+        "last_error",
+    )
+    actions = ["requeue"]
+
+    @admin.action(description="Вернуть в очередь (сбросить попытки)")
+    def requeue(self, request, queryset):
+        queryset.filter(processed_at__isnull=True).update(
+            failed_at=None, next_attempt_at=None, attempts=0
+        )
@@ -1,16 +1,44 @@
 from __future__ import annotations
 from typing import Any, Dict, Optional
 from django.conf import settings
+import asyncio
 import hashlib
 import json
+import random
+import threading
+import weakref
 import requests
+from requests.adapters import HTTPAdapter
 
 
-class TBankClient:
+# Общий пул соединений на процесс: keep-alive к банку переживает запросы,
+# и каждый вызов не платит за новый TCP+TLS handshake.
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _shared_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                cfg = settings.T_BANK_HTTP
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=cfg["MAX_CONNECTIONS"]
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+class _TBankBase:
+    """Конфиг, подпись и сборка тел запросов — общие для sync и async клиентов."""
+
     def __init__(self, *, base_url: Optional[str] = None, terminal_key: Optional[str] = None,
                  password: Optional[str] = None, success_url: Optional[str] = None,
-                 fail_url: Optional[str] = None, notification_url: Optional[str] = None,
-                 session: Optional[requests.Session] = None) -> None:
+                 fail_url: Optional[str] = None, notification_url: Optional[str] = None) -> None:
         cfg = settings.T_BANK
         self.base_url = base_url or cfg["BASE_URL"]
         self.terminal_key = terminal_key or cfg["TERMINAL_KEY"]
@@ -20,8 +48,6 @@ class TBankClient:
         self.fail_url = fail_url or cfg.get("FAIL_URL")
         self.notification_url = notification_url or cfg.get("NOTIFICATION_URL")
 
-        self.session = session or requests.Session()
-
     def _make_token(self, payload: Dict[str, Any]) -> str:
         flat: Dict[str, Any] = {}
 
@@ -40,26 +66,11 @@ class TBankClient:
         raw = "".join(str(v) for k, v in sorted(flat.items()))
         return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-    def _post(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        url = f"{self.base_url.rstrip('/')}/{method.lstrip('/')}"
-        try:
-            r = self.session.post(url, json=payload, timeout=15)
-            try:
-                data = r.json()
-            except json.JSONDecodeError:
-                data = {"raw_text": r.text}
-            if r.status_code != 200:
-                data.setdefault("Success", False)
-                data["http_status"] = r.status_code
-                data["http_error"] = getattr(r, "reason", "")
-                data["url"] = url
-            else:
-                data["url"] = url
-            return data
-        except Exception as e:
-            return {"Success": False, "http_error": str(e), "url": url}
+    def _url(self, method: str) -> str:
+        return f"{self.base_url.rstrip('/')}/{method.lstrip('/')}"
 
-    def init(self, *, amount: int, order_id: str, description: str = "", data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _init_payload(self, *, amount: int, order_id: str, description: str = "",
+                      data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         payload: Dict[str, Any] = {
             "TerminalKey": self.terminal_key,
             "Amount": amount,
@@ -80,13 +91,137 @@ class TBankClient:
             payload["DATA"] = data
 
         payload["Token"] = self._make_token(payload)
-        return self._post("Init", payload)
+        return payload
 
-    def get_state(self, *, order_id: Optional[str] = None, payment_id: Optional[str] = None) -> Dict[str, Any]:
+    def _get_state_payload(self, *, order_id: Optional[str] = None,
+                           payment_id: Optional[str] = None) -> Dict[str, Any]:
         payload: Dict[str, Any] = {"TerminalKey": self.terminal_key}
         if payment_id:
             payload["PaymentId"] = payment_id
         if order_id:
             payload["OrderId"] = order_id
         payload["Token"] = self._make_token(payload)
-        return self._post("GetState", payload)
\ No newline at end of file
+        return payload
+
+    @staticmethod
+    def _parse(url: str, status_code: int, reason: str, text: str) -> Dict[str, Any]:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = {"raw_text": text}
+        if status_code != 200:
+            data.setdefault("Success", False)
+            data["http_status"] = status_code
+            data["http_error"] = reason
+        data["url"] = url
+        return data
+
+
+class TBankClient(_TBankBase):
+    def __init__(self, *, session: Optional[requests.Session] = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.session = session or _shared_session()
+
+    def _post(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        url = self._url(method)
+        try:
+            r = self.session.post(url, json=payload, timeout=settings.T_BANK_HTTP["TIMEOUT"])
+            return self._parse(url, r.status_code, getattr(r, "reason", ""), r.text)
+        except Exception as e:
+            return {"Success": False, "http_error": str(e), "url": url}
+
+    def init(self, *, amount: int, order_id: str, description: str = "", data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self._post("Init", self._init_payload(
+            amount=amount, order_id=order_id, description=description, data=data
+        ))
+
+    def get_state(self, *, order_id: Optional[str] = None, payment_id: Optional[str] = None) -> Dict[str, Any]:
+        return self._post("GetState", self._get_state_payload(order_id=order_id, payment_id=payment_id))
+
+
+# -----------------------------
+# asyncio-клиент (ASGI)
+# -----------------------------
+# httpx.AsyncClient и семафор привязаны к event loop, поэтому пул — один на loop
+# (в ASGI-процессе он один). Семафор ограничивает одновременные запросы к банку;
+# дедлайн вызова покрывает и ожидание семафора, и все повторы.
+
+_async_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+# ошибки, после которых идемпотентный запрос можно повторить
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _async_pool():
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        import httpx  # только для ASGI-развёртываний
+
+        cfg = settings.T_BANK_HTTP
+        client = httpx.AsyncClient(
+            timeout=cfg["TIMEOUT"],
+            limits=httpx.Limits(
+                max_connections=cfg["MAX_CONNECTIONS"],
+                max_keepalive_connections=cfg["MAX_CONNECTIONS"],
+                keepalive_expiry=cfg["KEEPALIVE_SECONDS"],
+            ),
+        )
+        pool = (client, asyncio.Semaphore(cfg["CONCURRENCY"]))
+        _async_pools[loop] = pool
+    return pool
+
+
+class AsyncTBankClient(_TBankBase):
+    """
+    То же API, что у TBankClient, но корутины. GetState идемпотентен и повторяется
+    с экспоненциальной задержкой и full jitter; Init не повторяется (его повтор —
+    это новый платёж, см. create_or_get_payment_for_cart).
+    """
+
+    async def _post(self, method: str, payload: Dict[str, Any], *, retries: int = 0,
+                    deadline: Optional[float] = None) -> Dict[str, Any]:
+        cfg = settings.T_BANK_HTTP
+        url = self._url(method)
+        client, semaphore = _async_pool()
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + (deadline or cfg["DEADLINE_SECONDS"])
+
+        attempt = 0
+        while True:
+            result: Dict[str, Any]
+            retryable = False
+            try:
+                async with asyncio.timeout_at(deadline_at):
+                    async with semaphore:
+                        r = await client.post(url, json=payload)
+                result = self._parse(url, r.status_code, r.reason_phrase, r.text)
+                retryable = r.status_code in _RETRY_STATUSES
+            except TimeoutError:
+                return {"Success": False, "http_error": "deadline exceeded", "url": url}
+            except Exception as e:
+                result = {"Success": False, "http_error": str(e), "url": url}
+                retryable = True
+
+            if not retryable or attempt >= retries:
+                return result
+            delay = random.uniform(0, cfg["BACKOFF_SECONDS"] * 2 ** attempt)
+            if loop.time() + delay >= deadline_at:
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def init(self, *, amount: int, order_id: str, description: str = "",
+                   data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self._post("Init", self._init_payload(
+            amount=amount, order_id=order_id, description=description, data=data
+        ))
+
+    async def get_state(self, *, order_id: Optional[str] = None, payment_id: Optional[str] = None,
+                        deadline: Optional[float] = None) -> Dict[str, Any]:
+        return await self._post(
+            "GetState",
+            self._get_state_payload(order_id=order_id, payment_id=payment_id),
+            retries=settings.T_BANK_HTTP["RETRIES"],
+            deadline=deadline,
+        )
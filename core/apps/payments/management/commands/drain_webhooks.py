@@ -0,0 +1,41 @@
+import time
+
+from apps.payments.services import drain_webhook_inbox, webhook_inbox_stats
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = "Обрабатывать WebhookInbox пачками (по порядку внутри каждого PaymentId)"
+
+    def add_arguments(self, parser):
+        cfg = settings.WEBHOOK_INBOX
+        parser.add_argument("--once", action="store_true", help="одна пачка и выход")
+        parser.add_argument("--batch", type=int, default=cfg["BATCH"])
+        parser.add_argument(
+            "--stats", action="store_true", help="только показать очередь и задержку"
+        )
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            stats = webhook_inbox_stats()
+            self.stdout.write(" ".join(f"{k}={v}" for k, v in stats.items()))
+            return
+
+        poll = settings.WEBHOOK_INBOX["POLL_SECONDS"]
+        while True:
+            # как в poll_payments: не держим оборванное соединение с БД
+            close_old_connections()
+            stats = drain_webhook_inbox(batch=options["batch"])
+            if stats["processed"] or stats["failed"] or options["once"]:
+                self.stdout.write(
+                    f"processed={stats['processed']} failed={stats['failed']} "
+                    f"deferred={stats['deferred']}"
+                )
+            if options["once"]:
+                return
+            # неполная пачка — очередь разобрана, ждём новых уведомлений;
+            # отложенные не в счёт, иначе пачка из них крутит цикл без паузы
+            if stats["processed"] + stats["failed"] < options["batch"]:
+                time.sleep(poll)
@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from apps.payments.services import apoll_pending_payments
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Опрашивать T-Bank по незавершённым платежам (NEW / FORM_SHOWED / AUTHORIZING) "
+        "и применять переходы статусов"
+    )
+
+    def add_arguments(self, parser):
+        cfg = settings.PAYMENT_POLLER
+        parser.add_argument("--once", action="store_true", help="один проход и выход")
+        parser.add_argument("--batch", type=int, default=cfg["BATCH"])
+        parser.add_argument("--concurrency", type=int, default=cfg["CONCURRENCY"])
+
+    def handle(self, *args, **options):
+        # один event loop на всё время работы — пул соединений к банку переиспользуется
+        asyncio.run(self._run(options))
+
+    async def _run(self, options):
+        interval = settings.PAYMENT_POLLER["INTERVAL_SECONDS"]
+        while True:
+            started = time.monotonic()
+            # процесс живёт долго: соединение с БД, оборванное рестартом или
+            # idle-таймаутом, закрываем — ORM откроет новое
+            await sync_to_async(close_old_connections)()
+            stats = await apoll_pending_payments(
+                batch=options["batch"], concurrency=options["concurrency"]
+            )
+            self.stdout.write(
+                f"polled={stats['polled']} changed={stats['changed']} errors={stats['errors']}"
+            )
+            if options["once"]:
+                return
+            # полная пачка — значит, есть ещё: следующий проход без паузы
+            if stats["polled"] < options["batch"]:
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
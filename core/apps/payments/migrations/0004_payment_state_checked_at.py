@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_alter_payment_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='state_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_webhookinbox'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='webhookinbox',
+            name='payments_inbox_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='webhookinbox',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('processed_at__isnull', True)), fields=['id'], name='payments_inbox_pending_idx'),
+        ),
+    ]
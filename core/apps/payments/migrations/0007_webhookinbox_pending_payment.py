@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_webhookinbox_backoff'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhookinbox',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('processed_at__isnull', True)), fields=['payment_id', 'id'], name='payments_inbox_pending_pay_idx'),
+        ),
+    ]
@@ -38,6 +38,11 @@ class Payment(models.Model):
         blank=True,
         null=True,
     )
+    # когда статус последний раз сверяли с банком (poller, webhook, GetState)
+    state_checked_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
     )
@@ -57,4 +62,66 @@ class Payment(models.Model):
         ]
     
     def __str__(self):
-        return f'Payment №{self.pk} cart={self.cart_id} status={self.status}'
\ No newline at end of file
+        return f'Payment №{self.pk} cart={self.cart_id} status={self.status}'
+
+class WebhookInbox(models.Model):
+    """
+    Входящие уведомления T-Bank: вьюха только проверяет подпись и дописывает сюда
+    (повтор того же уведомления отсекается по dedup_hash), обработка — drain_webhooks.
+    """
+
+    payload = models.JSONField()
+    dedup_hash = models.CharField(
+        max_length=64,
+        unique=True,
+    )
+    payment_id = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+    )
+    received_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+    processed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+    )
+    # после ошибки — не раньше этого времени (экспоненциальная пауза)
+    next_attempt_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+    # исчерпаны попытки: отложено в сторону до ручного разбора (не обработано)
+    failed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+    last_error = models.TextField(
+        blank=True,
+        default="",
+    )
+
+    class Meta:
+        verbose_name = 'Входящий webhook'
+        verbose_name_plural = 'Входящие webhooks'
+        indexes = [
+            # очередь на обработку: только необработанные, по порядку поступления
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True, failed_at__isnull=True),
+                name="payments_inbox_pending_idx",
+            ),
+            # порядок внутри платежа: есть ли у него более раннее необработанное
+            models.Index(
+                fields=["payment_id", "id"],
+                condition=models.Q(processed_at__isnull=True, failed_at__isnull=True),
+                name="payments_inbox_pending_pay_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f'Webhook №{self.pk} payment={self.payment_id or "-"}'
@@ -1,17 +1,28 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
+import logging
 import time
 import uuid
+from datetime import timedelta
 from decimal import ROUND_HALF_UP, Decimal
 from typing import Any, Dict, Optional
 
+from apps.orders.events import publish_cart_event
 from apps.orders.models import Cart, CartItem
 from apps.orders.services import order_mark_paid_by_id
-from apps.payments.clients import TBankClient
-from apps.payments.models import Payment
+from apps.payments.clients import AsyncTBankClient, TBankClient
+from apps.payments.models import Payment, WebhookInbox
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Exists, F, Min, OuterRef, Q
 from django.utils import timezone
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
 
 # --- helpers ---
 
@@ -80,20 +91,31 @@ def _new_order_id(cart: Cart) -> str:
 # --- T-Bank operations ---
 
 
+# Локальный статус зарезервированного платежа, для которого ещё идёт Init в банке
+STATUS_INITIATING = "INITIATING"
+ALIVE_STATUSES = ("NEW", "FORM_SHOWED", "AUTHORIZING")
+
+
+class PaymentInitInProgress(Exception):
+    """Init для этой корзины уже выполняется другим запросом и не успел завершиться."""
+
+
+def _payment_is_ready(payment: Payment, amount: int) -> bool:
+    return (
+        payment.status in ALIVE_STATUSES
+        and payment.amount == amount
+        and bool(payment.payment_url and payment.payment_id)
+    )
+
+
 @transaction.atomic
-def create_or_get_payment_for_cart(cart: Cart) -> Payment:
+def _reserve_payment(cart: Cart) -> tuple[Payment, bool]:
     """
-    Идемпотентно: получаем существующий "живой" платеж или создаём новый и вызываем Init.
-
-    Логика:
-    - корзина должна быть не пустой и с суммой > 0;
-    - считаем текущую сумму корзины;
-    - считаем amount в копейках;
-    - если есть живой Payment с ТАКОЙ ЖЕ amount — переиспользуем его;
-    - если живой Payment есть, но amount отличается — помечаем старый как REJECTED
-      и создаём новый платёж в T-Bank.
+    Фаза 1 (короткая транзакция, без HTTP): под блокировкой корзины находим живой
+    платёж или резервируем новый со статусом INITIATING.
+    Возвращает (payment, created): created=False — готовый или уже идущий платёж.
     """
-    cart.refresh_from_db()
+    cart = Cart.objects.select_for_update().get(pk=cart.pk)
 
     # проверяем, что в корзине есть позиции
     if not CartItem.objects.filter(cart=cart).exists():
@@ -104,56 +126,115 @@ def create_or_get_payment_for_cart(cart: Cart) -> Payment:
     if total <= 0:
         raise ValueError("Сумма платежа должна быть > 0")
 
-    # сумма в копейках для T-Bank и для поля Payment.amount (как у тебя и было)
+    # сумма в копейках для T-Bank и для поля Payment.amount
     amount = _to_kopecks(total)
 
-    alive_statuses = ["NEW", "FORM_SHOWED", "AUTHORIZING"]
-
-    # пытаемся найти живой платёж для ЭТОЙ корзины
+    stale_before = timezone.now() - timedelta(
+        seconds=settings.T_BANK["INIT_STALE_SECONDS"]
+    )
     payment = (
-        Payment.objects.select_for_update()
-        .filter(cart_id=cart.id, status__in=alive_statuses)
+        Payment.objects.filter(
+            cart_id=cart.id, status__in=(*ALIVE_STATUSES, STATUS_INITIATING)
+        )
         .order_by("-id")
         .first()
     )
-
     if payment:
-        # если сумма совпадает и есть URL/ID — считаем платёж актуальным
-        if payment.amount == amount and payment.payment_url and payment.payment_id:
-            return payment
+        if _payment_is_ready(payment, amount):
+            return payment, False
+        if (
+            payment.status == STATUS_INITIATING
+            and payment.amount == amount
+            and payment.updated_at >= stale_before
+        ):
+            # Init уже идёт в другом запросе — присоединяемся к нему
+            return payment, False
 
-        # иначе считаем старый платёж неактуальным (сумма изменилась,
-        # либо он был создан со старыми токенами и т.п.)
-        payment.status = "REJECTED"
-        payment.save(update_fields=["status"])
+        # иначе старый платёж неактуален (сумма изменилась, попытка брошена и т.п.)
+        Payment.objects.filter(pk=payment.pk, status=payment.status).update(
+            status="REJECTED", updated_at=timezone.now()
+        )
 
-    # создаём НОВЫЙ платёж
-    order_id = _new_order_id(cart)
     payment = Payment.objects.create(
         cart_id=cart.id,
         amount=amount,
-        order_id=order_id,
-        status="NEW",
+        order_id=_new_order_id(cart),
+        status=STATUS_INITIATING,
     )
+    return payment, True
 
-    client = TBankClient()
-    init_resp = client.init(
-        amount=amount,
-        order_id=order_id,
-        description=f"Оплата корзины #{cart.id}",
-    )
-    payment.raw_init_resp = init_resp
 
+def _finalize_payment(payment: Payment, init_resp: Dict[str, Any]) -> Payment:
+    """
+    Фаза 3: compare-and-set из INITIATING. Если резерв за это время перехватили
+    (признан брошенным и заменён) — результат этой попытки не записываем.
+    """
     if init_resp.get("Success"):
-        payment.payment_id = str(init_resp.get("PaymentId") or "") or None
-        payment.payment_url = init_resp.get("PaymentURL") or init_resp.get("PaymentUrl")
-        payment.save(update_fields=["raw_init_resp", "payment_id", "payment_url"])
+        fields = {
+            "status": "NEW",
+            "payment_id": str(init_resp.get("PaymentId") or "") or None,
+            "payment_url": init_resp.get("PaymentURL") or init_resp.get("PaymentUrl"),
+        }
+    else:
+        fields = {"status": "REJECTED"}
+
+    updated = Payment.objects.filter(pk=payment.pk, status=STATUS_INITIATING).update(
+        raw_init_resp=init_resp, updated_at=timezone.now(), **fields
+    )
+    payment.refresh_from_db()
+    if not updated:
+        raise PaymentInitInProgress(f"payment {payment.pk} was superseded")
+    if not init_resp.get("Success"):
+        raise RuntimeError(f"T-Bank Init error: {init_resp}")
+    return payment
+
+
+def _wait_for_inflight(payment: Payment) -> Payment:
+    """Повторный запрос ждёт чужую попытку Init, не держа блокировок."""
+    deadline = time.monotonic() + settings.T_BANK["INIT_WAIT_SECONDS"]
+    delay = 0.1
+    while True:
+        payment.refresh_from_db()
+        if payment.status != STATUS_INITIATING:
+            break
+        if time.monotonic() >= deadline:
+            raise PaymentInitInProgress(f"payment {payment.pk} init is in progress")
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+    if payment.status in ALIVE_STATUSES and payment.payment_url:
+        return payment
+    raise RuntimeError(f"T-Bank Init error: {payment.raw_init_resp}")
+
+
+def create_or_get_payment_for_cart(cart: Cart) -> Payment:
+    """
+    Идемпотентно: получаем существующий "живой" платеж или создаём новый и вызываем Init.
+
+    Запрос к банку (до 15 с) идёт вне транзакции, поэтому соединение с БД
+    и блокировки на время HTTP не удерживаются:
+    1) _reserve_payment — короткая транзакция: готовый платёж с той же суммой
+       переиспользуем, иначе резервируем новый (INITIATING);
+    2) TBankClient.init — без транзакции;
+    3) _finalize_payment — compare-and-set из INITIATING.
+    Параллельный повтор для той же корзины не создаёт второй платёж, а ждёт
+    результата идущей попытки (_wait_for_inflight).
+    """
+    payment, created = _reserve_payment(cart)
+    if not created:
+        if payment.status == STATUS_INITIATING:
+            return _wait_for_inflight(payment)
         return payment
 
-    # ошибка инициализации — помечаем REJECTED и кидаем исключение
-    payment.status = "REJECTED"
-    payment.save(update_fields=["raw_init_resp", "status"])
-    raise RuntimeError(f"T-Bank Init error: {init_resp}")
+    try:
+        init_resp = TBankClient().init(
+            amount=int(payment.amount),
+            order_id=payment.order_id,
+            description=f"Оплата корзины #{cart.id}",
+        )
+    except Exception as e:
+        init_resp = {"Success": False, "http_error": str(e)}
+    return _finalize_payment(payment, init_resp)
 
 
 def get_state_by_order(order_id: str, payment_id: Optional[str] = None) -> dict:
@@ -178,6 +259,265 @@ def get_state_by_order(order_id: str, payment_id: Optional[str] = None) -> dict:
     return resp
 
 
+async def aget_state_by_order(order_id: str) -> dict:
+    """get_state_by_order для async-вьюх: пул AsyncTBankClient, тот же fallback."""
+    client = AsyncTBankClient()
+    resp = await client.get_state(order_id=order_id)
+    if resp.get("Success") is True or resp.get("ErrorCode") != "201":
+        return resp
+
+    pay = await Payment.objects.filter(order_id=order_id).order_by("-id").afirst()
+    if pay and pay.payment_id:
+        return await client.get_state(payment_id=str(pay.payment_id))
+    return resp
+
+
+# --- локальное состояние платежа: poller + ответы фронту ---
+# Статусные ручки отвечают из Payment; банк спрашиваем, только если состояние
+# «незавершённого» платежа давно не сверялось (poller обычно успевает раньше).
+
+PAID_STATUSES = ("CONFIRMED", "AUTHORIZED")
+
+
+def _bank_state_ok(state: Dict[str, Any]) -> bool:
+    """Ответ банка по существу (а не сетевая ошибка клиента)."""
+    return "http_error" not in state and bool(state.get("Status"))
+
+
+# статусы, после которых платёж уже не изменится (SSE-поток закрывается)
+FINAL_STATUSES = ("CONFIRMED", "REJECTED", "CANCELED", "DEADLINE_EXPIRED",
+                  "AUTH_FAIL", "REVERSED", "REFUNDED", "PARTIAL_REFUNDED")
+
+
+def _publish_payment_event(payment: Payment) -> None:
+    """
+    Уведомить подписчиков корзины о новом статусе (после коммита). Вызывать
+    до save(): post_save Payment может сам оформить заказ, а событие платежа
+    должно прийти раньше события заказа.
+    """
+    event = {
+        "type": "payment",
+        "status": str(payment.status or ""),
+        "payment_id": payment.payment_id,
+        "order_id": payment.order_id,
+    }
+    transaction.on_commit(lambda: publish_cart_event(payment.cart_id, event))
+
+
+def _status_can_move(current: str, new: str) -> bool:
+    """Финальный статус не откатывается к незавершённому (запоздавший ответ банка)."""
+    return not (str(current or "").upper() in FINAL_STATUSES and new.upper() not in FINAL_STATUSES)
+
+
+@transaction.atomic
+def apply_bank_state(payment_pk: int, state: Dict[str, Any], *,
+                     seen_status: Optional[str] = None) -> Optional[Payment]:
+    """
+    Применить ответ GetState к Payment: статус, сырой ответ, state_checked_at;
+    CONFIRMED/AUTHORIZED — отметить заказ оплаченным.
+    Сетевые ошибки ничего не меняют (poller попробует снова).
+
+    seen_status — статус, с которым спрашивали банк: если пока ждали ответа
+    его сменил webhook, ответ устарел и статус не трогаем (compare-and-set).
+    Тот же статус — только отметка state_checked_at, без записи и события.
+    """
+    payment = Payment.objects.select_for_update().filter(pk=payment_pk).first()
+    if payment is None or not _bank_state_ok(state):
+        return payment
+
+    now = timezone.now()
+    new_status = str(state["Status"])
+    if (
+        (seen_status is not None and payment.status != seen_status)
+        or payment.status == new_status
+        or not _status_can_move(payment.status, new_status)
+    ):
+        Payment.objects.filter(pk=payment.pk).update(state_checked_at=now)
+        payment.state_checked_at = now
+        return payment
+
+    payment.raw_last_callback = state
+    payment.status = new_status
+    payment.state_checked_at = now
+    _publish_payment_event(payment)
+    payment.save(update_fields=["raw_last_callback", "status", "state_checked_at"])
+
+    success_flag = state.get("Success") in (True, "true", "True", "1", 1)
+    if success_flag and new_status.upper() in PAID_STATUSES:
+        order_mark_paid_by_id(payment.cart_id)
+    return payment
+
+
+def sync_payment_state(state: Dict[str, Any], ident: str) -> bool:
+    """
+    Сохранить ответ GetState в наш Payment (поиск по PaymentId / OrderId / ident).
+    True — платёж найден.
+    """
+    pay_id = str(state.get("PaymentId") or "")
+    ord_id = str(state.get("OrderId") or ident)
+
+    pk = (
+        Payment.objects.filter(Q(payment_id=pay_id) | Q(order_id=ord_id) | Q(order_id=ident))
+        .order_by("-id")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if pk is None:
+        return False
+    apply_bank_state(pk, state)
+    return True
+
+
+def find_payment(*, payment_id: Optional[str] = None, order_id: Optional[str] = None) -> Optional[Payment]:
+    payment = None
+    if payment_id:
+        payment = Payment.objects.filter(payment_id=str(payment_id)).order_by("-id").first()
+    if payment is None and order_id:
+        payment = Payment.objects.filter(order_id=str(order_id)).order_by("-id").first()
+    return payment
+
+
+def payment_state_is_fresh(payment: Payment) -> bool:
+    """Завершённые статусы не меняются; незавершённые — свежи STALE_SECONDS."""
+    if payment.status not in ALIVE_STATUSES:
+        return True
+    if payment.state_checked_at is None:
+        return False
+    age = (timezone.now() - payment.state_checked_at).total_seconds()
+    return age <= settings.PAYMENT_POLLER["STALE_SECONDS"]
+
+
+def refresh_payment_state(payment: Payment) -> Payment:
+    """Спросить банк сейчас (устаревшее состояние) и применить ответ."""
+    if not payment.payment_id:
+        return payment
+    state = TBankClient().get_state(payment_id=str(payment.payment_id))
+    return apply_bank_state(payment.pk, state, seen_status=payment.status) or payment
+
+
+async def arefresh_payment_state(payment: Payment) -> Payment:
+    if not payment.payment_id:
+        return payment
+    state = await AsyncTBankClient().get_state(payment_id=str(payment.payment_id))
+    return await sync_to_async(apply_bank_state)(
+        payment.pk, state, seen_status=payment.status
+    ) or payment
+
+
+def payment_state_payload(payment: Payment) -> Dict[str, Any]:
+    """Ответ в формате GetState, собранный из локального состояния."""
+    status = str(payment.status or "")
+    return {
+        **(payment.raw_last_callback or {}),
+        "Status": status,
+        "PaymentId": payment.payment_id,
+        "OrderId": payment.order_id,
+        "Amount": int(payment.amount),
+        "_checked_at": payment.state_checked_at.isoformat() if payment.state_checked_at else None,
+        "_source": "local",
+    }
+
+
+def _long_poll_timeout(wait) -> float:
+    try:
+        wait = float(wait or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, min(wait, settings.PAYMENT_POLLER["MAX_WAIT_SECONDS"]))
+
+
+def wait_payment_state(payment: Payment, *, since: Optional[str], wait) -> Payment:
+    """
+    Long-poll: пока статус равен since (то, что уже видел фронт), перечитываем
+    строку раз в полсекунды, не дольше wait секунд (и не дольше MAX_WAIT_SECONDS).
+    Если состояние устарело — один раз спрашиваем банк.
+    """
+    timeout = _long_poll_timeout(wait)
+    if not payment_state_is_fresh(payment):
+        payment = refresh_payment_state(payment)
+    deadline = time.monotonic() + timeout
+    while since and payment.status == since and time.monotonic() < deadline:
+        time.sleep(0.5)
+        payment.refresh_from_db(fields=["status", "raw_last_callback", "state_checked_at"])
+    return payment
+
+
+async def await_payment_state(payment: Payment, *, since: Optional[str], wait) -> Payment:
+    """wait_payment_state для async-вьюх: ожидание не занимает поток."""
+    timeout = _long_poll_timeout(wait)
+    if not payment_state_is_fresh(payment):
+        payment = await arefresh_payment_state(payment)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while since and payment.status == since and loop.time() < deadline:
+        await asyncio.sleep(0.5)
+        await payment.arefresh_from_db(fields=["status", "raw_last_callback", "state_checked_at"])
+    return payment
+
+
+def payment_events_snapshot(payment: Payment) -> Dict[str, Any]:
+    """Первое событие SSE-потока: текущий статус платежа и заказа."""
+    order = Cart.objects.filter(pk=payment.cart_id).values("status", "is_ordered").first() or {}
+    return {
+        "type": "status",
+        "cart_id": payment.cart_id,
+        "status": str(payment.status or ""),
+        "payment_id": payment.payment_id,
+        "order_id": payment.order_id,
+        "order": order,
+    }
+
+
+def payment_event_is_final(event: Dict[str, Any]) -> bool:
+    """После такого события статус больше не меняется — поток можно закрыть."""
+    if event.get("type") == "order":
+        return bool(event.get("is_ordered"))
+    if (event.get("order") or {}).get("is_ordered"):
+        return True
+    return str(event.get("status") or "").upper() in FINAL_STATUSES
+
+
+async def apoll_pending_payments(*, batch: int, concurrency: int) -> Dict[str, int]:
+    """
+    Один проход poller'а: незавершённые платежи, не сверявшиеся дольше
+    INTERVAL_SECONDS, опрашиваются параллельно (не больше concurrency за раз).
+    """
+    cfg = settings.PAYMENT_POLLER
+    now = timezone.now()
+    checked_before = now - timedelta(seconds=cfg["INTERVAL_SECONDS"])
+    created_after = now - timedelta(hours=cfg["MAX_AGE_HOURS"])
+
+    qs = (
+        Payment.objects.filter(
+            status__in=ALIVE_STATUSES,
+            payment_id__isnull=False,
+            created_at__gte=created_after,
+        )
+        .filter(Q(state_checked_at__isnull=True) | Q(state_checked_at__lt=checked_before))
+        .order_by(F("state_checked_at").asc(nulls_first=True))
+    )
+    payments = [p async for p in qs[:batch]]
+
+    client = AsyncTBankClient()
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"polled": len(payments), "changed": 0, "errors": 0}
+
+    async def poll(payment: Payment) -> None:
+        async with semaphore:
+            state = await client.get_state(payment_id=str(payment.payment_id))
+        if not _bank_state_ok(state):
+            stats["errors"] += 1
+            return
+        updated = await sync_to_async(apply_bank_state)(
+            payment.pk, state, seen_status=payment.status
+        )
+        if updated is not None and updated.status != payment.status:
+            stats["changed"] += 1
+
+    await asyncio.gather(*(poll(p) for p in payments))
+    return stats
+
+
 # --- webhook / callback handling ---
 
 
@@ -187,39 +527,185 @@ def _verify_token_with_client(payload: Dict[str, Any]) -> bool:
     return expected == payload.get("Token")
 
 
-@transaction.atomic
-def apply_webhook(data: Dict[str, Any]) -> str:
-    """
-    Обработка webhook (string/plain ответ). Проверяем подпись и обновляем Payment.
-    Возвращает 'OK' или 'INVALID TOKEN'.
-    """
-    if not _verify_token_with_client(data):
-        return "INVALID TOKEN"
-
+def _apply_webhook_payload(data: Dict[str, Any]) -> None:
+    """Применить уже проверенное уведомление к Payment (вызывать в транзакции)."""
     payment_id = str(data.get("PaymentId") or "")
     order_id = str(data.get("OrderId") or "")
 
     pay: Optional[Payment] = None
     if payment_id:
-        pay = Payment.objects.filter(payment_id=payment_id).order_by("-id").first()
+        pay = (
+            Payment.objects.select_for_update()
+            .filter(payment_id=payment_id)
+            .order_by("-id")
+            .first()
+        )
     if not pay and order_id:
-        pay = Payment.objects.filter(order_id=order_id).order_by("-id").first()
+        pay = (
+            Payment.objects.select_for_update()
+            .filter(order_id=order_id)
+            .order_by("-id")
+            .first()
+        )
 
     if not pay:
-        return "OK"
+        return
 
     pay.raw_last_callback = data
     pay.status = data.get("Status") or pay.status
-    pay.save(update_fields=["raw_last_callback", "status"])
+    pay.state_checked_at = timezone.now()
+    _publish_payment_event(pay)
+    pay.save(update_fields=["raw_last_callback", "status", "state_checked_at"])
 
     success_flag = data.get("Success") in (True, "true", "True", "1", 1)
     status_upper = str(data.get("Status") or "").upper()
     if success_flag and status_upper == "CONFIRMED":
         order_mark_paid_by_id(pay.cart_id)
 
+
+# --- webhook inbox: быстрый ответ банку + обработка воркером ---
+
+
+def enqueue_webhook(data: Dict[str, Any]) -> str:
+    """
+    Проверить подпись и дописать уведомление в WebhookInbox — один INSERT,
+    дубликат (банк повторил то же уведомление) молча отбрасывается.
+    Возвращает 'OK' или 'INVALID TOKEN'.
+    """
+    if not _verify_token_with_client(data):
+        return "INVALID TOKEN"
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    WebhookInbox.objects.bulk_create(
+        [
+            WebhookInbox(
+                payload=data,
+                dedup_hash=hashlib.sha256(raw.encode("utf-8")).hexdigest(),
+                payment_id=str(data.get("PaymentId") or ""),
+            )
+        ],
+        ignore_conflicts=True,
+    )
     return "OK"
 
 
+def _record_webhook_lag(lags_ms: list[int], failed: int) -> None:
+    """Счётчики и задержка обработки — в Redis, как статистика кэша каталога."""
+    if not lags_ms and not failed:
+        return
+    try:
+        conn = get_redis_connection("default")
+        key = f"{settings.CACHE_KEY_PREFIX}:webhooks:stats"
+        pipe = conn.pipeline(transaction=False)
+        if lags_ms:
+            pipe.hincrby(key, "processed", len(lags_ms))
+            pipe.hset(key, mapping={"last_lag_ms": lags_ms[-1], "batch_max_lag_ms": max(lags_ms)})
+        if failed:
+            pipe.hincrby(key, "failed", failed)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("webhook lag metric failed: %s", e)
+
+
+@transaction.atomic
+def drain_webhook_inbox(*, batch: int) -> Dict[str, int]:
+    """
+    Обработать пачку необработанных уведомлений.
+
+    Строки берутся SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько воркеров
+    не мешают друг другу. Порядок внутри одного PaymentId сохраняется: платёж
+    обрабатываем, только если его самое раннее необработанное уведомление досталось
+    нам, а после ошибки его остальные уведомления в этой пачке не трогаем.
+    Каждое уведомление — в своём savepoint; после ошибки следующая попытка не
+    раньше next_attempt_at (экспоненциальная пауза, более поздние уведомления
+    платежа ждут и в выборку не попадают), после MAX_ATTEMPTS ошибок — failed_at: уведомление отложено
+    для ручного разбора и больше не держит очередь платежа.
+    """
+    cfg = settings.WEBHOOK_INBOX
+    now = timezone.now()
+    pending = WebhookInbox.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+    # уведомления за более ранним, ждущим повтора, не выбираем вовсе: иначе они
+    # занимают пачку, а свежие уведомления других платежей за ней не видны
+    waiting_before = pending.filter(
+        payment_id=OuterRef("payment_id"), id__lt=OuterRef("id"), next_attempt_at__gt=now
+    ).exclude(payment_id="")
+    rows = list(
+        pending.select_for_update(skip_locked=True)
+        .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        .filter(~Exists(waiting_before))
+        .order_by("id")[:batch]
+    )
+    if not rows:
+        return {"processed": 0, "failed": 0, "deferred": 0}
+
+    payment_ids = {r.payment_id for r in rows if r.payment_id}
+    first_pending = dict(
+        pending.filter(payment_id__in=payment_ids)
+        .values("payment_id")
+        .annotate(first_id=Min("id"))
+        .values_list("payment_id", "first_id")
+    )
+    taken = {r.id for r in rows}
+
+    stats = {"processed": 0, "failed": 0, "deferred": 0}
+    lags_ms: list[int] = []
+    blocked: set[str] = set()
+    for row in rows:
+        if row.payment_id and (
+            row.payment_id in blocked or first_pending.get(row.payment_id) not in taken
+        ):
+            # более раннее уведомление этого платежа у другого воркера или упало
+            stats["deferred"] += 1
+            continue
+        try:
+            with transaction.atomic():
+                _apply_webhook_payload(row.payload)
+        except Exception as e:
+            logger.exception("webhook inbox row %s failed", row.pk)
+            row.attempts += 1
+            row.last_error = f"{e.__class__.__name__}: {e}"
+            if row.attempts >= cfg["MAX_ATTEMPTS"]:
+                row.failed_at = timezone.now()
+            else:
+                delay = min(
+                    cfg["BACKOFF_SECONDS"] * 2 ** (row.attempts - 1),
+                    cfg["MAX_BACKOFF_SECONDS"],
+                )
+                row.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                blocked.add(row.payment_id)
+            row.save(update_fields=["attempts", "last_error", "failed_at", "next_attempt_at"])
+            stats["failed"] += 1
+            continue
+
+        row.processed_at = timezone.now()
+        row.save(update_fields=["processed_at"])
+        lags_ms.append(int((row.processed_at - row.received_at).total_seconds() * 1000))
+        stats["processed"] += 1
+
+    transaction.on_commit(lambda: _record_webhook_lag(lags_ms, stats["failed"]))
+    return stats
+
+
+def webhook_inbox_stats() -> Dict[str, Any]:
+    """Очередь (сколько ждёт и как давно самое старое), отложенные + метрики из Redis."""
+    pending = WebhookInbox.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+    oldest = pending.order_by("id").values_list("received_at", flat=True).first()
+    out: Dict[str, Any] = {
+        "pending": pending.count(),
+        "parked": WebhookInbox.objects.filter(failed_at__isnull=False).count(),
+        "oldest_pending_s": (
+            round((timezone.now() - oldest).total_seconds(), 1) if oldest else None
+        ),
+    }
+    try:
+        conn = get_redis_connection("default")
+        raw = conn.hgetall(f"{settings.CACHE_KEY_PREFIX}:webhooks:stats")
+        for k, v in raw.items():
+            out[k.decode() if hasattr(k, "decode") else k] = int(v)
+    except Exception as e:
+        logger.warning("webhook stats unavailable: %s", e)
+    return out
+
+
 @transaction.atomic
 def handle_callback(data: Dict[str, Any]) -> None:
     """
@@ -246,7 +732,9 @@ def handle_callback(data: Dict[str, Any]) -> None:
 
     payment.raw_last_callback = data
     payment.status = status or payment.status
-    payment.save(update_fields=["raw_last_callback", "status"])
+    payment.state_checked_at = timezone.now()
+    _publish_payment_event(payment)
+    payment.save(update_fields=["raw_last_callback", "status", "state_checked_at"])
 
     if str(status).upper() == "CONFIRMED":
         order_mark_paid_by_id(payment.cart_id)
@@ -1,3 +1,513 @@
-from django.test import TestCase
+import asyncio
+import datetime
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from apps.customers.models import Client
+from apps.orders.events import publish_cart_event
+from apps.orders.models import Cart, CartItem
+from apps.payments import clients
+from apps.payments.clients import AsyncTBankClient, TBankClient
+from apps.payments.models import Payment, WebhookInbox
+from apps.payments.services import (
+    STATUS_INITIATING,
+    PaymentInitInProgress,
+    apply_bank_state,
+    create_or_get_payment_for_cart,
+    drain_webhook_inbox,
+    enqueue_webhook,
+    payment_event_is_final,
+)
+from apps.payments.views import PaymentEventsView, _payment_event_stream
+from apps.products.models import Brand, Category, Product, ProductVariant
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+INIT = "apps.payments.services.TBankClient.init"
+
+
+def _init_ok(payment_id="5001"):
+    return {
+        "Success": True,
+        "PaymentId": payment_id,
+        "PaymentURL": f"https://pay.example/{payment_id}",
+    }
+
+
+def _make_cart(email: str) -> Cart:
+    """Черновая корзина клиента с одной позицией на 1500 ₽."""
+    user = User.objects.create_user(username=email, password="pw")
+    client = Client.objects.create(
+        user=user,
+        surname="Иванов",
+        name="Иван",
+        phone_number="+79990000101",
+        birthday=datetime.date(1990, 1, 1),
+    )
+    product = Product.objects.create(
+        name="Клюшка",
+        category=Category.objects.create(name="Клюшки"),
+        brand=Brand.objects.create(name="Bauer"),
+    )
+    variant = ProductVariant.objects.create(
+        product=product, size_value="S", base_price=Decimal("1500")
+    )
+    cart = Cart.objects.create(client=client)
+    CartItem.objects.create(cart=cart, product=product, product_variant=variant, quantity=1)
+    # итог корзины обычно считают on_commit-пересчёты
+    Cart.objects.filter(pk=cart.pk).update(cart_total_sum=Decimal("1500"))
+    cart.refresh_from_db()
+    return cart
+
+
+class CreateOrGetPaymentTest(TestCase):
+    """
+    Init идёт вне транзакции: резерв (INITIATING) → запрос в банк → compare-and-set.
+    Повтор для той же корзины не создаёт второй платёж.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cart = _make_cart("pay@example.com")
+
+    def _payment(self, **fields):
+        defaults = {
+            "cart_id": self.cart.pk,
+            "amount": 150000,
+            "order_id": f"cart-{self.cart.pk}-test",
+        }
+        return Payment.objects.create(**{**defaults, **fields})
+
+    def test_new_payment_goes_through_reservation(self):
+        with mock.patch(INIT, return_value=_init_ok()) as init:
+            payment = create_or_get_payment_for_cart(self.cart)
+
+        init.assert_called_once()
+        self.assertEqual(init.call_args.kwargs["amount"], 150000)
+        self.assertEqual(payment.status, "NEW")
+        self.assertEqual(payment.payment_id, "5001")
+        self.assertEqual(Payment.objects.filter(cart_id=self.cart.pk).count(), 1)
+
+    def test_ready_payment_is_reused(self):
+        ready = self._payment(
+            status="NEW", payment_id="42", payment_url="https://pay.example/42"
+        )
+        with mock.patch(INIT) as init:
+            payment = create_or_get_payment_for_cart(self.cart)
+
+        init.assert_not_called()
+        self.assertEqual(payment.pk, ready.pk)
+
+    def test_joins_inflight_reservation(self):
+        inflight = self._payment(status=STATUS_INITIATING)
+
+        def other_request_finishes(_delay):
+            Payment.objects.filter(pk=inflight.pk).update(
+                status="NEW", payment_id="77", payment_url="https://pay.example/77"
+            )
+
+        with mock.patch(INIT) as init, mock.patch(
+            "apps.payments.services.time.sleep", side_effect=other_request_finishes
+        ):
+            payment = create_or_get_payment_for_cart(self.cart)
+
+        init.assert_not_called()
+        self.assertEqual(payment.pk, inflight.pk)
+        self.assertEqual(payment.payment_url, "https://pay.example/77")
+        self.assertEqual(Payment.objects.filter(cart_id=self.cart.pk).count(), 1)
+
+    @override_settings(T_BANK={**settings.T_BANK, "INIT_WAIT_SECONDS": 0})
+    def test_inflight_reservation_wait_times_out(self):
+        self._payment(status=STATUS_INITIATING)
+        with mock.patch(INIT) as init, self.assertRaises(PaymentInitInProgress):
+            create_or_get_payment_for_cart(self.cart)
+        init.assert_not_called()
+
+    def test_stale_reservation_is_replaced(self):
+        stale = self._payment(status=STATUS_INITIATING)
+        Payment.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now()
+            - timedelta(seconds=settings.T_BANK["INIT_STALE_SECONDS"] + 1)
+        )
+        with mock.patch(INIT, return_value=_init_ok("6001")):
+            payment = create_or_get_payment_for_cart(self.cart)
+
+        self.assertNotEqual(payment.pk, stale.pk)
+        self.assertEqual(payment.status, "NEW")
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, "REJECTED")
+
+    def test_superseded_attempt_is_not_written(self):
+        def superseded_during_init(**kwargs):
+            # пока шёл Init, резерв признали брошенным и заменили
+            Payment.objects.filter(order_id=kwargs["order_id"]).update(status="REJECTED")
+            return _init_ok("7001")
+
+        with mock.patch(INIT, side_effect=superseded_during_init), self.assertRaises(
+            PaymentInitInProgress
+        ):
+            create_or_get_payment_for_cart(self.cart)
+
+        payment = Payment.objects.get(cart_id=self.cart.pk)
+        self.assertEqual(payment.status, "REJECTED")
+        self.assertIsNone(payment.payment_id)
+
+    def test_failed_init_rejects_reservation(self):
+        with mock.patch(INIT, return_value={"Success": False}), self.assertRaises(
+            RuntimeError
+        ):
+            create_or_get_payment_for_cart(self.cart)
+        self.assertEqual(Payment.objects.get(cart_id=self.cart.pk).status, "REJECTED")
+
+
+def _signed(payload):
+    return {**payload, "Token": TBankClient()._make_token(payload)}
+
+
+class WebhookInboxTest(TestCase):
+    """Вьюха только дописывает уведомление; воркер применяет их по порядку внутри PaymentId."""
+
+    APPLY = "apps.payments.services._apply_webhook_payload"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cart = _make_cart("hook@example.com")
+        cls.payment = Payment.objects.create(
+            cart_id=cls.cart.pk, amount=150000, order_id="cart-test", payment_id="901"
+        )
+
+    def test_duplicate_notification_is_stored_once(self):
+        data = _signed({"PaymentId": "901", "Status": "AUTHORIZED", "Success": True})
+        self.assertEqual(enqueue_webhook(data), "OK")
+        self.assertEqual(enqueue_webhook(dict(data)), "OK")
+        self.assertEqual(WebhookInbox.objects.count(), 1)
+
+    def test_bad_token_is_not_stored(self):
+        data = {"PaymentId": "901", "Status": "CONFIRMED", "Token": "forged"}
+        self.assertEqual(enqueue_webhook(data), "INVALID TOKEN")
+        self.assertFalse(WebhookInbox.objects.exists())
+
+    def test_drain_applies_in_arrival_order(self):
+        for status in ("AUTHORIZED", "CONFIRMED"):
+            enqueue_webhook(_signed({"PaymentId": "901", "Status": status, "Success": True}))
+
+        stats = drain_webhook_inbox(batch=10)
+
+        self.assertEqual(stats["processed"], 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "CONFIRMED")
+        self.cart.refresh_from_db()
+        self.assertTrue(self.cart.is_ordered)
+        self.assertFalse(WebhookInbox.objects.filter(processed_at__isnull=True).exists())
+
+    def test_failed_notification_holds_back_later_ones_of_same_payment(self):
+        first = WebhookInbox.objects.create(
+            payload={"PaymentId": "901", "Status": "AUTHORIZED"}, dedup_hash="a", payment_id="901"
+        )
+        second = WebhookInbox.objects.create(
+            payload={"PaymentId": "901", "Status": "CONFIRMED"}, dedup_hash="b", payment_id="901"
+        )
+        other = WebhookInbox.objects.create(
+            payload={"PaymentId": "902", "Status": "CONFIRMED"}, dedup_hash="c", payment_id="902"
+        )
+
+        def fail_first(payload):
+            if payload["Status"] == "AUTHORIZED":
+                raise RuntimeError("deadlock detected")
+
+        with mock.patch(self.APPLY, side_effect=fail_first) as apply, self.assertLogs(
+            "apps.payments.services", "ERROR"
+        ):
+            stats = drain_webhook_inbox(batch=10)
+        self.assertEqual(stats, {"processed": 1, "failed": 1, "deferred": 1})
+        self.assertEqual([c.args[0]["PaymentId"] for c in apply.call_args_list], ["901", "902"])
+
+        # пауза перед повтором: следующий проход не выбирает ни упавшее, ни следующее за ним
+        first.refresh_from_db()
+        self.assertEqual(first.attempts, 1)
+        self.assertGreater(first.next_attempt_at, timezone.now())
+        with mock.patch(self.APPLY) as apply:
+            stats = drain_webhook_inbox(batch=10)
+        apply.assert_not_called()
+        self.assertEqual(stats, {"processed": 0, "failed": 0, "deferred": 0})
+
+        WebhookInbox.objects.filter(pk=first.pk).update(next_attempt_at=timezone.now())
+        with mock.patch(self.APPLY) as apply:
+            drain_webhook_inbox(batch=10)
+        self.assertEqual(
+            [c.args[0]["Status"] for c in apply.call_args_list], ["AUTHORIZED", "CONFIRMED"]
+        )
+        for row in (first, second, other):
+            row.refresh_from_db()
+            self.assertIsNotNone(row.processed_at)
+
+    def test_rows_behind_backoff_do_not_fill_the_batch(self):
+        later = timezone.now() + timedelta(minutes=5)
+        for pid in ("901", "902", "903"):
+            WebhookInbox.objects.create(
+                payload={"PaymentId": pid, "Status": "AUTHORIZED"},
+                dedup_hash=f"{pid}-a",
+                payment_id=pid,
+                attempts=1,
+                next_attempt_at=later,
+            )
+            WebhookInbox.objects.create(
+                payload={"PaymentId": pid, "Status": "CONFIRMED"},
+                dedup_hash=f"{pid}-b",
+                payment_id=pid,
+            )
+        fresh = WebhookInbox.objects.create(
+            payload={"PaymentId": "904", "Status": "CONFIRMED"}, dedup_hash="d", payment_id="904"
+        )
+
+        # ждущих за паузой больше, чем пачка, но свежее уведомление всё равно достаётся
+        with mock.patch(self.APPLY) as apply:
+            stats = drain_webhook_inbox(batch=2)
+        self.assertEqual(stats, {"processed": 1, "failed": 0, "deferred": 0})
+        self.assertEqual([c.args[0]["PaymentId"] for c in apply.call_args_list], ["904"])
+        fresh.refresh_from_db()
+        self.assertIsNotNone(fresh.processed_at)
+
+    @override_settings(WEBHOOK_INBOX={**settings.WEBHOOK_INBOX, "MAX_ATTEMPTS": 2})
+    def test_exhausted_notification_is_parked_not_processed(self):
+        row = WebhookInbox.objects.create(
+            payload={"PaymentId": "901", "Status": "CONFIRMED"}, dedup_hash="a", payment_id="901"
+        )
+        with mock.patch(self.APPLY, side_effect=RuntimeError("boom")), self.assertLogs(
+            "apps.payments.services", "ERROR"
+        ):
+            for _ in range(2):
+                WebhookInbox.objects.filter(pk=row.pk).update(next_attempt_at=None)
+                drain_webhook_inbox(batch=10)
+
+        row.refresh_from_db()
+        self.assertEqual(row.attempts, 2)
+        self.assertIsNone(row.processed_at)
+        self.assertIsNotNone(row.failed_at)
+        with mock.patch(self.APPLY) as apply:
+            drain_webhook_inbox(batch=10)
+        apply.assert_not_called()
+
+
+class ApplyBankStateTest(TestCase):
+    """Ответ GetState не перетирает статус, который успел записать webhook."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cart = _make_cart("state@example.com")
+
+    def setUp(self):
+        self.payment = Payment.objects.create(
+            cart_id=self.cart.pk,
+            amount=150000,
+            order_id="cart-state",
+            payment_id="801",
+            status="FORM_SHOWED",
+        )
+
+    def test_transition_is_applied(self):
+        state = {"Success": True, "Status": "REJECTED"}
+        payment = apply_bank_state(self.payment.pk, state, seen_status="FORM_SHOWED")
+        self.assertEqual(payment.status, "REJECTED")
+        self.assertEqual(payment.raw_last_callback, state)
+
+    def test_late_answer_does_not_override_webhook(self):
+        # webhook записал CONFIRMED, пока poller ждал ответа банка
+        Payment.objects.filter(pk=self.payment.pk).update(status="CONFIRMED")
+        apply_bank_state(
+            self.payment.pk, {"Success": True, "Status": "AUTHORIZING"}, seen_status="FORM_SHOWED"
+        )
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "CONFIRMED")
+        self.assertIsNotNone(self.payment.state_checked_at)
+
+    def test_final_status_is_never_rolled_back(self):
+        Payment.objects.filter(pk=self.payment.pk).update(status="CONFIRMED")
+        apply_bank_state(self.payment.pk, {"Success": True, "Status": "FORM_SHOWED"})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "CONFIRMED")
+
+    def test_unchanged_status_only_marks_checked(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            apply_bank_state(
+                self.payment.pk, {"Success": True, "Status": "FORM_SHOWED"}, seen_status="FORM_SHOWED"
+            )
+        self.assertEqual(callbacks, [])
+        self.payment.refresh_from_db()
+        self.assertIsNone(self.payment.raw_last_callback)
+        self.assertIsNotNone(self.payment.state_checked_at)
+
+
+class PaymentSyncViewTest(TestCase):
+    """Анонимный sync/ отвечает сразу: long-poll только у status/ и events/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.payment = Payment.objects.create(
+            cart_id=_make_cart("sync@example.com").pk,
+            amount=150000,
+            order_id="cart-sync",
+            payment_id="801",
+            status="FORM_SHOWED",
+            state_checked_at=timezone.now(),
+        )
+
+    def test_anonymous_sync_does_not_long_poll(self):
+        with mock.patch("apps.payments.services.time.sleep") as sleep:
+            response = APIClient().post(
+                "/api/payments/sync/",
+                {"PaymentId": "801", "since": "FORM_SHOWED", "wait": 25},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "FORM_SHOWED")
+        sleep.assert_not_called()
+
+
+class PaymentEventIsFinalTest(SimpleTestCase):
+    def test_payment_events(self):
+        self.assertTrue(payment_event_is_final({"type": "payment", "status": "CONFIRMED"}))
+        self.assertTrue(payment_event_is_final({"type": "payment", "status": "rejected"}))
+        self.assertFalse(payment_event_is_final({"type": "payment", "status": "AUTHORIZED"}))
+
+    def test_order_events(self):
+        self.assertTrue(payment_event_is_final({"type": "order", "is_ordered": True}))
+        self.assertFalse(payment_event_is_final({"type": "order", "is_ordered": False}))
+
+    def test_snapshot(self):
+        snapshot = {"type": "status", "status": "AUTHORIZED", "order": {"is_ordered": True}}
+        self.assertTrue(payment_event_is_final(snapshot))
+        snapshot["order"] = {"is_ordered": False}
+        self.assertFalse(payment_event_is_final(snapshot))
+
+
+class PaymentEventsViewTest(TestCase):
+    """SSE-поток статуса: доступ только к своей корзине, финальный статус — 204."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cart = _make_cart("sse@example.com")
+        cls.payment = Payment.objects.create(
+            cart_id=cls.cart.pk,
+            amount=150000,
+            order_id="cart-sse",
+            payment_id="701",
+            status="FORM_SHOWED",
+        )
+        cls.owner = cls.cart.client.user
+        cls.stranger = User.objects.create_user(username="other@example.com", password="pw")
+        Client.objects.create(
+            user=cls.stranger,
+            surname="Петров",
+            name="Пётр",
+            phone_number="+79990000102",
+            birthday=datetime.date(1990, 1, 1),
+        )
+
+    async def _get(self, user, ident="701"):
+        token = str(AccessToken.for_user(user))
+        request = RequestFactory().get(f"/api/payments/events/{ident}", {"token": token})
+        return await PaymentEventsView.as_view()(request, ident=ident)
+
+    async def test_final_payment_is_204(self):
+        await Payment.objects.filter(pk=self.payment.pk).aupdate(status="CONFIRMED")
+        response = await self._get(self.owner)
+        self.assertEqual(response.status_code, 204)
+
+    async def test_other_clients_payment_is_404(self):
+        response = await self._get(self.stranger)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_unauthenticated_is_401(self):
+        request = RequestFactory().get("/api/payments/events/701", {"token": "garbage"})
+        response = await PaymentEventsView.as_view()(request, ident="701")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_event_between_subscribe_and_snapshot_is_delivered(self):
+        from apps.payments import services
+
+        real_snapshot = services.payment_events_snapshot
+
+        def snapshot_then_confirm(payment):
+            data = real_snapshot(payment)
+            # статус сменился уже после подписки, но до того, как клиент увидел снимок
+            publish_cart_event(payment.cart_id, {"type": "payment", "status": "CONFIRMED"})
+            return data
+
+        stream = _payment_event_stream(self.payment)
+        with mock.patch(
+            "apps.payments.views.payment_events_snapshot", side_effect=snapshot_then_confirm
+        ):
+            chunks = [await asyncio.wait_for(stream.__anext__(), 5) for _ in range(3)]
+        await stream.aclose()
+
+        self.assertIn('"status": "FORM_SHOWED"', chunks[0])
+        self.assertTrue(chunks[1].startswith("event: payment\n"))
+        self.assertIn('"status": "CONFIRMED"', chunks[1])
+        self.assertTrue(chunks[2].startswith("event: end\n"))
+
+
+@override_settings(T_BANK_HTTP={**settings.T_BANK_HTTP, "RETRIES": 2, "BACKOFF_SECONDS": 0})
+class AsyncTBankClientTest(SimpleTestCase):
+    """Повторы только у GetState, общий дедлайн вызова, один httpx-пул на event loop."""
+
+    def setUp(self):
+        self.calls = []
+        self.responses = []
+        real_client = httpx.AsyncClient
+        transport = httpx.MockTransport(self._handle)
+        patcher = mock.patch(
+            "httpx.AsyncClient",
+            side_effect=lambda **kw: real_client(transport=transport, **kw),
+        )
+        self.client_factory = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _handle(self, request):
+        self.calls.append(request.url.path)
+        status_code, body, delay = self.responses.pop(0) if self.responses else (200, {}, 0)
+        if delay:
+            await asyncio.sleep(delay)
+        return httpx.Response(status_code, json=body)
+
+    async def test_get_state_is_retried(self):
+        self.responses = [(503, {}, 0), (502, {}, 0), (200, {"Success": True, "Status": "CONFIRMED"}, 0)]
+        result = await AsyncTBankClient().get_state(payment_id="1")
+        self.assertEqual(result["Status"], "CONFIRMED")
+        self.assertEqual(len(self.calls), 3)
+
+    async def test_retries_are_bounded(self):
+        self.responses = [(503, {}, 0)] * 5
+        result = await AsyncTBankClient().get_state(payment_id="1")
+        self.assertFalse(result["Success"])
+        self.assertEqual(len(self.calls), 3)
+
+    async def test_init_is_not_retried(self):
+        self.responses = [(503, {}, 0), (200, {"Success": True}, 0)]
+        result = await AsyncTBankClient().init(amount=100, order_id="cart-1")
+        self.assertFalse(result["Success"])
+        self.assertEqual(len(self.calls), 1)
+
+    async def test_deadline_covers_the_whole_call(self):
+        self.responses = [(200, {"Success": True}, 1.0)]
+        result = await AsyncTBankClient().get_state(payment_id="1", deadline=0.05)
+        self.assertEqual(result["http_error"], "deadline exceeded")
+
+    async def test_pool_is_shared_within_a_loop(self):
+        await AsyncTBankClient().get_state(payment_id="1")
+        await AsyncTBankClient().get_state(payment_id="2")
+        self.assertEqual(self.client_factory.call_count, 1)
+
+    def test_new_loop_gets_its_own_pool(self):
+        async def pool():
+            return clients._async_pool()
+
+        first, second = asyncio.run(pool()), asyncio.run(pool())
+        self.assertIsNot(first[0], second[0])
+        self.assertEqual(self.client_factory.call_count, 2)
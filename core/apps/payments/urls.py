@@ -1,4 +1,7 @@
 from apps.payments.views import (
+    AsyncPaymentStatusSmartView,
+    AsyncPaymentStatusView,
+    PaymentEventsView,
     PaymentInitView,
     PaymentStatusSmartView,
     PaymentStatusView,
@@ -6,19 +9,34 @@ from apps.payments.views import (
     TBankCallbackView,
     TBankWebhookView,
 )
+from django.conf import settings
 from django.urls import path
 
 app_name = "payments"
 
+# под ASGI статус платежа опрашивает банк без блокировки потока (AsyncTBankClient)
+if settings.T_BANK_ASYNC_VIEWS:
+    status_view = AsyncPaymentStatusView.as_view()
+    smart_status_view = AsyncPaymentStatusSmartView.as_view()
+else:
+    status_view = PaymentStatusView.as_view()
+    smart_status_view = PaymentStatusSmartView.as_view()
+
 urlpatterns = [
     path("init/", PaymentInitView.as_view(), name="init"),
     path("webhook/", TBankWebhookView.as_view(), name="webhook"),
     path("callback/", TBankCallbackView.as_view(), name="callback"),
-    path("status/<str:order_id>", PaymentStatusView.as_view(), name="status"),
+    path("status/<str:order_id>", status_view, name="status"),
     path("sync/", PaymentSyncView.as_view(), name="payment-sync"),
     path(
         "payments/status/<path:ident>",
-        PaymentStatusSmartView.as_view(),
+        smart_status_view,
         name="smart_status",
     ),
 ]
+
+# SSE держит соединение открытым — только под ASGI
+if settings.T_BANK_ASYNC_VIEWS:
+    urlpatterns.append(
+        path("events/<path:ident>", PaymentEventsView.as_view(), name="events")
+    )
@@ -1,27 +1,41 @@
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+import json
 
+from apps.orders.events import cart_channel, event_hub
 from apps.orders.models import Cart
 from apps.orders.selectors import get_or_create_draft_cart
-from apps.orders.services import order_mark_paid_by_id
-from apps.payments.clients import TBankClient
-from apps.payments.models import Payment
+from apps.payments.clients import AsyncTBankClient, TBankClient
 from apps.payments.services import (
-    apply_webhook,
+    PaymentInitInProgress,
+    aget_state_by_order,
+    await_payment_state,
     create_or_get_payment_for_cart,
+    enqueue_webhook,
+    find_payment,
     get_state_by_order,
     handle_callback,
+    payment_event_is_final,
+    payment_events_snapshot,
+    payment_state_is_fresh,
+    payment_state_payload,
+    refresh_payment_state,
+    sync_payment_state,
+    wait_payment_state,
 )
-from django.db import transaction
-from django.db.models import Q
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import permissions, status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
 class PaymentInitView(APIView):
@@ -65,6 +79,11 @@ class PaymentInitView(APIView):
 
         try:
             payment = create_or_get_payment_for_cart(cart)
+        except PaymentInitInProgress:
+            return Response(
+                {"detail": "Платёж уже создаётся, повторите запрос"},
+                status=status.HTTP_409_CONFLICT,
+            )
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -90,7 +109,8 @@ class PaymentInitView(APIView):
 class TBankWebhookView(APIView):
     """
     Endpoint, на который T-Bank шлёт webhook (Notification URL).
-    Банку достаточно текста 'OK' (200).
+    Банку достаточно текста 'OK' (200) — отвечаем сразу после проверки подписи
+    и записи в WebhookInbox; Payment обновляет воркер (manage.py drain_webhooks).
     """
 
     permission_classes = [AllowAny]
@@ -100,7 +120,7 @@ class TBankWebhookView(APIView):
             data = request.data
         else:
             data = request.POST.dict()
-        text = apply_webhook(data)
+        text = enqueue_webhook(data)
         return HttpResponse(text, content_type="text/plain", status=200)
 
 
@@ -125,13 +145,23 @@ class TBankCallbackView(APIView):
 class PaymentStatusView(APIView):
     """
     Опрос состояния платежа по order_id (строка).
+    Отвечаем из локального Payment (банк — только если состояние устарело);
+    ?wait=N&since=<статус> — дождаться смены статуса (long-poll).
+    Неизвестный нам order_id — как раньше, напрямую у банка.
     """
 
     permission_classes = [IsAuthenticated]
 
     def get(self, request, order_id: str):
-        resp = get_state_by_order(order_id)
-        return Response(resp)
+        payment = find_payment(order_id=order_id)
+        if payment is None:
+            return Response(get_state_by_order(order_id))
+        payment = wait_payment_state(
+            payment,
+            since=request.query_params.get("since"),
+            wait=request.query_params.get("wait"),
+        )
+        return Response(payment_state_payload(payment))
 
 
 class PaymentStatusSmartView(APIView):
@@ -139,58 +169,227 @@ class PaymentStatusSmartView(APIView):
     GET /api/payments/payments/status/<ident>
     ident = PaymentId (числа) ИЛИ OrderId (строка вида cart-...).
 
-    1) спрашиваем банк
-    2) сохраняем локально (Payment.status, raw_last_callback)
-    3) если CONFIRMED — переводим корзину (order_mark_paid_by_id)
+    1) берём локальный Payment (его актуальным держат poller и webhook)
+    2) если состояние устарело — спрашиваем банк и применяем ответ
+       (CONFIRMED — перевод корзины через order_mark_paid_by_id)
+    3) ?wait=N&since=<статус> — long-poll до смены статуса
     """
 
     permission_classes = [IsAuthenticated]
 
     def get(self, request, ident: str):
-        client = TBankClient()
+        payment = _find_payment_by_ident(ident)
+        if payment is None:
+            return Response(_bank_state_by_ident(ident))
+
+        payment = wait_payment_state(
+            payment,
+            since=request.query_params.get("since"),
+            wait=request.query_params.get("wait"),
+        )
+        return Response(
+            {
+                **payment_state_payload(payment),
+                "_synced": True,
+                "_lookup": {"PaymentId": payment.payment_id, "OrderId": payment.order_id},
+            },
+            status=200,
+        )
 
-        if ident.isdigit():
-            state = client.get_state(payment_id=ident)
-        else:
-            state = client.get_state(order_id=ident)
-
-        pay_id = str(state.get("PaymentId") or "")
-        ord_id = str(state.get("OrderId") or ident)
-
-        synced = False
-        with transaction.atomic():
-            payment: Optional[Payment] = (
-                Payment.objects.select_for_update()
-                .filter(Q(payment_id=pay_id) | Q(order_id=ord_id) | Q(order_id=ident))
-                .order_by("-id")
-                .first()
-            )
 
-            if payment:
-                old_status = payment.status
-                new_status = (state.get("Status") or old_status) or "NEW"
+def _find_payment_by_ident(ident: str):
+    if ident.isdigit():
+        return find_payment(payment_id=ident)
+    return find_payment(order_id=ident)
+
+
+def _bank_state_by_ident(ident: str) -> dict:
+    """Платежа у нас нет — отвечаем как раньше, сырым GetState."""
+    client = TBankClient()
+    if ident.isdigit():
+        state = client.get_state(payment_id=ident)
+    else:
+        state = client.get_state(order_id=ident)
+    synced = sync_payment_state(state, ident)
+    return {
+        **state,
+        "_synced": synced,
+        "_lookup": {
+            "PaymentId": str(state.get("PaymentId") or ""),
+            "OrderId": str(state.get("OrderId") or ident),
+        },
+    }
+
+
+# -----------------------------
+# async-варианты для ASGI (settings.T_BANK_ASYNC_VIEWS, см. urls.py)
+# -----------------------------
+# Ни запрос к банку, ни long-poll не занимают поток воркера.
+# DRF APIView не умеет async-обработчики, поэтому это обычные Django View
+# с той же JWT-аутентификацией.
+
+
+async def _aauthenticate(request):
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+class AsyncPaymentStatusView(View):
+    async def get(self, request, order_id: str):
+        if await _aauthenticate(request) is None:
+            return JsonResponse({"detail": "not_authenticated"}, status=401)
+
+        payment = await sync_to_async(find_payment)(order_id=order_id)
+        if payment is None:
+            return JsonResponse(await aget_state_by_order(order_id))
+        payment = await await_payment_state(
+            payment, since=request.GET.get("since"), wait=request.GET.get("wait")
+        )
+        return JsonResponse(payment_state_payload(payment))
 
-                payment.raw_last_callback = state
-                payment.status = new_status
-                payment.save(update_fields=["raw_last_callback", "status"])
-                synced = True
 
-                success_flag = state.get("Success") in (True, "true", "True", "1", 1)
-                status_upper = str(new_status or "").upper()
+class AsyncPaymentStatusSmartView(View):
+    async def get(self, request, ident: str):
+        if await _aauthenticate(request) is None:
+            return JsonResponse({"detail": "not_authenticated"}, status=401)
 
-                if success_flag and status_upper in ("CONFIRMED", "AUTHORIZED"):
-                    order_mark_paid_by_id(payment.cart_id)
+        payment = await sync_to_async(_find_payment_by_ident)(ident)
+        if payment is None:
+            client = AsyncTBankClient()
+            if ident.isdigit():
+                state = await client.get_state(payment_id=ident)
+            else:
+                state = await client.get_state(order_id=ident)
+            synced = await sync_to_async(sync_payment_state)(state, ident)
+            return JsonResponse(
+                {
+                    **state,
+                    "_synced": synced,
+                    "_lookup": {
+                        "PaymentId": str(state.get("PaymentId") or ""),
+                        "OrderId": str(state.get("OrderId") or ident),
+                    },
+                }
+            )
 
-        return Response(
+        payment = await await_payment_state(
+            payment, since=request.GET.get("since"), wait=request.GET.get("wait")
+        )
+        return JsonResponse(
             {
-                **state,
-                "_synced": synced,
-                "_lookup": {"PaymentId": pay_id, "OrderId": ord_id},
-            },
-            status=200,
+                **payment_state_payload(payment),
+                "_synced": True,
+                "_lookup": {"PaymentId": payment.payment_id, "OrderId": payment.order_id},
+            }
         )
 
 
+# -----------------------------
+# SSE: push статуса платежа/заказа (только ASGI)
+# -----------------------------
+# Клиент держит открытым GET и получает события text/event-stream:
+#   status  — снимок при подключении
+#   payment — сменился статус Payment (webhook / poller / sync)
+#   order   — корзина оформлена как заказ
+# Соединение ничего не стоит, кроме очереди в EventHub: ни потока, ни запросов
+# к БД между событиями. На финальном статусе приходит событие end и поток
+# закрывается (клиент вызывает close()); если статус финальный уже при
+# подключении — 204, и EventSource перестаёт переподключаться. По
+# MAX_STREAM_SECONDS поток закрывается без end — EventSource переподключится
+# и получит свежий снимок.
+
+
+async def _aauthenticate_stream(request):
+    """EventSource не умеет заголовки — токен можно передать в ?token=."""
+    raw = request.GET.get("token")
+    if not raw or request.headers.get("Authorization"):
+        return await _aauthenticate(request)
+
+    def _auth():
+        auth = JWTAuthentication()
+        return auth.get_user(auth.get_validated_token(raw))
+
+    try:
+        return await sync_to_async(_auth)()
+    except AuthenticationFailed:
+        return None
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _sse_end(reason: str) -> str:
+    return _sse({"type": "end", "reason": reason})
+
+
+async def _payment_event_stream(payment):
+    cfg = settings.ORDER_EVENTS
+    hub = event_hub()
+    channel = cart_channel(payment.cart_id)
+    # сначала подписка, потом снимок: событие между ними окажется в очереди
+    queue = await hub.subscribe(channel)
+    try:
+        await payment.arefresh_from_db(fields=["status"])
+        snapshot = await sync_to_async(payment_events_snapshot)(payment)
+        yield f"retry: {cfg['RETRY_MS']}\n" + _sse(snapshot)
+        if payment_event_is_final(snapshot):
+            yield _sse_end("final")
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + cfg["MAX_STREAM_SECONDS"]
+        while True:
+            timeout = min(cfg["HEARTBEAT_SECONDS"], deadline - loop.time())
+            if timeout <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout)
+            except TimeoutError:
+                # комментарий держит соединение живым через прокси
+                yield ": ping\n\n"
+                continue
+            yield _sse(event)
+            if payment_event_is_final(event):
+                yield _sse_end("final")
+                return
+    finally:
+        await hub.unsubscribe(channel, queue)
+
+
+class PaymentEventsView(View):
+    """
+    GET /api/payments/events/<ident>  (ident = PaymentId или OrderId)
+    Server-sent events со статусом платежа и заказа своей корзины.
+    """
+
+    async def get(self, request, ident: str):
+        user = await _aauthenticate_stream(request)
+        if user is None:
+            return JsonResponse({"detail": "not_authenticated"}, status=401)
+
+        payment = await sync_to_async(_find_payment_by_ident)(ident)
+        if payment is None or not await Cart.objects.filter(
+            pk=payment.cart_id, client__user=user
+        ).aexists():
+            return JsonResponse({"detail": "payment_not_found"}, status=404)
+
+        # уже финальный статус: 204 — EventSource больше не переподключается
+        if payment_event_is_final(await sync_to_async(payment_events_snapshot)(payment)):
+            return HttpResponse(status=204)
+
+        response = StreamingHttpResponse(
+            _payment_event_stream(payment), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # nginx не должен буферизовать поток
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
 class PaymentSyncView(APIView):
     """
     Синхронизация статуса платежа.
@@ -222,17 +421,7 @@ class PaymentSyncView(APIView):
             )
 
         # 1) ищем локальный Payment
-        payment = None
-        if payment_id:
-            payment = (
-                Payment.objects.filter(payment_id=str(payment_id))
-                .order_by("-id")
-                .first()
-            )
-        if not payment and order_id:
-            payment = (
-                Payment.objects.filter(order_id=str(order_id)).order_by("-id").first()
-            )
+        payment = find_payment(payment_id=payment_id, order_id=order_id)
 
         if not payment:
             return Response(
@@ -240,30 +429,16 @@ class PaymentSyncView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        # 2) опрашиваем банк: по PaymentId или по OrderId (с fallback внутри get_state_by_order)
-        try:
-            if payment_id:
-                bank_state = TBankClient().get_state(payment_id=str(payment_id))
-            else:
-                bank_state = get_state_by_order(str(order_id))
-        except Exception as e:
-            return Response(
-                {"detail": f"tbank_request_error: {e.__class__.__name__}"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        # 3) сохраняем статус/сырой ответ
-        new_status = bank_state.get("Status") or payment.status or "NEW"
-        payment.status = new_status
-        payment.raw_last_callback = bank_state
-        payment.save(update_fields=["status", "raw_last_callback"])
-
-        success_flag = bank_state.get("Success") in (True, "true", "True", "1", 1)
-        status_upper = str(new_status or "").upper()
-
-        # 4) если успешно — сразу фиксируем заказ (status not_completed + is_ordered + бонусы)
-        if success_flag and status_upper in ("CONFIRMED", "AUTHORIZED"):
-            order_mark_paid_by_id(payment.cart_id)
+        # 2) состояние — локальное (его держат poller и webhook); банк спрашиваем,
+        #    только если оно устарело. Long-poll (wait/since) здесь нет: вызов
+        #    анонимный и синхронный — ожидание занимало бы поток и соединение с БД;
+        #    ждать смены статуса — через status/ или events/
+        if not payment_state_is_fresh(payment):
+            payment = refresh_payment_state(payment)
+        status_upper = str(payment.status or "").upper()
+        success_flag = (payment.raw_last_callback or {}).get("Success") in (
+            True, "true", "True", "1", 1,
+        )
 
         # 5) возвращаем данные (cart_total_sum берем из Cart)
         cart_total = "0.00"
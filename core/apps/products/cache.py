@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from typing import Iterable
+
+from apps.products.models import Favorite
+from django.conf import settings
+from django_redis import get_redis_connection
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# Теги записей кэша ответов каталога:
+#   p:<id>   — запись содержит товар <id> (деталка или элемент списка)
+#   c:<id>   — список отфильтрован по категории <id>
+#   c:all    — список без фильтра по категории (в него может попасть любой товар)
+#   catalog  — вообще все записи (смена бренда/категории и т.п.)
+TAG_ALL_CATEGORIES = "c:all"
+TAG_CATALOG = "catalog"
+
+
+def product_tag(product_id) -> str:
+    return f"p:{product_id}"
+
+
+def category_tag(category_id) -> str:
+    return f"c:{category_id}"
+
+
+def _conn():
+    """Как и recently_viewed: Redis не должен валить каталог."""
+    try:
+        return get_redis_connection("default")
+    except Exception as e:
+        logger.warning("catalog cache redis unavailable: %s", e)
+        return None
+
+
+def _key(*parts) -> str:
+    return ":".join([settings.CACHE_KEY_PREFIX, "catalog", *map(str, parts)])
+
+
+def _timeout() -> int:
+    return settings.CATALOG_CACHE["TIMEOUT"]
+
+
+def catalog_cache_key(kind: str, request) -> str:
+    """
+    Ключ по пути и нормализованным query-параметрам: порядок и пустые
+    значения не влияют. Хост входит в ключ — в ответе абсолютные next/previous.
+    """
+    params = sorted(
+        (k, v)
+        for k in request.query_params
+        for v in request.query_params.getlist(k)
+        if v != ""
+    )
+    raw = json.dumps([request.get_host(), request.path, params], ensure_ascii=False)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return _key("resp", kind, digest)
+
+
+def catalog_cache_get(key: str):
+    if not settings.CATALOG_CACHE["ENABLED"]:
+        return None
+    conn = _conn()
+    if conn is None:
+        return None
+    try:
+        # один round-trip: GET + счётчик обращений (промахи считает catalog_cache_set)
+        pipe = conn.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.incr(_key("stats", "lookups"))
+        raw, _ = pipe.execute()
+    except Exception as e:
+        logger.warning("catalog_cache_get failed: %s", e)
+        return None
+    return json.loads(raw) if raw is not None else None
+
+
+def catalog_cache_set(key: str, data, *, tags: Iterable[str]) -> None:
+    if not settings.CATALOG_CACHE["ENABLED"]:
+        return
+    conn = _conn()
+    if conn is None:
+        return
+    timeout = _timeout()
+    try:
+        pipe = conn.pipeline(transaction=False)
+        pipe.set(key, json.dumps(data, cls=JSONEncoder), ex=timeout)
+        pipe.incr(_key("stats", "misses"))
+        for tag in {*tags, TAG_CATALOG}:
+            tag_key = _key("tag", tag)
+            pipe.sadd(tag_key, key)
+            # тег живёт дольше записей, чтобы инвалидация их точно нашла
+            pipe.expire(tag_key, timeout * 2)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("catalog_cache_set failed: %s", e)
+
+
+def catalog_cache_invalidate(tags: Iterable[str]) -> None:
+    conn = _conn()
+    if conn is None:
+        return
+    tag_keys = [_key("tag", t) for t in set(tags)]
+    if not tag_keys:
+        return
+    try:
+        keys = conn.sunion(tag_keys)
+        pipe = conn.pipeline(transaction=False)
+        if keys:
+            pipe.delete(*keys)
+        pipe.delete(*tag_keys)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("catalog_cache_invalidate failed: %s", e)
+
+
+def invalidate_product_cache(product_id, *category_ids) -> None:
+    """
+    Товар изменился: его деталка, списки с ним, списки по его категориям
+    (старой и новой) и списки без фильтра по категории.
+    """
+    tags = [product_tag(product_id), TAG_ALL_CATEGORIES]
+    tags += [category_tag(cid) for cid in category_ids if cid]
+    catalog_cache_invalidate(tags)
+    bump_catalog_version()
+
+
+def invalidate_catalog_cache() -> None:
+    catalog_cache_invalidate([TAG_CATALOG])
+    bump_catalog_version(dims=True)
+
+
+# -----------------------------
+# Версии для ETag
+# -----------------------------
+#   v:catalog     — любое изменение каталога (ETag списков)
+#   v:dims        — категории/бренды: их имена есть и в деталке товара
+#   v:fav:<id>    — избранное клиента (is_favorited в выдаче)
+
+
+def catalog_version_key() -> str:
+    """Ключ версии каталога — чтобы читать его в одном MGET со своими ключами."""
+    return _key("v", "catalog")
+
+
+def bump_catalog_version(*, dims: bool = False) -> None:
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        pipe = conn.pipeline(transaction=False)
+        pipe.incr(_key("v", "catalog"))
+        if dims:
+            pipe.incr(_key("v", "dims"))
+        pipe.execute()
+    except Exception as e:
+        logger.warning("bump_catalog_version failed: %s", e)
+
+
+def bump_favorites_version(client_id) -> None:
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        conn.incr(_key("v", "fav", client_id))
+    except Exception as e:
+        logger.warning("bump_favorites_version failed: %s", e)
+
+
+def catalog_versions(client_id=None) -> dict | None:
+    """
+    {"catalog", "dims", "fav"} одним MGET; None — Redis недоступен,
+    и тогда ETag не отдаём (иначе можно ответить 304 на устаревшие данные).
+    """
+    conn = _conn()
+    if conn is None:
+        return None
+    keys = [_key("v", "catalog"), _key("v", "dims")]
+    if client_id:
+        keys.append(_key("v", "fav", client_id))
+    try:
+        values = conn.mget(keys)
+    except Exception as e:
+        logger.warning("catalog_versions failed: %s", e)
+        return None
+    catalog, dims, *fav = [int(v or 0) for v in values]
+    return {"catalog": catalog, "dims": dims, "fav": fav[0] if fav else None}
+
+
+def catalog_cache_stats() -> dict:
+    conn = _conn()
+    if conn is None:
+        return {"hits": 0, "misses": 0, "hit_rate": None}
+    try:
+        lookups, misses = conn.mget([_key("stats", "lookups"), _key("stats", "misses")])
+    except Exception as e:
+        logger.warning("catalog_cache_stats failed: %s", e)
+        return {"hits": 0, "misses": 0, "hit_rate": None}
+    lookups, misses = int(lookups or 0), int(misses or 0)
+    hits = max(lookups - misses, 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+    }
+
+
+def overlay_is_favorited(items: list[dict], user) -> list[dict]:
+    """
+    В кэше лежит «анонимная» выдача (is_favorited = False).
+    Для клиента проставляем флаг одним запросом по id товаров на странице.
+    """
+    if not items or not getattr(user, "is_authenticated", False):
+        return items
+    client_id = getattr(getattr(user, "client", None), "id", None)
+    if not client_id:
+        return items
+    ids = [it["id"] for it in items]
+    favorited = set(
+        Favorite.objects.filter(client_id=client_id, product_id__in=ids).values_list(
+            "product_id", flat=True
+        )
+    )
+    for it in items:
+        it["is_favorited"] = it["id"] in favorited
+    return items
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Iterable
+
+from apps.products.categories import category_tree
+from apps.products.models import Product, ProductListing, ProductVariant
+from apps.products.serializers import ProductListingSerializer
+from django.conf import settings
+from django_redis import get_redis_connection
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# Карточки — сериализованные фрагменты товара и варианта, общие для списков,
+# избранного, недавно просмотренных, корзин и деталей заказа:
+#   card:p:<id> — элемент списка товаров (формат ProductListSerializer, без is_favorited)
+#   card:v:<id> — вариант + вложенный фрагмент товара (формат позиций корзины)
+# Пачка id читается одним MGET, промахи добираются одним запросом и пишутся
+# одним pipeline. Сбрасываются из apps/products/signals.py.
+
+
+def _conn():
+    try:
+        return get_redis_connection("default")
+    except Exception as e:
+        logger.warning("product cards redis unavailable: %s", e)
+        return None
+
+
+def _key(kind: str, obj_id) -> str:
+    return f"{settings.CACHE_KEY_PREFIX}:card:{kind}:{obj_id}"
+
+
+def _image_url(name: str | None) -> str | None:
+    if not name:
+        return None
+    try:
+        return Product._meta.get_field("image").storage.url(name)
+    except Exception:
+        return None
+
+
+# -----------------------------
+# Сборка карточек из БД (один запрос на пачку)
+# -----------------------------
+
+
+def _build_product_cards(ids: list[int]) -> dict[int, dict]:
+    """Из витрины: там уже посчитаны min_price, sizes, путь категории — без join'ов."""
+    rows = ProductListing.objects.filter(product_id__in=ids)
+    out = {}
+    for row in rows:
+        data = dict(ProductListingSerializer(row).data)
+        data.pop("is_favorited", None)
+        out[row.product_id] = data
+    return out
+
+
+def _build_variant_cards(ids: list[int]) -> dict[int, dict]:
+    nodes = category_tree()
+    rows = ProductVariant.objects.filter(pk__in=ids).values(
+        "id",
+        "size_type",
+        "size_value",
+        "color",
+        "is_active",
+        "is_order",
+        "current_price",
+        "product_id",
+        "product__slug",
+        "product__name",
+        "product__image",
+        "product__is_active",
+        "product__brand__name",
+        "product__category_id",
+    )
+    out = {}
+    for r in rows:
+        category = nodes.get(r["product__category_id"])
+        out[r["id"]] = {
+            "id": r["id"],
+            "size_type": r["size_type"],
+            "size_value": r["size_value"],
+            "color": r["color"],
+            "in_stock": r["is_active"],
+            "is_order": r["is_order"],
+            "current_price": (
+                f"{r['current_price']:.2f}" if r["current_price"] is not None else None
+            ),
+            "product": {
+                "id": r["product_id"],
+                "slug": r["product__slug"],
+                "name": r["product__name"],
+                "image": _image_url(r["product__image"]),
+                "brand": r["product__brand__name"],
+                "category": category["name"] if category else None,
+                "is_active": r["product__is_active"],
+            },
+        }
+    return out
+
+
+def _get_many(kind: str, ids: Iterable[int], build) -> dict[int, dict]:
+    ids = list(dict.fromkeys(int(i) for i in ids))
+    if not ids:
+        return {}
+
+    conn = _conn()
+    found: dict[int, dict] = {}
+    if conn is not None:
+        try:
+            for obj_id, raw in zip(ids, conn.mget([_key(kind, i) for i in ids])):
+                if raw is not None:
+                    found[obj_id] = json.loads(raw)
+        except Exception as e:
+            logger.warning("product cards mget failed: %s", e)
+            conn = None
+
+    missing = [i for i in ids if i not in found]
+    if not missing:
+        return found
+
+    built = build(missing)
+    found.update(built)
+    if conn is not None and built:
+        timeout = settings.CATALOG_CACHE["TIMEOUT"]
+        try:
+            pipe = conn.pipeline(transaction=False)
+            for obj_id, card in built.items():
+                pipe.set(_key(kind, obj_id), json.dumps(card, cls=JSONEncoder), ex=timeout)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("product cards set failed: %s", e)
+    return found
+
+
+def product_cards(ids: Iterable[int]) -> dict[int, dict]:
+    """{product_id: карточка}; неактивных товаров (нет в витрине) в ответе нет."""
+    return _get_many("p", ids, _build_product_cards)
+
+
+def variant_cards(ids: Iterable[int]) -> dict[int, dict]:
+    """{variant_id: карточка варианта с фрагментом товара}; удалённых нет."""
+    return _get_many("v", ids, _build_variant_cards)
+
+
+# -----------------------------
+# Инвалидация (из сигналов)
+# -----------------------------
+
+
+def _delete(keys: list[str]) -> None:
+    if not keys:
+        return
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        conn.delete(*keys)
+    except Exception as e:
+        logger.warning("product cards delete failed: %s", e)
+
+
+def invalidate_product_cards(product_id) -> None:
+    """Карточка товара и карточки всех его вариантов (в них фрагмент товара)."""
+    variant_ids = ProductVariant.objects.filter(product_id=product_id).values_list(
+        "id", flat=True
+    )
+    _delete([_key("p", product_id), *(_key("v", vid) for vid in variant_ids)])
+
+
+def invalidate_variant_cards(variant_id, product_id) -> None:
+    # в карточке товара sizes / min_price / default_variant_id зависят от вариантов
+    _delete([_key("v", variant_id), _key("p", product_id)])
+
+
+def invalidate_all_cards() -> None:
+    """Категория/бренд изменились — их имена есть во всех карточках. Редкая операция."""
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        pattern = f"{settings.CACHE_KEY_PREFIX}:card:*"
+        batch = []
+        for key in conn.scan_iter(match=pattern, count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                conn.delete(*batch)
+                batch = []
+        if batch:
+            conn.delete(*batch)
+    except Exception as e:
+        logger.warning("invalidate_all_cards failed: %s", e)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import logging
+import time
+from functools import reduce
+from operator import or_
+
+from apps.products.models import Category
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
+
+logger = logging.getLogger(__name__)
+
+# Материализованный путь: id предков и самой категории через "/", с хвостовым "/".
+# Пример: корень 1 → "1/", его ребёнок 5 → "1/5/", внук 12 → "1/5/12/".
+PATH_SEP = "/"
+
+TREE_VERSION_KEY = "catalog:categories:v"
+# как часто (сек) воркер сверяет версию дерева с Redis
+TREE_CHECK_INTERVAL = 2.0
+
+_tree_state: dict = {"version": None, "checked_at": 0.0, "nodes": {}}
+
+
+def category_path_for(category: Category, parent: Category | None) -> tuple[str, int]:
+    prefix = parent.path if parent else ""
+    depth = parent.depth + 1 if parent else 0
+    return f"{prefix}{category.pk}{PATH_SEP}", depth
+
+
+def category_check_parent(category: Category) -> None:
+    """Категорию нельзя переносить внутрь её же поддерева."""
+    if not category.pk or not category.parent_id:
+        return
+    if category.parent_id == category.pk:
+        raise ValidationError("Категория не может быть родителем самой себя")
+    parent_path = (
+        Category.objects.filter(pk=category.parent_id)
+        .values_list("path", flat=True)
+        .first()
+    )
+    own_path = f"{PATH_SEP}{category.pk}{PATH_SEP}"
+    if parent_path and own_path in f"{PATH_SEP}{parent_path}":
+        raise ValidationError("Нельзя перенести категорию в её подкатегорию")
+
+
+def category_move_subtree(old_path: str, new_path: str, depth_delta: int) -> None:
+    """Переписываем пути всех потомков одним UPDATE."""
+    if not old_path or old_path == new_path:
+        return
+    Category.objects.filter(path__startswith=old_path).exclude(path=old_path).update(
+        path=Concat(Value(new_path), Substr("path", len(old_path) + 1)),
+        depth=F("depth") + depth_delta,
+    )
+
+
+def path_ids(path: str) -> list[int]:
+    return [int(i) for i in (path or "").split(PATH_SEP) if i]
+
+
+# -----------------------------
+# Кэш дерева категорий в памяти воркера
+# -----------------------------
+
+
+def bump_category_tree_version() -> None:
+    try:
+        try:
+            cache.incr(TREE_VERSION_KEY)
+        except ValueError:
+            cache.set(TREE_VERSION_KEY, 1, timeout=None)
+    except Exception as e:
+        logger.warning("bump_category_tree_version failed: %s", e)
+    # в своём процессе перечитываем дерево сразу, даже если Redis недоступен
+    _tree_state["version"] = None
+    _tree_state["checked_at"] = 0.0
+
+
+def category_tree() -> dict[int, dict]:
+    """
+    {id: {"name", "slug", "parent_id", "path"}} для всех категорий.
+    Категорий немного, поэтому держим их в памяти и перечитываем одним запросом,
+    только когда сигналы поднимут версию дерева.
+    """
+    now = time.monotonic()
+    if _tree_state["nodes"] and now - _tree_state["checked_at"] < TREE_CHECK_INTERVAL:
+        return _tree_state["nodes"]
+
+    try:
+        version = cache.get(TREE_VERSION_KEY) or 0
+    except Exception as e:
+        # Redis недоступен: версию не узнать — перечитываем дерево из БД
+        # (не чаще TREE_CHECK_INTERVAL), а после восстановления сверимся заново
+        logger.warning("category tree version unavailable: %s", e)
+        version = None
+    if version is None or version != _tree_state["version"]:
+        _tree_state["nodes"] = {
+            row["id"]: row
+            for row in Category.objects.values("id", "name", "slug", "parent_id", "path")
+        }
+        _tree_state["version"] = version
+    _tree_state["checked_at"] = now
+    return _tree_state["nodes"]
+
+
+def category_ancestors(category_id: int | None) -> list[dict]:
+    """Цепочка от корня до самой категории (хлебные крошки)."""
+    if not category_id:
+        return []
+    nodes = category_tree()
+    node = nodes.get(category_id)
+    if node is None:
+        # категорию могли создать в другом процессе — перечитываем дерево один раз
+        _tree_state["version"] = None
+        _tree_state["checked_at"] = 0.0
+        nodes = category_tree()
+        node = nodes.get(category_id)
+    if node is None:
+        return []
+    ids = path_ids(node["path"]) or [category_id]
+    return [nodes[i] for i in ids if i in nodes]
+
+
+def category_path_names(category_id: int | None) -> str | None:
+    """«Родитель - Ребёнок - Внук», как раньше отдавал get_category_path."""
+    chain = category_ancestors(category_id)
+    if not chain:
+        return None
+    return " - ".join(c["name"] for c in chain)
+
+
+def category_subtree_q(paths, *, field: str = "path") -> Q | None:
+    """Q «категория + все потомки на любой глубине» по префиксу пути."""
+    paths = [p for p in paths if p]
+    if not paths:
+        return None
+    return reduce(or_, (Q(**{f"{field}__startswith": p}) for p in paths))
+
+
+def category_descendant_ids(category_id: int) -> set[int]:
+    """Сама категория + все дочерние на любой глубине (одним запросом)."""
+    path = Category.objects.filter(pk=category_id).values_list("path", flat=True).first()
+    if not path:
+        return {category_id}
+    return set(
+        Category.objects.filter(path__startswith=path).values_list("id", flat=True)
+    )
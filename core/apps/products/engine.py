@@ -0,0 +1,436 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal, InvalidOperation
+from typing import Iterable
+
+from apps.products.categories import category_tree
+from apps.products.selectors import _russian_stem, _truthy, get_product_listing_qs
+from apps.products.serializers import ProductListingSerializer
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Параметры, которые движок умеет отвечать из памяти. Всё остальное
+# (?q=, ?ordering=, keyset-курсоры, ...) уходит в обычный SQL-путь.
+ENGINE_PARAMS = frozenset(
+    {
+        "category",
+        "group",
+        "parent",
+        "brand",
+        "sizes",
+        "popular",
+        "is_hit",
+        "is_new",
+        "is_sale",
+        "in_stock",
+        "price_min",
+        "price_max",
+        "limit",
+        "page",
+    }
+)
+
+# in_stock — BooleanFilter из ProductFilter (NullBooleanSelect): остальное игнорирует
+_FILTER_TRUE = ("true", "True", "2")
+_FILTER_FALSE = ("false", "False", "3")
+
+_POPCOUNT = bytes(bin(i).count("1") for i in range(256))
+
+# Атомарно: поднять версию и записать в журнал, какие товары ею изменены
+_MARK_CHANGED_LUA = """
+local v = redis.call('INCR', KEYS[1])
+for i = 1, #ARGV do
+    redis.call('ZADD', KEYS[2], v, ARGV[i])
+end
+return v
+"""
+
+
+def _key(*parts) -> str:
+    return ":".join([settings.CACHE_KEY_PREFIX, "catalog", "engine", *map(str, parts)])
+
+
+def _conn():
+    try:
+        return get_redis_connection("default")
+    except Exception as e:
+        logger.warning("catalog engine redis unavailable: %s", e)
+        return None
+
+
+def _enabled() -> bool:
+    return settings.CATALOG_ENGINE["ENABLED"]
+
+
+# -----------------------------
+# Журнал изменений (пишут сигналы через refresh_product_listings)
+# -----------------------------
+
+
+def catalog_engine_mark_changed(product_ids: Iterable[int]) -> None:
+    """
+    Поднимает версию каталога и отмечает товары в журнале (ZSET pid → версия).
+    Воркеры по журналу перечитывают только изменившиеся строки витрины.
+    """
+    if not _enabled():
+        return
+    ids = [str(int(pid)) for pid in product_ids]
+    if not ids:
+        return
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        conn.eval(_MARK_CHANGED_LUA, 2, _key("v"), _key("log"), *ids)
+    except Exception as e:
+        logger.warning("catalog_engine_mark_changed failed: %s", e)
+
+
+def catalog_engine_mark_changed_on_commit(product_ids: Iterable[int]) -> None:
+    ids = list(product_ids)
+    transaction.on_commit(lambda: catalog_engine_mark_changed(ids))
+
+
+# -----------------------------
+# Битсеты
+# -----------------------------
+
+
+def _bits(positions: Iterable[int], size: int) -> int:
+    """Набор позиций → битсет (int). Через bytearray, чтобы не гонять big-int в цикле."""
+    buf = bytearray((size + 7) // 8)
+    for i in positions:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _select(mask: int, size: int, start: int, stop: int) -> list[int]:
+    """Позиции установленных битов с номерами [start, stop) по возрастанию."""
+    out: list[int] = []
+    if stop <= start:
+        return out
+    seen = 0
+    for byte_no, byte in enumerate(mask.to_bytes((size + 7) // 8, "little")):
+        if not byte:
+            continue
+        cnt = _POPCOUNT[byte]
+        if seen + cnt <= start:
+            seen += cnt
+            continue
+        base = byte_no << 3
+        while byte:
+            low = byte & -byte
+            if seen >= start:
+                out.append(base + low.bit_length() - 1)
+                if len(out) == stop - start:
+                    return out
+            seen += 1
+            byte ^= low
+    return out
+
+
+class _Index:
+    """
+    Колоночный снимок витрины. Позиция строки = её место в порядке выдачи
+    (-product_id), поэтому результат фильтра — это просто биты по возрастанию.
+    """
+
+    def __init__(self, rows: dict[int, dict]):
+        order = sorted(rows, reverse=True)
+        self.size = size = len(order)
+        self.ids = array("q", order)
+        self.items = [rows[pid]["item"] for pid in order]
+
+        brand: dict[int, list[int]] = {}
+        category: dict[int, list[int]] = {}
+        sizes: dict[str, list[int]] = {}
+        flags: dict[str, list[int]] = {"is_hit": [], "is_new": [], "is_sale": [], "in_stock": []}
+        priced: list[tuple[Decimal, int]] = []
+
+        for pos, pid in enumerate(order):
+            row = rows[pid]
+            brand.setdefault(row["brand_id"], []).append(pos)
+            category.setdefault(row["category_id"], []).append(pos)
+            for s in row["sizes"]:
+                sizes.setdefault(s, []).append(pos)
+            for flag, positions in flags.items():
+                if row[flag]:
+                    positions.append(pos)
+            if row["min_price"] is not None:
+                priced.append((row["min_price"], pos))
+
+        self.all = (1 << size) - 1
+        self.by_brand = {k: _bits(v, size) for k, v in brand.items()}
+        self.by_category = {k: _bits(v, size) for k, v in category.items()}
+        self.by_size = {k: _bits(v, size) for k, v in sizes.items()}
+        self.flags = {k: _bits(v, size) for k, v in flags.items()}
+
+        priced.sort()
+        self.price_keys = [p for p, _ in priced]
+        self.price_pos = [pos for _, pos in priced]
+
+    def price_range(self, lo: Decimal | None, hi: Decimal | None) -> int:
+        start = bisect_left(self.price_keys, lo) if lo is not None else 0
+        stop = bisect_right(self.price_keys, hi) if hi is not None else len(self.price_keys)
+        return _bits(self.price_pos[start:stop], self.size)
+
+
+class EngineResult:
+    """
+    Ленивая «выдача» для PageNumberPagination: len() — popcount маски,
+    срез — только нужные позиции, без материализации всего списка.
+    """
+
+    def __init__(self, index: _Index, mask: int, limit: int | None = None):
+        self.index = index
+        self.mask = mask
+        self.total = mask.bit_count()
+        if limit is not None:
+            self.total = min(self.total, limit)
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("EngineResult supports slicing only")
+        start, stop, _ = key.indices(self.total)
+        positions = _select(self.mask, self.index.size, start, stop)
+        # копии: поверх выдачи потом накладывается is_favorited
+        return [dict(self.index.items[pos]) for pos in positions]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+class CatalogEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: dict[int, dict] = {}
+        self.index: _Index | None = None
+        self.version: int | None = None
+        self.checked_at = 0.0
+
+    # ----- загрузка -----
+
+    @staticmethod
+    def _load_rows(product_ids=None) -> dict[int, dict]:
+        qs = get_product_listing_qs(user=None).order_by()
+        if product_ids is not None:
+            qs = qs.filter(product_id__in=product_ids)
+        rows = {}
+        for obj in qs.iterator(chunk_size=2000):
+            rows[obj.product_id] = {
+                "item": dict(ProductListingSerializer(obj).data),
+                "brand_id": obj.brand_id,
+                "category_id": obj.category_id,
+                "sizes": list(obj.sizes or []),
+                "is_hit": obj.is_hit,
+                "is_new": obj.is_new,
+                "is_sale": obj.is_sale,
+                "in_stock": obj.active_variants_count > 0,
+                "min_price": obj.min_price,
+            }
+        return rows
+
+    def sync(self) -> bool:
+        """
+        Сверяет версию с Redis не чаще CHECK_INTERVAL. При расхождении
+        перечитывает из витрины только товары из журнала изменений.
+        False — снимок не гарантированно свежий, отвечать из памяти нельзя.
+        """
+        now = time.monotonic()
+        if (
+            self.index is not None
+            and now - self.checked_at < settings.CATALOG_ENGINE["CHECK_INTERVAL"]
+        ):
+            return True
+
+        with self._lock:
+            if (
+                self.index is not None
+                and time.monotonic() - self.checked_at
+                < settings.CATALOG_ENGINE["CHECK_INTERVAL"]
+            ):
+                return True
+            conn = _conn()
+            if conn is None:
+                return False
+            try:
+                version = int(conn.get(_key("v")) or 0)
+                if self.index is None or self.version is None or version < self.version:
+                    # первая загрузка или Redis потерял счётчик — читаем всё
+                    self._rows = self._load_rows()
+                elif version > self.version:
+                    changed = [
+                        int(pid)
+                        for pid in conn.zrangebyscore(
+                            _key("log"), f"({self.version}", version
+                        )
+                    ]
+                    fresh = self._load_rows(changed)
+                    for pid in changed:
+                        self._rows.pop(pid, None)
+                    self._rows.update(fresh)
+                else:
+                    self.checked_at = time.monotonic()
+                    return True
+            except Exception as e:
+                logger.warning("catalog engine sync failed: %s", e)
+                return False
+
+            self.index = _Index(self._rows)
+            self.version = version
+            self.checked_at = time.monotonic()
+            return True
+
+    # ----- запрос -----
+
+    def _category_mask(self, index: _Index, cat: str, group: str) -> int | None:
+        """Те же правила, что и selectors._resolve_categories, но по дереву в памяти."""
+        nodes = category_tree().values()
+
+        def matcher(name: str):
+            name_l = name.lower()
+            stem = _russian_stem(name)
+
+            def match(node) -> bool:
+                n = (node["name"] or "").lower()
+                return (
+                    n == name_l
+                    or name_l in n
+                    or bool(stem and stem != name_l and n.startswith(stem))
+                )
+
+            return match
+
+        ids: list[int] = []
+        if cat and group:
+            match_cat, match_grp = matcher(cat), matcher(group)
+            parents = [n["path"] for n in nodes if match_grp(n) and n["path"]]
+            ids = [
+                n["id"]
+                for n in nodes
+                if match_cat(n)
+                and n["path"] not in parents
+                and any(n["path"].startswith(p) for p in parents)
+            ]
+            if not ids:
+                cat_l, group_l = cat.lower(), group.lower()
+                ids = [
+                    n["id"]
+                    for n in nodes
+                    if cat_l in (n["name"] or "").lower()
+                    and group_l in (n["name"] or "").lower()
+                ]
+        elif cat:
+            match_cat = matcher(cat)
+            ids = [n["id"] for n in nodes if match_cat(n)]
+        elif group:
+            match_grp = matcher(group)
+            parents = [n["path"] for n in nodes if match_grp(n) and n["path"]]
+            ids = [
+                n["id"] for n in nodes if any(n["path"].startswith(p) for p in parents)
+            ]
+        else:
+            return None
+
+        mask = 0
+        for cid in ids:
+            mask |= index.by_category.get(cid, 0)
+        return mask
+
+    def query(self, query_params) -> EngineResult | None:
+        """
+        Отвечает на фильтры ProductListView из памяти. None — параметры
+        не поддерживаются (или не разобрались): пусть отвечает SQL.
+        """
+        qp = query_params
+        if any(k not in ENGINE_PARAMS for k in qp if qp.get(k, "") != ""):
+            return None
+        if not self.sync():
+            return None
+        index = self.index
+        mask = index.all
+
+        try:
+            # ----- КАТЕГОРИИ -----
+            cat = (qp.get("category") or "").strip()
+            group = (qp.get("group") or qp.get("parent") or "").strip()
+            if cat.isdigit():
+                mask &= index.by_category.get(int(cat), 0)
+                cat = ""
+            cat_mask = self._category_mask(index, cat, group)
+            if cat_mask is not None:
+                mask &= cat_mask
+
+            # ----- БРЕНД -----
+            brand = qp.get("brand")
+            if brand:
+                mask &= index.by_brand.get(int(brand), 0)
+
+            # ----- РАЗМЕРЫ -----
+            size_list = [
+                s.strip() for s in (qp.get("sizes") or "").split(",") if s.strip()
+            ]
+            if size_list:
+                sizes_mask = 0
+                for s in size_list:
+                    sizes_mask |= index.by_size.get(s, 0)
+                mask &= sizes_mask
+
+            # ----- ФЛАГИ -----
+            # как в filter_product_listing: хит/новинка/скидка только «включают»
+            # фильтр (?is_sale=false игнорируется), in_stock — да/нет
+            if _truthy(qp.get("popular")) or _truthy(qp.get("is_hit")):
+                mask &= index.flags["is_hit"]
+            for flag in ("is_new", "is_sale"):
+                if _truthy(qp.get(flag)):
+                    mask &= index.flags[flag]
+            in_stock = qp.get("in_stock")
+            if in_stock in _FILTER_TRUE:
+                mask &= index.flags["in_stock"]
+            elif in_stock in _FILTER_FALSE:
+                mask &= ~index.flags["in_stock"] & index.all
+
+            # ----- ЦЕНА -----
+            lo = Decimal(qp["price_min"]) if qp.get("price_min") else None
+            hi = Decimal(qp["price_max"]) if qp.get("price_max") else None
+            if lo is not None or hi is not None:
+                mask &= index.price_range(lo, hi)
+
+            limit = None
+            limit_raw = qp.get("limit")
+            if limit_raw and int(limit_raw) > 0:
+                limit = int(limit_raw)
+        except (TypeError, ValueError, InvalidOperation):
+            return None
+
+        return EngineResult(index, mask, limit=limit)
+
+
+_engine = CatalogEngine()
+
+
+def catalog_engine_query(query_params) -> EngineResult | None:
+    if not _enabled():
+        return None
+    return _engine.query(query_params)
+
+
+def catalog_engine_warmup() -> None:
+    """Загрузка снимка при старте воркера, чтобы первый запрос не платил за неё."""
+    if not _enabled():
+        return
+    try:
+        _engine.sync()
+    except Exception as e:
+        logger.warning("catalog engine warmup failed: %s", e)
@@ -1,6 +1,6 @@
 import django_filters
 from django.db.models import F
-from apps.products.models import Product
+from apps.products.models import ProductListing
 
 
 class ProductFilter(django_filters.FilterSet):
@@ -12,29 +12,25 @@ class ProductFilter(django_filters.FilterSet):
         field_name='category_id',
         lookup_expr='exact',
     )
-    is_sale = django_filters.BooleanFilter(
-        field_name='is_sale',
-    )
-    is_new = django_filters.BooleanFilter(
-        field_name='is_new',
-    )
+    # is_hit / is_new / is_sale здесь нет: флаги работают только как «включить»
+    # (?is_sale=false игнорируется) и разбираются в selectors.filter_product_listing
     in_stock = django_filters.BooleanFilter(
         method='filter_in_stock',
     )
     price_min = django_filters.NumberFilter(
-        field_name='price',
+        field_name='min_price',
         lookup_expr='gte'
     )
     price_max = django_filters.NumberFilter(
-        field_name='price',
+        field_name='min_price',
         lookup_expr='lte'
     )
     
     def filter_in_stock(self, queryset, name, value):
         if value is True:
-            return queryset.filter(variants_count__gt=0)
+            return queryset.filter(active_variants_count__gt=0)
         if value is False:
-            return queryset.filter(variants_count__lte=0)
+            return queryset.filter(active_variants_count__lte=0)
         return queryset
     
     def filter_price_min(self, queryset, name, value):
@@ -44,6 +40,6 @@ class ProductFilter(django_filters.FilterSet):
         return queryset.filter(min_price__lte=value)
     
     class Meta:
-        model = Product
+        model = ProductListing
         fields = []
     
\ No newline at end of file
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from apps.products.categories import (
+    category_descendant_ids,
+    category_path_names,
+)
+from apps.products.engine import catalog_engine_mark_changed_on_commit
+from apps.products.models import (
+    Product,
+    ProductListing,
+    ProductVariant,
+)
+from django.contrib.postgres.search import SearchVector
+from django.db.models import OuterRef, Subquery
+
+# Конфигурация полнотекстового поиска Postgres (стемминг для русского)
+SEARCH_CONFIG = "russian"
+
+LISTING_FIELDS = (
+    "name",
+    "slug",
+    "image",
+    "price",
+    "sale",
+    "is_sale",
+    "is_new",
+    "is_hit",
+    "brand",
+    "brand_name",
+    "category",
+    "category_path",
+    "min_price",
+    "active_variants_count",
+    "sizes",
+    "default_variant_id",
+    "updated_at",
+)
+
+BATCH_SIZE = 500
+
+
+def _build_row(product: Product, variants: list[dict]) -> ProductListing:
+    prices = [v["current_price"] for v in variants if v["current_price"] is not None]
+    sizes = sorted({v["size_value"] for v in variants if v["size_value"]}, key=str)
+    return ProductListing(
+        product_id=product.id,
+        name=product.name,
+        slug=product.slug,
+        image=product.image.name if product.image else None,
+        price=product.price,
+        sale=product.sale,
+        is_sale=product.is_sale,
+        is_new=product.is_new,
+        is_hit=product.is_hit,
+        brand_id=product.brand_id,
+        brand_name=product.brand.name,
+        category_id=product.category_id,
+        category_path=category_path_names(product.category_id) or "",
+        min_price=min(prices) if prices else None,
+        active_variants_count=len(variants),
+        sizes=sizes,
+        default_variant_id=variants[0]["id"] if variants else None,
+    )
+
+
+def listing_search_vector():
+    """
+    tsvector для витрины: название (A), бренд (B), путь категории (C)
+    и описание товара (D) — описание в витрине не храним, берём из Product.
+    """
+    description = Subquery(
+        Product.objects.filter(pk=OuterRef("product_id")).values("description")[:1]
+    )
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("brand_name", weight="B", config=SEARCH_CONFIG)
+        + SearchVector("category_path", weight="C", config=SEARCH_CONFIG)
+        + SearchVector(description, weight="D", config=SEARCH_CONFIG)
+    )
+
+
+def refresh_product_listings(product_ids: Iterable[int]) -> None:
+    """
+    Пересобирает строки витрины для заданных товаров.
+    Неактивные/удалённые товары из витрины убираются.
+    """
+    ids = sorted({int(pid) for pid in product_ids})
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start : start + BATCH_SIZE]
+
+        products = list(
+            Product.objects.select_related("brand").filter(pk__in=batch, is_active=True)
+        )
+        active_ids = {p.id for p in products}
+
+        variants_by_product: dict[int, list[dict]] = {pid: [] for pid in active_ids}
+        for v in (
+            ProductVariant.objects.filter(product_id__in=active_ids, is_active=True)
+            .order_by("id")
+            .values("id", "product_id", "size_value", "current_price")
+        ):
+            variants_by_product[v["product_id"]].append(v)
+
+        ProductListing.objects.filter(product_id__in=batch).exclude(
+            product_id__in=active_ids
+        ).delete()
+
+        rows = [_build_row(p, variants_by_product[p.id]) for p in products]
+        if rows:
+            ProductListing.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["product"],
+                update_fields=LISTING_FIELDS,
+            )
+            ProductListing.objects.filter(product_id__in=active_ids).update(
+                search_vector=listing_search_vector()
+            )
+
+        # in-process движок каталога перечитает эти строки по журналу
+        catalog_engine_mark_changed_on_commit(batch)
+
+
+def refresh_product_listing(product_id: int) -> None:
+    refresh_product_listings([product_id])
+
+
+def refresh_listings_for_category(category_id: int) -> None:
+    ids = Product.objects.filter(
+        category_id__in=category_descendant_ids(category_id)
+    ).values_list("id", flat=True)
+    refresh_product_listings(ids)
+
+
+def refresh_listings_for_brand(brand_id: int) -> None:
+    refresh_product_listings(
+        Product.objects.filter(brand_id=brand_id).values_list("id", flat=True)
+    )
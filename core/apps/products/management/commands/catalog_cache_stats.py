@@ -0,0 +1,14 @@
+from apps.products.cache import catalog_cache_stats
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Попадания/промахи кэша ответов каталога"
+
+    def handle(self, *args, **options):
+        stats = catalog_cache_stats()
+        rate = stats["hit_rate"]
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} "
+            f"hit_rate={'-' if rate is None else f'{rate:.2%}'}"
+        )
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:28
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_product_listing(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    ProductVariant = apps.get_model("products", "ProductVariant")
+    ProductListing = apps.get_model("products", "ProductListing")
+
+    variants = {}
+    for v in (
+        ProductVariant.objects.filter(is_active=True, product__is_active=True)
+        .order_by("id")
+        .values("id", "product_id", "size_value", "current_price")
+    ):
+        variants.setdefault(v["product_id"], []).append(v)
+
+    rows = []
+    for p in Product.objects.filter(is_active=True).select_related("brand", "category"):
+        names = []
+        cat = p.category
+        while cat:
+            names.append(cat.name)
+            cat = cat.parent
+        vs = variants.get(p.id, [])
+        prices = [v["current_price"] for v in vs if v["current_price"] is not None]
+        rows.append(
+            ProductListing(
+                product_id=p.id,
+                name=p.name,
+                slug=p.slug,
+                image=p.image.name if p.image else None,
+                price=p.price,
+                sale=p.sale,
+                is_sale=p.is_sale,
+                is_new=p.is_new,
+                is_hit=p.is_hit,
+                brand_id=p.brand_id,
+                brand_name=p.brand.name,
+                category_id=p.category_id,
+                category_path=" - ".join(reversed(names)),
+                min_price=min(prices) if prices else None,
+                active_variants_count=len(vs),
+                sizes=sorted({v["size_value"] for v in vs if v["size_value"]}, key=str),
+                default_variant_id=vs[0]["id"] if vs else None,
+            )
+        )
+    ProductListing.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_is_hit'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'ordering': ['-id'], 'verbose_name': 'Товар', 'verbose_name_plural': 'Товары'},
+        ),
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='products.product', verbose_name='Товар')),
+                ('name', models.CharField(max_length=255, verbose_name='Название товара')),
+                ('slug', models.SlugField(max_length=255, verbose_name='URL-идентификатор')),
+                ('image', models.ImageField(blank=True, null=True, upload_to='productiproducts_image/', verbose_name='Изображение')),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Цена для отображения')),
+                ('sale', models.PositiveIntegerField(default=0, verbose_name='Скидка (%)')),
+                ('is_sale', models.BooleanField(default=False, verbose_name='Распродажный товар')),
+                ('is_new', models.BooleanField(default=False, verbose_name='Новый товар')),
+                ('is_hit', models.BooleanField(default=False, verbose_name='Хит')),
+                ('brand_name', models.CharField(max_length=255, verbose_name='Название бренда')),
+                ('category_path', models.CharField(blank=True, max_length=1024, verbose_name='Путь категории')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Минимальная цена активного варианта')),
+                ('active_variants_count', models.PositiveIntegerField(default=0, verbose_name='Активных вариантов')),
+                ('sizes', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), blank=True, default=list, size=None, verbose_name='Размеры в наличии')),
+                ('default_variant_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Вариант по умолчанию')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.brand', verbose_name='Бренд')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Витрина товара',
+                'verbose_name_plural': 'Витрина каталога',
+                'ordering': ['-product'],
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['sizes'], name='listing_sizes_gin'), models.Index(fields=['min_price'], name='listing_min_price_idx'), models.Index(condition=models.Q(('is_hit', True)), fields=['-product'], name='listing_hit_idx'), models.Index(condition=models.Q(('is_new', True)), fields=['-product'], name='listing_new_idx'), models.Index(condition=models.Q(('is_sale', True)), fields=['-product'], name='listing_sale_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_product_listing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def fill_search_vector(apps, schema_editor):
+    Product = apps.get_model("products", "Product")
+    ProductListing = apps.get_model("products", "ProductListing")
+    description = Subquery(
+        Product.objects.filter(pk=OuterRef("product_id")).values("description")[:1]
+    )
+    ProductListing.objects.update(
+        search_vector=SearchVector("name", weight="A", config="russian")
+        + SearchVector("brand_name", weight="B", config="russian")
+        + SearchVector("category_path", weight="C", config="russian")
+        + SearchVector(description, weight="D", config="russian")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_productlisting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlisting',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddIndex(
+            model_name='productlisting',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='listing_search_gin'),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+def fill_category_paths(apps, schema_editor):
+    Category = apps.get_model("products", "Category")
+    level = list(Category.objects.filter(parent__isnull=True))
+    depth = 0
+    seen = set()
+    while level:
+        for cat in level:
+            parent_path = cat.parent.path if cat.parent_id else ""
+            cat.path = f"{parent_path}{cat.pk}/"
+            cat.depth = depth
+            seen.add(cat.pk)
+        Category.objects.bulk_update(level, ["path", "depth"])
+        level = list(
+            Category.objects.filter(parent_id__in=[c.pk for c in level])
+            .exclude(pk__in=seen)
+            .select_related("parent")
+        )
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_productlisting_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень вложенности'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_like_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import Q
 from django.urls import reverse
 
 
@@ -34,6 +38,19 @@ class Category(models.Model):
         blank=True,
         db_index=True,
     )
+    # материализованный путь "1/5/12/" (поддерживается сигналами, см. categories.py)
+    path = models.CharField(
+        "Путь в дереве",
+        max_length=255,
+        blank=True,
+        default="",
+        editable=False,
+    )
+    depth = models.PositiveSmallIntegerField(
+        "Уровень вложенности",
+        default=0,
+        editable=False,
+    )
 
     def __str__(self):
         if self.parent:
@@ -44,6 +61,13 @@ class Category(models.Model):
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
         ordering = ["name"]
+        indexes = [
+            models.Index(
+                fields=["path"],
+                name="category_path_like_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
 
 
 class Product(models.Model):
@@ -108,6 +132,12 @@ class Product(models.Model):
         null=True,
         blank=True,
     )
+    # растёт при каждом изменении товара или его вариантов (см. signals) — для ETag
+    version = models.PositiveIntegerField(
+        verbose_name="Версия",
+        default=1,
+        editable=False,
+    )
 
     def __str__(self):
         return f"{self.name}"
@@ -211,3 +241,112 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f"{self.client_id} ♥ {self.product_id}"
+
+
+class ProductListing(models.Model):
+    """
+    Денормализованная строка каталога: одна на активный товар.
+    Поддерживается сигналами apps/products/signals.py (см. apps/products/listing.py),
+    чтобы список товаров читался без Count/Min по вариантам и без .distinct().
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="listing",
+        verbose_name="Товар",
+    )
+    name = models.CharField(max_length=255, verbose_name="Название товара")
+    slug = models.SlugField(max_length=255, verbose_name="URL-идентификатор")
+    image = models.ImageField(
+        upload_to="productiproducts_image/",
+        verbose_name="Изображение",
+        blank=True,
+        null=True,
+    )
+    price = models.DecimalField(
+        verbose_name="Цена для отображения",
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+    )
+    sale = models.PositiveIntegerField(verbose_name="Скидка (%)", default=0)
+    is_sale = models.BooleanField(verbose_name="Распродажный товар", default=False)
+    is_new = models.BooleanField(verbose_name="Новый товар", default=False)
+    is_hit = models.BooleanField(verbose_name="Хит", default=False)
+    brand = models.ForeignKey(
+        Brand,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Бренд",
+    )
+    brand_name = models.CharField(max_length=255, verbose_name="Название бренда")
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Категория",
+    )
+    category_path = models.CharField(
+        max_length=1024,
+        verbose_name="Путь категории",
+        blank=True,
+    )
+    min_price = models.DecimalField(
+        verbose_name="Минимальная цена активного варианта",
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+    )
+    active_variants_count = models.PositiveIntegerField(
+        verbose_name="Активных вариантов",
+        default=0,
+    )
+    sizes = ArrayField(
+        models.CharField(max_length=50),
+        verbose_name="Размеры в наличии",
+        default=list,
+        blank=True,
+    )
+    default_variant_id = models.PositiveBigIntegerField(
+        verbose_name="Вариант по умолчанию",
+        null=True,
+        blank=True,
+    )
+    search_vector = SearchVectorField(
+        verbose_name="Поисковый вектор",
+        null=True,
+        editable=False,
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}"
+
+    class Meta:
+        verbose_name = "Витрина товара"
+        verbose_name_plural = "Витрина каталога"
+        ordering = ["-product"]
+        indexes = [
+            GinIndex(fields=["sizes"], name="listing_sizes_gin"),
+            GinIndex(fields=["search_vector"], name="listing_search_gin"),
+            models.Index(fields=["min_price"], name="listing_min_price_idx"),
+            models.Index(
+                fields=["-product"],
+                condition=Q(is_hit=True),
+                name="listing_hit_idx",
+            ),
+            models.Index(
+                fields=["-product"],
+                condition=Q(is_new=True),
+                name="listing_new_idx",
+            ),
+            models.Index(
+                fields=["-product"],
+                condition=Q(is_sale=True),
+                name="listing_sale_idx",
+            ),
+        ]
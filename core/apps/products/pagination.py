@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, replace_query_param
+from rest_framework.response import Response
+
+
+def keyset_requested(request) -> bool:
+    """Keyset-режим включается явно: ?pagination=cursor или уже полученным ?cursor=."""
+    qp = request.query_params
+    return (
+        qp.get(KeysetPagination.mode_query_param) == "cursor"
+        or KeysetPagination.cursor_query_param in qp
+    )
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) пагинация без COUNT(*) и OFFSET.
+
+    Порядок берётся из order_by() queryset'а (или Meta.ordering) и дополняется
+    первичным ключом как tie-breaker'ом. Следующая страница — это
+    WHERE (k1, ..., pk) «после» последней строки, поэтому страница N стоит
+    столько же, сколько первая. Курсоры непрозрачные (base64 JSON).
+
+    NULL'ы учитываются так же, как их сортирует Postgres:
+    ASC — в конце, DESC — в начале.
+    """
+
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    page_size_query_param = "page_size"
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        self.attnames = [self._attname(queryset.model, f) for f, _ in self.ordering]
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor["r"])
+        if cursor:
+            queryset = queryset.filter(
+                self._seek_q(self.ordering, cursor["v"], reverse=reverse)
+            )
+        queryset = queryset.order_by(*self._order_by(self.ordering, reverse=reverse))
+
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        has_next = True if reverse else has_more
+        has_prev = has_more if reverse else cursor is not None
+
+        self.next_values = self._row_values(rows[-1]) if rows and has_next else None
+        self.prev_values = self._row_values(rows[0]) if rows and has_prev else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    # ----- порядок и условие «после курсора» -----
+
+    def get_ordering(self, queryset) -> list[tuple[str, bool]]:
+        """[(поле, desc), ...] + pk последним, чтобы ключ был уникальным."""
+        model = queryset.model
+        raw = list(queryset.query.order_by) or list(model._meta.ordering or [])
+        if not all(isinstance(o, str) for o in raw):
+            raw = []
+
+        ordering = []
+        for o in raw:
+            desc = o.startswith("-")
+            ordering.append((o.lstrip("-"), desc))
+
+        pk = model._meta.pk
+        names = {f for f, _ in ordering}
+        if not names & {"pk", pk.name, pk.attname}:
+            ordering.append((pk.attname, ordering[0][1] if ordering else True))
+        return ordering
+
+    @staticmethod
+    def _attname(model, name: str) -> str:
+        if name == "pk":
+            return model._meta.pk.attname
+        try:
+            return model._meta.get_field(name).attname
+        except FieldDoesNotExist:
+            return name
+
+    @staticmethod
+    def _order_by(ordering, *, reverse: bool) -> list[str]:
+        return [f"{'-' if desc != reverse else ''}{f}" for f, desc in ordering]
+
+    @staticmethod
+    def _after_q(field: str, desc: bool, value) -> Q:
+        if value is None:
+            # NULL'ы — в конце ASC и в начале DESC
+            return Q(**{f"{field}__isnull": False}) if desc else Q(pk__in=[])
+        if desc:
+            return Q(**{f"{field}__lt": value})
+        return Q(**{f"{field}__gt": value}) | Q(**{f"{field}__isnull": True})
+
+    @staticmethod
+    def _equal_q(field: str, value) -> Q:
+        if value is None:
+            return Q(**{f"{field}__isnull": True})
+        return Q(**{field: value})
+
+    def _seek_q(self, ordering, values, *, reverse: bool) -> Q:
+        result = Q(pk__in=[])
+        prefix = Q()
+        for (field, desc), value in zip(ordering, values):
+            result |= prefix & self._after_q(field, desc != reverse, value)
+            prefix &= self._equal_q(field, value)
+        return result
+
+    # ----- курсоры -----
+
+    def _row_values(self, row) -> list:
+        return [getattr(row, name) for name in self.attnames]
+
+    @staticmethod
+    def _dump(value):
+        if isinstance(value, Decimal):
+            return str(value)
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value
+
+    def encode_cursor(self, values, *, reverse: bool) -> str:
+        payload = {"v": [self._dump(v) for v in values], "r": int(reverse)}
+        raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        token = base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, token
+        )
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            payload = json.loads(raw)
+            values = payload["v"]
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError("cursor does not match ordering")
+            values = [
+                self._load(field, value) for (field, _), value in zip(self.ordering, values)
+            ]
+            return {"v": values, "r": bool(payload.get("r"))}
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _load(self, name: str, value):
+        """Значение из курсора — к типу поля; мусор не доходит до SQL."""
+        if value is None:
+            return None
+        if isinstance(value, (dict, list)):
+            raise ValueError("cursor value must be scalar")
+        try:
+            field = (
+                self.model._meta.pk
+                if name == "pk"
+                else self.model._meta.get_field(name)
+            )
+        except FieldDoesNotExist:
+            # аннотация: тип неизвестен, сравнение отдаём БД как есть
+            return value
+        return field.to_python(value)
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return self.encode_cursor(self.next_values, reverse=False)
+
+    def get_previous_link(self):
+        if self.prev_values is None:
+            return None
+        return self.encode_cursor(self.prev_values, reverse=True)
+
+
+class KeysetOptInMixin:
+    """
+    Для generic-view: по умолчанию глобальная PageNumberPagination,
+    а при ?pagination=cursor / ?cursor=... — KeysetPagination.
+    """
+
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if keyset_requested(self.request):
+                self._paginator = self.keyset_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
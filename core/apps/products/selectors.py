@@ -1,75 +1,330 @@
+from apps.products.categories import category_subtree_q, category_tree
+from apps.products.filters import ProductFilter
 from apps.products.models import (
+    Category,
     Favorite,
     Product,
+    ProductListing,
     ProductVariant,
 )
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
 from django.db.models import (
     BooleanField,
-    Count,
     Exists,
-    Min,
+    F,
+    FloatField,
     OuterRef,
     Prefetch,
     Q,
     Value,
 )
+from django.db.models.functions import Cast
 
 VARIANTS_RELATED_NAME = "variants"
 
+FACET_FLAGS = ("is_hit", "is_new", "is_sale")
+
 
 def base_products_qs():
     return Product.objects.select_related("brand", "category").filter(is_active=True)
 
 
-def _annotate_is_favorited(qs, user):
-    if (
-        user
-        and getattr(user, "is_authenticated", False)
-        and getattr(user, "client_id", None)
-    ):
+def _annotate_is_favorited(qs, user, *, product_ref="pk"):
+    # Client связан с User через OneToOne (related_name="client"), у User нет client_id
+    client_id = (
+        getattr(getattr(user, "client", None), "id", None)
+        if user and getattr(user, "is_authenticated", False)
+        else None
+    )
+    if client_id:
         subq = Favorite.objects.filter(
-            client_id=user.client_id, product_id=OuterRef("pk")
+            client_id=client_id, product_id=OuterRef(product_ref)
         )
         return qs.annotate(is_favorited=Exists(subq))
     return qs.annotate(is_favorited=Value(False, output_field=BooleanField()))
 
 
-def with_list_annotations(qs, user=None):
-    active_variants = Q(**{f"{VARIANTS_RELATED_NAME}__is_active": True})
-    qs = qs.annotate(
-        variants_count=Count(
-            VARIANTS_RELATED_NAME,
-            filter=active_variants,
-            distinct=True,
-        ),
-        min_price=Min(
-            f"{VARIANTS_RELATED_NAME}__current_price",
-            filter=active_variants,
-        ),
+def get_product_detail_qs(*, user=None):
+    active_variants_qs = ProductVariant.objects.filter(is_active=True).order_by("id")
+    qs = base_products_qs().prefetch_related(
+        Prefetch(VARIANTS_RELATED_NAME, queryset=active_variants_qs)
     )
     qs = _annotate_is_favorited(qs, user)
+
     return qs
 
 
-def get_products_list_qs(*, user=None):
-    active_variants_qs = (
-        ProductVariant.objects.filter(is_active=True)
-        .only("id", "product_id", "size_value", "size_type")
-        .order_by("id")
-    )
+def get_product_listing_qs(*, user=None):
+    """
+    Список товаров из денормализованной витрины: один индексный проход
+    по ProductListing без join'ов на варианты.
+    """
+    qs = ProductListing.objects.all()
+    return _annotate_is_favorited(qs, user, product_ref="product_id")
 
-    qs = base_products_qs().prefetch_related(
-        Prefetch("variants", queryset=active_variants_qs)
+
+def search_product_listing(qs, q: str):
+    """
+    Полнотекстовый поиск по витрине (GIN по search_vector, конфигурация russian).
+    Синтаксис как у поисковиков: слова через пробел, "фраза", -исключение.
+    """
+    query = SearchQuery(q, config="russian", search_type="websearch")
+    return (
+        qs.filter(search_vector=query)
+        # ts_rank отдаёт real; приводим к double, чтобы значение точно
+        # переживало round-trip через keyset-курсор
+        .annotate(rank=Cast(SearchRank(F("search_vector"), query), FloatField()))
+        .order_by("-rank", "-product_id")
     )
-    qs = with_list_annotations(qs, user=user)
-    return qs
 
 
-def get_product_detail_qs(*, user=None):
-    active_variants_qs = ProductVariant.objects.filter(is_active=True).order_by("id")
-    qs = base_products_qs().prefetch_related(
-        Prefetch(VARIANTS_RELATED_NAME, queryset=active_variants_qs)
+def _truthy(v) -> bool:
+    return str(v).lower() in ("1", "true", "yes", "y", "on")
+
+
+def _russian_stem(s: str) -> str:
+    """Грубый стеммер для русского: срезаем финальные гласные/мягкий знак."""
+    s = (s or "").strip().lower()
+    while s and s[-1] in "аиыоуэеёюяйь":
+        s = s[:-1]
+    return s
+
+
+def _category_name_q(name: str):
+    """
+    Строим Q для Category.name:
+    - точное совпадение (iexact)
+    - подстрока (icontains)
+    - startswith по стемму, чтобы "Клюшки" поймало "Клюшка" и наоборот
+    """
+    if not name:
+        return None
+    name_l = name.lower()
+    stem = _russian_stem(name)
+
+    q = Q(name__iexact=name) | Q(name__icontains=name)
+    if stem and stem != name_l:
+        q |= Q(name__istartswith=stem)
+    return q
+
+
+def _resolve_categories(cat: str, group: str) -> list[int] | None:
+    """id категорий по именам ?category= / ?group=; None — фильтра по категории нет."""
+    cat_q = _category_name_q(cat)
+    grp_q = _category_name_q(group)
+    if not (cat_q or grp_q):
+        return None
+
+    cats = Category.objects.none()
+
+    if cat_q and grp_q:
+        # сначала ищем потомков выбранного родителя (на любой глубине)
+        parents = list(Category.objects.filter(grp_q).values_list("path", flat=True))
+        subtree_q = category_subtree_q(parents)
+        cats = (
+            Category.objects.filter(cat_q, subtree_q).exclude(path__in=parents)
+            if subtree_q
+            else Category.objects.none()
+        )
+
+        # если по parent+child ничего не нашли — fallback:
+        # плоская категория, в имени которой встречаются и group, и category
+        if not cats.exists():
+            cats = Category.objects.filter(
+                Q(name__icontains=cat) & Q(name__icontains=group)
+            )
+
+    elif cat_q:
+        # только конкретная категория
+        cats = Category.objects.filter(cat_q)
+
+    elif grp_q:
+        # только группа: берём сам родитель и всё его поддерево
+        parents = list(Category.objects.filter(grp_q).values_list("path", flat=True))
+        subtree_q = category_subtree_q(parents)
+        cats = (
+            Category.objects.filter(subtree_q)
+            if subtree_q
+            else Category.objects.none()
+        )
+
+    return list(cats.values_list("id", flat=True))
+
+
+def filter_product_listing(qs, query_params):
+    """
+    Общие фильтры списка товаров и фасетов (ProductListView, ProductFacetsView).
+    Возвращает (qs, category_ids): category_ids — категории, которыми ограничена
+    выдача (для тегов кэша), или None, если фильтра по категории нет.
+    """
+    qp = query_params
+
+    # ----- ПАРАМЕТРЫ -----
+    cat = (qp.get("category") or "").strip()
+    group = (qp.get("group") or qp.get("parent") or "").strip()
+
+    # ----- ProductFilter: brand, category (id), in_stock, price_min/max -----
+    data = qp.copy()
+    if cat and not cat.isdigit():
+        # ?category=<имя> разбирается ниже, NumberFilter его не понимает
+        data.pop("category", None)
+    qs = ProductFilter(data, queryset=qs).qs
+
+    # ----- ФИЛЬТР ПО КАТЕГОРИЯМ -----
+    category_ids = None
+    if cat.isdigit() and not group:
+        category_ids = [int(cat)]
+    else:
+        category_ids = _resolve_categories("" if cat.isdigit() else cat, group)
+        if category_ids is not None:
+            qs = qs.filter(category__in=category_ids)
+
+    # ----- ФИЛЬТР ПО РАЗМЕРАМ -----
+    sizes = qp.get("sizes")
+    if sizes:
+        size_list = [s.strip() for s in sizes.split(",") if s.strip()]
+        if size_list:
+            # sizes в витрине — только размеры активных вариантов (GIN-индекс)
+            qs = qs.filter(sizes__overlap=size_list)
+
+    # ----- ХИТ / NEW / SALE -----
+    if _truthy(qp.get("popular")) or _truthy(qp.get("is_hit")):
+        qs = qs.filter(is_hit=True)
+
+    if _truthy(qp.get("is_new")):
+        qs = qs.filter(is_new=True)
+
+    if _truthy(qp.get("is_sale")):
+        qs = qs.filter(is_sale=True)
+
+    # ----- ПОЛНОТЕКСТОВЫЙ ПОИСК -----
+    # ?q= — по названию, бренду, категории и описанию; сортировка по релевантности
+    q = (qp.get("q") or "").strip()
+    if q:
+        qs = search_product_listing(qs, q)
+
+    return qs, category_ids
+
+
+# -----------------------------
+# Фасеты
+# -----------------------------
+
+# Порядок колонок в GROUPING(...) — по нему раскладываем строки результата
+_FACET_KEYS = ("size", "brand", "category", *FACET_FLAGS, "bucket")
+
+_FACETS_SQL = """
+WITH f AS ({base}),
+b AS (
+    SELECT f.*, width_bucket(f.min_price, %s::numeric[]) AS bucket FROM f
+)
+SELECT
+    GROUPING(s.size, b.brand_id, b.category_id, b.is_hit, b.is_new, b.is_sale, b.bucket),
+    s.size, b.brand_id, MIN(b.brand_name), b.category_id,
+    b.is_hit, b.is_new, b.is_sale, b.bucket,
+    COUNT(DISTINCT b.product_id)
+FROM b
+LEFT JOIN LATERAL unnest(b.sizes) AS s(size) ON TRUE
+GROUP BY GROUPING SETS (
+    (s.size), (b.brand_id), (b.category_id),
+    (b.is_hit), (b.is_new), (b.is_sale), (b.bucket), ()
+)
+"""
+
+
+def _facet_key(grouping: int) -> str | None:
+    """Какой набор группировки дал строку: у «своей» колонки бит GROUPING = 0."""
+    full = (1 << len(_FACET_KEYS)) - 1
+    if grouping == full:
+        return "total"
+    for i, key in enumerate(_FACET_KEYS):
+        if grouping == full ^ (1 << (len(_FACET_KEYS) - 1 - i)):
+            return key
+    return None
+
+
+def product_listing_facets(qs) -> dict:
+    """
+    Счётчики для фильтров по уже отфильтрованной витрине — одним запросом:
+    GROUP BY GROUPING SETS по размеру, бренду, категории, флагам и корзине цены.
+    Размеры разворачиваются через unnest, поэтому товары считаем DISTINCT.
+    """
+    bounds = [float(b) for b in settings.CATALOG_FACETS["PRICE_BUCKETS"]]
+    base = qs.order_by().values(
+        "product_id",
+        "brand_id",
+        "brand_name",
+        "category_id",
+        "min_price",
+        "sizes",
+        *FACET_FLAGS,
     )
-    qs = _annotate_is_favorited(qs, user)
+    result = {
+        "total": 0,
+        "sizes": [],
+        "brands": [],
+        "categories": [],
+        "flags": {flag: 0 for flag in FACET_FLAGS},
+        "price": [],
+    }
+    try:
+        base_sql, base_params = base.query.sql_with_params()
+    except EmptyResultSet:
+        # заведомо пустая выдача (например, category__in=[] для неизвестной категории)
+        return result
 
-    return qs
+    with connection.cursor() as cursor:
+        cursor.execute(_FACETS_SQL.format(base=base_sql), [*base_params, bounds])
+        rows = cursor.fetchall()
+
+    nodes = category_tree()
+    buckets = {}
+    for (
+        grouping,
+        size,
+        brand_id,
+        brand_name,
+        category_id,
+        is_hit,
+        is_new,
+        is_sale,
+        bucket,
+        count,
+    ) in rows:
+        key = _facet_key(grouping)
+        if key == "total":
+            result["total"] = count
+        elif key == "size" and size is not None:
+            result["sizes"].append({"value": size, "count": count})
+        elif key == "brand" and brand_id is not None:
+            result["brands"].append({"id": brand_id, "name": brand_name, "count": count})
+        elif key == "category" and category_id is not None:
+            node = nodes.get(category_id) or {}
+            result["categories"].append(
+                {"id": category_id, "name": node.get("name"), "count": count}
+            )
+        elif key in FACET_FLAGS:
+            value = {"is_hit": is_hit, "is_new": is_new, "is_sale": is_sale}[key]
+            if value:
+                result["flags"][key] = count
+        elif key == "bucket" and bucket is not None:
+            buckets[bucket] = count
+
+    # width_bucket: 0 — ниже первой границы, i — [bounds[i-1], bounds[i]),
+    # len(bounds) — от последней границы и выше
+    for i in sorted(buckets):
+        result["price"].append(
+            {
+                "from": bounds[i - 1] if i > 0 else None,
+                "to": bounds[i] if i < len(bounds) else None,
+                "count": buckets[i],
+            }
+        )
+
+    result["sizes"].sort(key=lambda x: (-x["count"], str(x["value"])))
+    result["brands"].sort(key=lambda x: (-x["count"], x["name"] or ""))
+    result["categories"].sort(key=lambda x: (-x["count"], x["name"] or ""))
+    return result
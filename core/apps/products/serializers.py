@@ -1,9 +1,11 @@
 from decimal import Decimal, InvalidOperation
 
+from apps.products.categories import category_path_names
 from apps.products.models import (
     Brand,
     Category,
     Product,
+    ProductListing,
     ProductVariant,
 )
 from apps.products.services import compute_variant_current_price
@@ -135,32 +137,24 @@ class ProductListSerializer(serializers.ModelSerializer):
     def get_image(self, obj: Product):
         return _safe_image_url(obj)
 
-    def get_default_variant_id(self, obj):
+    # Варианты берём только из prefetch (активные, по id):
+    # .filter()/.first() здесь
+    # обошли бы prefetch-кэш и дали запрос на каждую строку.
+    def _variants(self, obj) -> list:
         vs = getattr(obj, "variants", None)
-        if not vs:
-            return None
-        v = vs.filter(is_active=True).first()
-        return v.id if v else None
+        return list(vs.all()) if vs is not None else []
+
+    def get_default_variant_id(self, obj):
+        vs = self._variants(obj)
+        return vs[0].id if vs else None
 
     def get_sizes(self, obj):
-        vs = getattr(obj, "variants", None)
-        if vs is None:
-            return []
-        vals = []
-        for v in vs.all():
-            if getattr(v, "size_value", None):
-                vals.append(v.size_value)
-        return sorted(set(vals), key=lambda x: str(x))
+        vals = {v.size_value for v in self._variants(obj) if v.size_value}
+        return sorted(vals, key=lambda x: str(x))
 
     def get_category_path(self, obj):
-        cat = getattr(obj, "category", None)
-        if not cat:
-            return None
-        names = []
-        while cat:
-            names.append(cat.name)
-            cat = getattr(cat, "parent", None)
-        return " - ".join(reversed(names))
+        # предки берём из закэшированного дерева категорий, без запроса на уровень
+        return category_path_names(getattr(obj, "category_id", None))
 
     class Meta:
         model = Product
@@ -180,3 +174,44 @@ class ProductListSerializer(serializers.ModelSerializer):
             "sizes",
             "default_variant_id",
         )
+
+
+class ProductListingSerializer(serializers.ModelSerializer):
+    """
+    Тот же JSON, что и у ProductListSerializer, но из витрины ProductListing —
+    всё уже посчитано, поэтому без запросов на строку.
+    """
+
+    id = serializers.IntegerField(source="product_id", read_only=True)
+    is_favorited = serializers.BooleanField(read_only=True)
+    min_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, read_only=True
+    )
+    category_path = serializers.SerializerMethodField()
+    sizes = serializers.ListField(child=serializers.CharField(), read_only=True)
+    image = serializers.SerializerMethodField()
+
+    def get_image(self, obj: ProductListing):
+        return _safe_image_url(obj)
+
+    def get_category_path(self, obj: ProductListing):
+        return obj.category_path or None
+
+    class Meta:
+        model = ProductListing
+        fields = (
+            "id",
+            "slug",
+            "name",
+            "price",
+            "image",
+            "is_favorited",
+            "min_price",
+            "is_sale",
+            "is_new",
+            "is_hit",
+            "sale",
+            "category_path",
+            "sizes",
+            "default_variant_id",
+        )
@@ -1,5 +1,6 @@
 import logging
 import time
+import weakref
 from decimal import Decimal
 from typing import (
     Iterable,
@@ -16,18 +17,12 @@ from apps.products.models import (
     Product,
     ProductVariant,
 )
-from apps.products.selectors import (
-    base_products_qs,
-)
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.db.models import (
-    Case,
     F,
-    IntegerField,
     Value,
-    When,
 )
 from django_redis import get_redis_connection
 from rest_framework.exceptions import (
@@ -61,7 +56,8 @@ def bulk_recalc_variants_for_product(product: Product):
 
 def cart_ids_for_product(product: Product) -> Iterable[int]:
     return (
-        CartItem.objects.filter(product=product)
+        CartItem.objects.filter(product_variant__product=product)
+        .exclude(cart__is_ordered=True)
         .values_list("cart_id", flat=True)
         .distinct()
     )
@@ -70,33 +66,49 @@ def cart_ids_for_product(product: Product) -> Iterable[int]:
 def cart_ids_for_variant(variant: ProductVariant) -> Iterable[int]:
     return (
         CartItem.objects.filter(product_variant=variant)
+        .exclude(cart__is_ordered=True)
         .values_list("cart_id", flat=True)
         .distinct()
     )
 
 
-def update_carts(cart_ids: Iterable[int]) -> None:
-    for cid in cart_ids:
-        try:
-            cart = Cart.objects.get(pk=cid)
-        except Cart.DoesNotExist:
-            continue
-        cart_recalculate(cart)
-
-
-def cart_recalculate(cart: Cart):
-    items = list(
-        CartItem.objects.filter(cart=cart).select_related("product_variant", "product")
+# Пересчёт итогов корзин одним UPDATE ... FROM (агрегат) на пачку.
+# Оформленные заказы (is_ordered) не трогаем — их суммы историческая правда.
+CART_RECALC_BATCH_SIZE = 1000
+
+_CART_RECALC_SQL = """
+UPDATE {cart} AS c
+SET cart_total_sum = t.total
+FROM (
+    SELECT c2.id AS cart_id,
+           COALESCE(SUM(COALESCE(v.current_price, 0) * ci.quantity), 0) AS total
+    FROM {cart} AS c2
+    LEFT JOIN {item} AS ci ON ci.cart_id = c2.id
+    LEFT JOIN {variant} AS v ON v.id = ci.product_variant_id
+    WHERE c2.id = ANY(%s) AND c2.is_ordered IS NOT TRUE
+    GROUP BY c2.id
+) AS t
+WHERE c.id = t.cart_id
+  AND c.cart_total_sum IS DISTINCT FROM t.total
+"""
+
+
+def update_carts(cart_ids: Iterable[int]) -> int:
+    """Пересчитывает cart_total_sum черновых корзин. Возвращает число изменённых."""
+    ids = sorted({int(cid) for cid in cart_ids})
+    if not ids:
+        return 0
+    sql = _CART_RECALC_SQL.format(
+        cart=Cart._meta.db_table,
+        item=CartItem._meta.db_table,
+        variant=ProductVariant._meta.db_table,
     )
-    total = Decimal("0")
-    for it in items:
-        price = getattr(it.product_variant, "current_price", None)
-        if price is None:
-            price = compute_variant_current_price(it.product_variant)
-        total += Decimal(str(price)) * Decimal(it.qty)
-
-    cart.total_sum = total
-    cart.save(update_fields=["total_sum"])
+    updated = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), CART_RECALC_BATCH_SIZE):
+            cursor.execute(sql, [ids[start : start + CART_RECALC_BATCH_SIZE]])
+            updated += cursor.rowcount
+    return updated
 
 
 def get_request_client_or_raise(request):
@@ -127,14 +139,16 @@ def favorites_remove(client: Client, *, product: Product) -> None:
     ).delete()
 
 
-def favorites_products_qs(client: Client):
+def favorites_ids_qs(client: Client):
+    """Только id и порядок избранного: сами карточки берутся из apps/products/cards.py."""
     return (
         Product.objects.filter(
             is_active=True,
             favorited_by__client=client,
         )
-        .select_related("brand", "category")
-        .order_by("-favorited_by__created_at")
+        .annotate(favorited_at=F("favorited_by__created_at"))
+        .order_by("-favorited_at", "-id")
+        .only("id")
     )
 
 
@@ -163,6 +177,37 @@ def _rv_key(*, user_id=None, annon_id=None) -> str | None:
     return None
 
 
+# Запись просмотра за один round-trip:
+#   KEYS[1] — ZSET просмотров, KEYS[2] — маркер debounce для пары зритель/товар
+#   ARGV: product_id, score, max_len, ttl, debounce_seconds
+_RV_ADD_LUA = """
+local debounce = tonumber(ARGV[5])
+if debounce > 0 then
+    if not redis.call('SET', KEYS[2], '1', 'NX', 'EX', debounce) then
+        return 0
+    end
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+local size = redis.call('ZCARD', KEYS[1])
+local max_len = tonumber(ARGV[3])
+if size > max_len then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, size - max_len - 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# Script (SHA скрипта) создаётся один раз на соединение, а не на каждый просмотр
+_rv_add_scripts: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _rv_add_script(conn):
+    script = _rv_add_scripts.get(conn)
+    if script is None:
+        script = _rv_add_scripts[conn] = conn.register_script(_RV_ADD_LUA)
+    return script
+
+
 def add_recent_view(
     *,
     product_id: int,
@@ -170,6 +215,10 @@ def add_recent_view(
     annon_id: str | None,
     ts: float | None = None,
 ) -> None:
+    """
+    ZADD + обрезка до MAX_LEN + EXPIRE одним Lua-скриптом (EVALSHA).
+    Повторное открытие того же товара в течение DEBOUNCE_SECONDS не пишется.
+    """
     key = _rv_key(user_id=user_id, annon_id=annon_id)
     if not key:
         return
@@ -178,16 +227,18 @@ def add_recent_view(
     if conn is None:
         return
 
+    cfg = settings.RECENTLY_VIEWED
     try:
-        score = ts or time.time()
-        conn.zadd(key, {product_id: score})
-
-        max_len = settings.RECENTLY_VIEWED["MAX_LEN"]
-        size = conn.zcard(key)
-        if size > max_len:
-            conn.zremrangebyrank(key, 0, size - max_len - 1)
-
-        conn.expire(key, settings.RECENTLY_VIEWED["TTL_SECONDS"])
+        _rv_add_script(conn)(
+            keys=[key, f"{key}:d:{product_id}"],
+            args=[
+                product_id,
+                ts or time.time(),
+                cfg["MAX_LEN"],
+                cfg["TTL_SECONDS"],
+                cfg["DEBOUNCE_SECONDS"],
+            ],
+        )
     except Exception as e:
         logger.warning("add_recent_view failed: %s", e)
 
@@ -216,13 +267,3 @@ def get_recent_ids(
     except Exception as e:
         logger.warning("get_recent_ids failed: %s", e)
         return []
-
-
-def products_preserve_order(ids: List[int]):
-    if not ids:
-        return base_products_qs().none()
-    ordering = Case(
-        *[When(pk=pk, then=pos) for pos, pk in enumerate(ids)],
-        output_field=IntegerField(),
-    )
-    return base_products_qs().filter(pk__in=ids).order_by(ordering)
@@ -4,9 +4,35 @@ from django.db.models.signals import (
     post_delete,
 )
 from django.db import transaction
+from django.db.models import F
 from django.dispatch import receiver
 from apps.products.slugs import assign_product_slug
+from apps.products.cache import (
+    bump_favorites_version,
+    invalidate_catalog_cache,
+    invalidate_product_cache,
+)
+from apps.products.cards import (
+    invalidate_all_cards,
+    invalidate_product_cards,
+    invalidate_variant_cards,
+)
+from apps.products.categories import (
+    bump_category_tree_version,
+    category_check_parent,
+    category_move_subtree,
+    category_path_for,
+)
+from apps.products.engine import catalog_engine_mark_changed_on_commit
+from apps.products.listing import (
+    refresh_listings_for_brand,
+    refresh_listings_for_category,
+    refresh_product_listing,
+)
 from apps.products.models import (
+    Brand,
+    Category,
+    Favorite,
     Product,
     ProductVariant,
 )
@@ -35,22 +61,53 @@ def variant_pre_save_set_current_price(sender, instance: ProductVariant, **kwarg
 def product_pre_save_capture_old_sale(sender, instance: Product, **kwargs):
     if instance.pk:
         try:
-            old = Product.objects.only('sale').get(pk=instance.pk)
+            old = Product.objects.only('sale', 'category_id').get(pk=instance.pk)
             instance._old_sale = old.sale
+            instance._old_category_id = old.category_id
         except Product.DoesNotExist:
             instance._old_sale = None
+            instance._old_category_id = None
     else:
         instance._old_sale = None
+        instance._old_category_id = None
         
         
+# Версия товара для ETag деталки: растёт при изменении товара и его вариантов.
+# Только UPDATE ... version = version + 1: значение из памяти (устаревший
+# экземпляр) могло бы повторить уже выданную версию и дать ложный 304.
+@receiver(pre_save, sender=Product)
+def product_pre_save_keep_version(sender, instance: Product, **kwargs):
+    # новая строка (в т.ч. с явным pk: loaddata, восстановление) вставляется как есть —
+    # F() в INSERT недопустим
+    if instance.pk and not instance._state.adding:
+        # save() не перезаписывает версию в БД своим значением
+        instance.version = F("version")
+
+
+@receiver(post_save, sender=Product)
+def product_post_save_bump_version(sender, instance: Product, created, **kwargs):
+    if created:
+        return
+    Product.objects.filter(pk=instance.pk).update(version=F("version") + 1)
+    instance.refresh_from_db(fields=["version"])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed_bump_product_version(sender, instance: ProductVariant, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(version=F("version") + 1)
+
+
 @receiver(post_save, sender=ProductVariant)
 def variant_post_save_update_carts(sender, instance: ProductVariant, created, **kwargs):
     transaction.on_commit(lambda: update_carts(cart_ids_for_variant(instance)))
+    transaction.on_commit(lambda: refresh_product_listing(instance.product_id))
     
     
 @receiver(post_delete, sender=ProductVariant)
 def variant_post_delete_update_carts(sender, instance: ProductVariant, **kwargs):
     transaction.on_commit(lambda: update_carts(cart_ids_for_variant(instance)))
+    transaction.on_commit(lambda: refresh_product_listing(instance.product_id))
     
     
 @receiver(post_save, sender=Product)
@@ -62,4 +119,130 @@ def product_post_save_reprice_and_update_carts(sender, instance: Product, create
         bulk_recalc_variants_for_product(instance)
         update_carts(cart_ids_for_product(instance))
     
-    transaction.on_commit(_do)
\ No newline at end of file
+    transaction.on_commit(_do)
+
+
+# Витрина каталога (ProductListing).
+# Регистрируется ПОСЛЕ пересчёта цен: on_commit-колбэки выполняются по порядку,
+# поэтому min_price в витрине считается уже по новым current_price.
+@receiver(post_save, sender=Product)
+def product_post_save_refresh_listing(sender, instance: Product, created, **kwargs):
+    transaction.on_commit(lambda: refresh_product_listing(instance.pk))
+
+
+@receiver(pre_save, sender=Category)
+def category_pre_save_capture_old_path(sender, instance: Category, **kwargs):
+    category_check_parent(instance)
+    old = None
+    if instance.pk:
+        old = Category.objects.filter(pk=instance.pk).values("path", "depth").first()
+    instance._old_path = old["path"] if old else None
+    instance._old_depth = old["depth"] if old else 0
+
+
+@receiver(post_save, sender=Category)
+def category_post_save_update_path(sender, instance: Category, created, **kwargs):
+    parent = None
+    if instance.parent_id:
+        parent = Category.objects.only("path", "depth").get(pk=instance.parent_id)
+    path, depth = category_path_for(instance, parent)
+
+    if path != instance.path or depth != instance.depth:
+        Category.objects.filter(pk=instance.pk).update(path=path, depth=depth)
+        instance.path, instance.depth = path, depth
+
+    old_path = getattr(instance, "_old_path", None)
+    if old_path and old_path != path:
+        category_move_subtree(old_path, path, depth - instance._old_depth)
+
+    transaction.on_commit(bump_category_tree_version)
+    if not created:
+        transaction.on_commit(lambda: refresh_listings_for_category(instance.pk))
+
+
+@receiver(post_delete, sender=Category)
+def category_post_delete_bump_tree(sender, instance: Category, **kwargs):
+    transaction.on_commit(bump_category_tree_version)
+
+
+@receiver(post_save, sender=Brand)
+def brand_post_save_refresh_listing(sender, instance: Brand, created, **kwargs):
+    if created:
+        return
+    transaction.on_commit(lambda: refresh_listings_for_brand(instance.pk))
+
+
+# Кэш ответов каталога (apps/products/cache.py).
+# Сбрасываем после обновления витрины, чтобы следующий промах читал новые данные.
+def _invalidate_variant_product(product_id):
+    category_id = (
+        Product.objects.filter(pk=product_id).values_list("category_id", flat=True).first()
+    )
+    invalidate_product_cache(product_id, category_id)
+
+
+@receiver(post_save, sender=Product)
+def product_post_save_invalidate_cache(sender, instance: Product, created, **kwargs):
+    old_category_id = getattr(instance, "_old_category_id", None)
+    transaction.on_commit(
+        lambda: invalidate_product_cache(
+            instance.pk, instance.category_id, old_category_id
+        )
+    )
+
+
+@receiver(post_delete, sender=Product)
+def product_post_delete_invalidate_cache(sender, instance: Product, **kwargs):
+    # pk обнуляется после delete(), до on_commit — запоминаем сейчас
+    product_id = instance.pk
+    transaction.on_commit(
+        lambda: invalidate_product_cache(product_id, instance.category_id)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def product_post_delete_mark_engine(sender, instance: Product, **kwargs):
+    # строка витрины удаляется каскадом, refresh_product_listing не вызывается
+    catalog_engine_mark_changed_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+def variant_post_save_invalidate_cache(sender, instance: ProductVariant, created, **kwargs):
+    transaction.on_commit(lambda: _invalidate_variant_product(instance.product_id))
+
+
+@receiver(post_delete, sender=ProductVariant)
+def variant_post_delete_invalidate_cache(sender, instance: ProductVariant, **kwargs):
+    transaction.on_commit(lambda: _invalidate_variant_product(instance.product_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+def catalog_dimension_changed_invalidate_cache(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_catalog_cache)
+    transaction.on_commit(invalidate_all_cards)
+
+
+# Карточки товаров и вариантов (apps/products/cards.py)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed_invalidate_cards(sender, instance: Product, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: invalidate_product_cards(product_id))
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed_invalidate_cards(sender, instance: ProductVariant, **kwargs):
+    variant_id = instance.pk
+    transaction.on_commit(
+        lambda: invalidate_variant_cards(variant_id, instance.product_id)
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorite_changed_bump_version(sender, instance: Favorite, **kwargs):
+    transaction.on_commit(lambda: bump_favorites_version(instance.client_id))
@@ -1,3 +1,431 @@
-from django.test import TestCase
+import datetime
+import uuid
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from apps.customers.models import Client
+from apps.orders.models import Cart, CartItem
+from apps.products.cache import bump_catalog_version
+from apps.products.cards import product_cards, variant_cards
+from apps.products.categories import bump_category_tree_version, category_tree
+from apps.products.engine import CatalogEngine
+from apps.products.listing import refresh_product_listings
+from apps.products.models import (
+    Brand,
+    Category,
+    Favorite,
+    Product,
+    ProductVariant,
+)
+from apps.products.selectors import (
+    filter_product_listing,
+    get_product_listing_qs,
+)
+from apps.products.services import (
+    CART_RECALC_BATCH_SIZE,
+    _rv_conn,
+    _rv_key,
+    add_recent_view,
+    update_carts,
+)
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+
+def _make_client(email: str, phone: str) -> Client:
+    user = User.objects.create_user(username=email, password="pw")
+    return Client.objects.create(
+        user=user,
+        surname="Иванов",
+        name="Иван",
+        phone_number=phone,
+        birthday=datetime.date(1990, 1, 1),
+    )
+
+
+def _make_catalog(n: int = 10):
+    brand = Brand.objects.create(name="Bauer")
+    category = Category.objects.create(name="Клюшки")
+    products = []
+    for i in range(n):
+        product = Product.objects.create(
+            name=f"Клюшка {i}", category=category, brand=brand
+        )
+        for size, active in (("S", True), ("M", True), ("L", i % 2 == 0)):
+            ProductVariant.objects.create(
+                product=product,
+                size_value=size,
+                base_price=Decimal(1000 + i),
+                is_active=active,
+            )
+        products.append(product)
+    return products
+
+
+def _warm_category_tree() -> None:
+    # дерево категорий — кэш процесса, а не часть стоимости страницы; версию
+    # поднимает on_commit, которого в TestCase нет, поэтому сбрасываем явно
+    bump_category_tree_version()
+    category_tree()
+
+
+class IsolatedCardsCacheMixin:
+    """
+    Карточки живут в Redis: у каждого теста свой CACHE_KEY_PREFIX, чтобы не видеть
+    чужой кэш, и его ключи удаляются после теста.
+    """
+
+    def setUp(self):
+        super().setUp()
+        prefix = f"test-{uuid.uuid4().hex[:12]}"
+        override = override_settings(CACHE_KEY_PREFIX=prefix)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self._drop_keys, prefix)
+        _warm_category_tree()
+
+    @staticmethod
+    def _drop_keys(prefix: str) -> None:
+        conn = get_redis_connection("default")
+        keys = list(conn.scan_iter(match=f"{prefix}:*"))
+        if keys:
+            conn.delete(*keys)
+
+
+class ProductListQueriesTest(IsolatedCardsCacheMixin, TestCase):
+    """GET /api/products/ стоит фиксированное число запросов при любом размере страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = _make_catalog(10)
+        refresh_product_listings(p.id for p in cls.products)
+
+    def _queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Cache"], "MISS")
+        return response.json(), len(ctx.captured_queries)
+
+    def test_page_number(self):
+        small, small_queries = self._queries("/api/products/?limit=2")
+        large, large_queries = self._queries("/api/products/?limit=10")
+        self.assertEqual(len(small["results"]), 2)
+        self.assertEqual(len(large["results"]), 10)
+        # COUNT(*) + страница витрины
+        self.assertEqual(small_queries, 2)
+        self.assertEqual(large_queries, 2)
+
+    def test_keyset(self):
+        small, small_queries = self._queries("/api/products/?pagination=cursor&page_size=2")
+        large, large_queries = self._queries("/api/products/?pagination=cursor&page_size=10")
+        self.assertEqual(len(small["results"]), 2)
+        self.assertEqual(len(large["results"]), 10)
+        # только страница витрины, без COUNT(*)
+        self.assertEqual(small_queries, 1)
+        self.assertEqual(large_queries, 1)
+
+
+class CardEndpointsQueriesTest(IsolatedCardsCacheMixin, TestCase):
+    """
+    Избранное и недавно просмотренные отдаются из карточек (apps/products/cards.py):
+    число запросов не зависит от размера страницы ни при холодном, ни при тёплом кэше.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = _make_catalog(10)
+        # витрину обычно пересобирает on_commit, а в TestCase коммита нет
+        refresh_product_listings(p.id for p in cls.products)
+        cls.big = _make_client("big@example.com", "+79990000011")
+        cls.small = _make_client("small@example.com", "+79990000012")
+        for product in cls.products:
+            Favorite.objects.create(client=cls.big, product=product)
+        for product in cls.products[:2]:
+            Favorite.objects.create(client=cls.small, product=product)
+
+    def _get(self, url, *, client=None, headers=None):
+        api = APIClient()
+        if client is not None:
+            api.force_authenticate(client.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = api.get(url, headers=headers or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_favorites_fixed_queries(self):
+        small_data, small_cold = self._get("/favorites/", client=self.small)
+        big_data, big_cold = self._get("/favorites/", client=self.big)
+        self.assertEqual(len(small_data["results"]), 2)
+        self.assertEqual(len(big_data["results"]), 10)
+        self.assertEqual(small_cold, big_cold)
+
+        _, small_warm = self._get("/favorites/", client=self.small)
+        _, big_warm = self._get("/favorites/", client=self.big)
+        self.assertEqual(small_warm, big_warm)
+        # тёплый кэш: карточки не собираются из витрины
+        self.assertEqual(big_warm, big_cold - 1)
+
+    def test_recently_viewed_fixed_queries(self):
+        anon_id = uuid.uuid4().hex
+        self.addCleanup(
+            lambda: _rv_conn().delete(_rv_key(annon_id=anon_id))
+        )
+        for ts, product in enumerate(self.products, start=1):
+            add_recent_view(product_id=product.id, user_id=None, annon_id=anon_id, ts=ts)
+        headers = {settings.RECENTLY_VIEWED["ANON_HEADER"]: anon_id}
+
+        small, small_queries = self._get("/api/recently-viewed/?limit=2", headers=headers)
+        big, big_queries = self._get("/api/recently-viewed/?limit=10", headers=headers)
+        self.assertEqual(small_queries, big_queries)
+        # последний просмотренный — первым
+        ids = [it["id"] for it in big["results"]]
+        self.assertEqual(ids, [p.id for p in reversed(self.products)])
+        self.assertEqual([it["id"] for it in small["results"]], ids[:2])
+
+    def test_favorites_item_shape(self):
+        data, _ = self._get("/favorites/", client=self.big)
+        item = next(it for it in data["results"] if it["id"] == self.products[1].id)
+        # L у нечётных товаров неактивен — ни в размерах, ни в default_variant_id
+        self.assertEqual(sorted(item["sizes"]), ["M", "S"])
+        first_active = (
+            ProductVariant.objects.filter(product=self.products[1], is_active=True)
+            .order_by("id")
+            .first()
+        )
+        self.assertEqual(item["default_variant_id"], first_active.id)
+        self.assertEqual(item["min_price"], "1001.00")
+        self.assertTrue(item["is_favorited"])
+        self.assertEqual(item["category_path"], "Клюшки")
+
+
+class ProductCardsInvalidationTest(IsolatedCardsCacheMixin, TestCase):
+    """Сигналы сбрасывают карточки после коммита — следующий MGET видит новые данные."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = _make_catalog(1)[0]
+        refresh_product_listings([cls.product.id])
+        cls.variant = cls.product.variants.order_by("id").first()
+
+    def test_cached_after_first_read(self):
+        product_cards([self.product.id])
+        variant_cards([self.variant.id])
+        with self.assertNumQueries(0):
+            self.assertIn(self.product.id, product_cards([self.product.id]))
+            self.assertIn(self.variant.id, variant_cards([self.variant.id]))
+
+    def test_product_change_resets_product_and_variant_cards(self):
+        product_cards([self.product.id])
+        variant_cards([self.variant.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Клюшка Pro"
+            self.product.save()
+
+        self.assertEqual(product_cards([self.product.id])[self.product.id]["name"], "Клюшка Pro")
+        card = variant_cards([self.variant.id])[self.variant.id]
+        self.assertEqual(card["product"]["name"], "Клюшка Pro")
+
+    def test_variant_change_resets_variant_and_product_cards(self):
+        product_cards([self.product.id])
+        variant_cards([self.variant.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.variant.base_price = Decimal("500")
+            self.variant.save()
+
+        self.assertEqual(variant_cards([self.variant.id])[self.variant.id]["current_price"], "500.00")
+        self.assertEqual(product_cards([self.product.id])[self.product.id]["min_price"], "500.00")
+
+    def test_inactive_product_drops_out(self):
+        product_cards([self.product.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.is_active = False
+            self.product.save()
+
+        self.assertEqual(product_cards([self.product.id]), {})
+
+    def test_brand_rename_resets_all_cards(self):
+        variant_cards([self.variant.id])
+        brand = self.product.brand
+        with self.captureOnCommitCallbacks(execute=True):
+            brand.name = "CCM"
+            brand.save()
+
+        card = variant_cards([self.variant.id])[self.variant.id]
+        self.assertEqual(card["product"]["brand"], "CCM")
+
+
+class ProductFacetsTest(IsolatedCardsCacheMixin, TestCase):
+    """Фасеты считаются по той же выдаче, что и список."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = _make_catalog(3)
+        refresh_product_listings(p.id for p in cls.products)
+
+    def test_counts(self):
+        data = APIClient().get("/api/products/facets/").json()
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(data["brands"][0]["count"], 3)
+
+    def test_unknown_category_gives_empty_facets(self):
+        response = APIClient().get("/api/products/facets/?category=no-such-category")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["total"], 0)
+        self.assertEqual(data["categories"], [])
+
+
+class ProductVersionTest(TestCase):
+    """Версия товара растёт в БД и не ломает вставку с явным id."""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Шлемы")
+        self.brand = Brand.objects.create(name="Warrior")
+
+    def test_create_with_explicit_id(self):
+        product = Product(id=900001, name="Шлем", category=self.category, brand=self.brand)
+        product.save()
+        self.assertEqual(Product.objects.get(pk=900001).version, product.version)
+
+    def test_save_bumps_version(self):
+        product = Product.objects.create(name="Шлем", category=self.category, brand=self.brand)
+        before = Product.objects.get(pk=product.pk).version
+        product.name = "Шлем Pro"
+        product.save()
+        self.assertEqual(product.version, before + 1)
+        self.assertEqual(Product.objects.get(pk=product.pk).version, before + 1)
+
+
+class CatalogListCacheTest(IsolatedCardsCacheMixin, TestCase):
+    """Кэш списка и фасетов привязан к версии каталога, как и их ETag."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = _make_catalog(2)
+        refresh_product_listings(p.id for p in cls.products)
+
+    def test_catalog_version_is_part_of_the_key(self):
+        for url in ("/api/products/", "/api/products/facets/"):
+            api = APIClient()
+            first = api.get(url)
+            self.assertEqual(api.get(url)["X-Cache"], "HIT")
+            # запись, сделанная до смены версии, с новым ETag не отдаётся
+            bump_catalog_version()
+            second = api.get(url)
+            self.assertEqual(second["X-Cache"], "MISS")
+            self.assertNotEqual(first["ETag"], second["ETag"])
+
+
+class CatalogEngineParityTest(IsolatedCardsCacheMixin, TestCase):
+    """Движок в памяти и SQL-путь отвечают на одни и те же параметры одинаково."""
+
+    QUERIES = [
+        "",
+        "is_sale=true",
+        "is_sale=false",
+        "is_sale=3",
+        "is_new=1",
+        "is_new=0",
+        "is_hit=2",
+        "popular=1",
+        "in_stock=true",
+        "in_stock=false",
+        "in_stock=1",
+        "is_sale=1&in_stock=false",
+        "price_min=1002&price_max=1004",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        products = _make_catalog(6)
+        for i, product in enumerate(products):
+            Product.objects.filter(pk=product.pk).update(
+                is_sale=i % 2 == 0, is_new=i % 3 == 0, is_hit=i < 2
+            )
+        # у последнего товара нет активных вариантов
+        ProductVariant.objects.filter(product=products[-1]).update(is_active=False)
+        refresh_product_listings(p.id for p in products)
+
+    def test_same_results(self):
+        engine = CatalogEngine()
+        for query in self.QUERIES:
+            with self.subTest(query=query):
+                qp = QueryDict(query)
+                qs, _ = filter_product_listing(get_product_listing_qs(user=None), qp)
+                expected = set(qs.values_list("product_id", flat=True))
+                result = engine.query(qp)
+                self.assertIsNotNone(result)
+                self.assertEqual({item["id"] for item in result}, expected)
+
+
+class UpdateCartsTest(TestCase):
+    """Пересчёт итогов корзин пачками UPDATE ... FROM; оформленные заказы не трогаются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_obj = _make_client("carts@example.com", "+79990000701")
+        cls.product = _make_catalog(1)[0]
+        cls.variant = cls.product.variants.order_by("id").first()
+
+    def _carts(self, n, *, is_ordered=False, total="1.00"):
+        carts = Cart.objects.bulk_create(
+            Cart(client=self.client_obj, is_ordered=is_ordered, cart_total_sum=Decimal(total))
+            for _ in range(n)
+        )
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=self.product, product_variant=self.variant, quantity=2)
+            for cart in carts
+        )
+        return [cart.pk for cart in carts]
+
+    def test_batches_beyond_batch_size(self):
+        ids = self._carts(CART_RECALC_BATCH_SIZE + 1)
+        # одна пачка — один UPDATE
+        with self.assertNumQueries(2):
+            self.assertEqual(update_carts(ids), len(ids))
+        totals = set(Cart.objects.filter(pk__in=ids).values_list("cart_total_sum", flat=True))
+        self.assertEqual(totals, {self.variant.current_price * 2})
+        # уже совпадающие итоги не переписываются
+        self.assertEqual(update_carts(ids), 0)
+
+    def test_ordered_carts_are_left_alone(self):
+        draft = self._carts(1)
+        ordered = self._carts(1, is_ordered=True, total="123.00")
+        self.assertEqual(update_carts(draft + ordered), 1)
+        self.assertEqual(Cart.objects.get(pk=ordered[0]).cart_total_sum, Decimal("123.00"))
+
+    def test_sale_change_reprices_only_draft_carts(self):
+        draft = self._carts(1)[0]
+        ordered = self._carts(1, is_ordered=True, total="123.00")[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.sale = 50
+            self.product.save()
+        self.variant.refresh_from_db()
+        self.assertEqual(
+            Cart.objects.get(pk=draft).cart_total_sum, self.variant.current_price * 2
+        )
+        self.assertEqual(Cart.objects.get(pk=ordered).cart_total_sum, Decimal("123.00"))
+
+
+class CategoryTreeRedisDownTest(TestCase):
+    """Без Redis дерево категорий строится из БД, а не роняет запрос."""
+
+    def test_tree_is_built_from_db(self):
+        category = Category.objects.create(name="Коньки")
+        down = mock.patch(
+            "apps.products.categories.cache.get", side_effect=ConnectionError("redis down")
+        )
+        incr_down = mock.patch(
+            "apps.products.categories.cache.incr", side_effect=ConnectionError("redis down")
+        )
+        with down, incr_down, self.assertLogs("apps.products.categories", "WARNING"):
+            bump_category_tree_version()
+            nodes = category_tree()
+        self.assertEqual(nodes[category.pk]["name"], "Коньки")
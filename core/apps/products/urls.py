@@ -1,5 +1,6 @@
 from django.urls import path
 from apps.products.views import (
+    ProductFacetsView,
     ProductRetrieveView,
     ProductListView,
 )
@@ -9,6 +10,7 @@ app_name = 'product'
 
 urlpatterns = [
     path('', ProductListView.as_view(), name='product_list'),
+    path('facets/', ProductFacetsView.as_view(), name='product_facets'),
     
     path('<slug:slug>/', ProductRetrieveView.as_view(), name='product'),
 ]
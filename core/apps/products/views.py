@@ -1,27 +1,42 @@
-from apps.products.models import (
-    Category,
-    Product,
+from apps.products.cache import (
+    TAG_ALL_CATEGORIES,
+    catalog_cache_get,
+    catalog_cache_key,
+    catalog_cache_set,
+    catalog_versions,
+    category_tag,
+    overlay_is_favorited,
+    product_tag,
+)
+from apps.products.cards import product_cards
+from apps.products.engine import catalog_engine_query
+from apps.products.models import Product
+from apps.products.pagination import (
+    KeysetOptInMixin,
+    keyset_requested,
 )
 from apps.products.selectors import (
+    filter_product_listing,
     get_product_detail_qs,
-    get_products_list_qs,
+    get_product_listing_qs,
+    product_listing_facets,
 )
 from apps.products.serializers import (
+    ProductListingSerializer,
     ProductListSerializer,
     ProductSerializer,
 )
 from apps.products.services import (
     add_recent_view,
     favorites_add,
-    favorites_products_qs,
+    favorites_ids_qs,
     favorites_remove,
     get_recent_ids,
     get_request_client_or_raise,
-    products_preserve_order,
 )
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.utils.http import parse_etags
 from django.utils.text import slugify
 from rest_framework import status
 from rest_framework.authentication import (
@@ -42,102 +57,106 @@ from rest_framework_simplejwt.authentication import (
 )
 
 
-class ProductListView(ListAPIView):
+def _request_client_id(request):
+    user = request.user
+    if not getattr(user, "is_authenticated", False):
+        return None
+    return getattr(getattr(user, "client", None), "id", None)
+
+
+def _not_modified(request, etag):
+    """304 без сериализации, если у клиента уже эта версия (If-None-Match)."""
+    if not etag:
+        return None
+    tags = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in tags or "*" in tags:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+
+def _catalog_list_etag(request):
+    """
+    (ETag, версия каталога) для списков: ETag — версия каталога (+ версия
+    избранного клиента, от неё зависит is_favorited). Параметры запроса в ETag
+    не входят — он и так привязан к URL. Redis недоступен — (None, None).
+    """
+    client_id = _request_client_id(request)
+    versions = catalog_versions(client_id)
+    if versions is None:
+        return None, None
+    etag = f"l{versions['catalog']}"
+    if client_id:
+        etag += f".f{versions['fav']}"
+    return f'"{etag}"', versions["catalog"]
+
+
+def _catalog_list_cache_key(kind: str, request, version) -> str:
+    # версия в ключе: ответ, собранный до смены каталога и записанный после
+    # сброса, ложится под мёртвый ключ и не отдаётся с новым ETag
+    return catalog_cache_key(f"{kind}:{version}" if version is not None else kind, request)
+
+
+class ProductListView(KeysetOptInMixin, ListAPIView):
     permission_classes = [AllowAny]
-    serializer_class = ProductListSerializer
+    serializer_class = ProductListingSerializer
+
+    # категории, по которым отфильтрован список (для тегов кэша); None — без фильтра
+    cache_category_ids = None
+
+    def list(self, request, *args, **kwargs):
+        etag, version = _catalog_list_etag(request)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        # при включённом CATALOG_ENGINE простые фильтры отвечаются из памяти.
+        # ETag не отдаём: снимок воркера может отставать от версии в Redis
+        result = catalog_engine_query(request.query_params)
+        if result is not None:
+            page = self.paginate_queryset(result)
+            data = (
+                self.get_paginated_response(page).data
+                if page is not None
+                else list(result)
+            )
+            items = data["results"] if isinstance(data, dict) else data
+            overlay_is_favorited(items, request.user)
+            return Response(data, headers={"X-Cache": "ENGINE"})
+
+        # is_favorited в кэше всегда False — флаги клиента накладываются после
+        key = _catalog_list_cache_key("list", request, version)
+        data = catalog_cache_get(key)
+        hit = data is not None
+        if not hit:
+            data = super().list(request, *args, **kwargs).data
+            catalog_cache_set(key, data, tags=self._cache_tags(data))
+
+        items = data["results"] if isinstance(data, dict) else data
+        overlay_is_favorited(items, request.user)
+        headers = {"X-Cache": "HIT" if hit else "MISS"}
+        if etag:
+            headers["ETag"] = etag
+        return Response(data, headers=headers)
+
+    def _cache_tags(self, data):
+        items = data["results"] if isinstance(data, dict) else data
+        tags = [product_tag(it["id"]) for it in items]
+        if self.cache_category_ids is None:
+            tags.append(TAG_ALL_CATEGORIES)
+        else:
+            tags += [category_tag(cid) for cid in self.cache_category_ids]
+        return tags
 
     def get_queryset(self):
-        qs = get_products_list_qs(user=self.request.user)
-        qs = qs.order_by("-id")
+        qs = get_product_listing_qs(user=None)
+        qs = qs.order_by("-product_id")
         qp = self.request.query_params
-
-        def truthy(v):
-            return str(v).lower() in ("1", "true", "yes", "y", "on")
-
-        # ----- ПАРАМЕТРЫ -----
-        cat = (qp.get("category") or "").strip()
-        group = (qp.get("group") or qp.get("parent") or "").strip()
-
-        # ----- ФИЛЬТР ПО КАТЕГОРИЯМ -----
-        # грубый стеммер для русского: срезаем финальные гласные/мягкий знак
-        def russian_stem(s: str) -> str:
-            s = (s or "").strip().lower()
-            while s and s[-1] in "аиыоуэеёюяйь":
-                s = s[:-1]
-            return s
-
-        def make_name_q(name: str):
-            """
-            Строим Q для Category.name:
-            - точное совпадение (iexact)
-            - подстрока (icontains)
-            - startswith по стемму, чтобы "Клюшки" поймало "Клюшка" и наоборот
-            """
-            if not name:
-                return None
-            name_l = name.lower()
-            stem = russian_stem(name)
-
-            q = Q(name__iexact=name) | Q(name__icontains=name)
-            if stem and stem != name_l:
-                q |= Q(name__istartswith=stem)
-            return q
-
-        cat_q = make_name_q(cat)
-        grp_q = make_name_q(group)
-
-        if cat_q or grp_q:
-            # найдём набор категорий, по которым будем фильтровать товары
-            cats = Category.objects.none()
-
-            if cat_q and grp_q:
-                # сначала ищем детей выбранного родителя
-                parents = Category.objects.filter(grp_q)
-                cats = Category.objects.filter(cat_q, parent__in=parents)
-
-                # если по parent+child ничего не нашли — fallback:
-                # плоская категория, в имени которой встречаются и group, и category
-                if not cats.exists():
-                    cats = Category.objects.filter(
-                        Q(name__icontains=cat) & Q(name__icontains=group)
-                    )
-
-            elif cat_q:
-                # только конкретная категория
-                cats = Category.objects.filter(cat_q)
-
-            elif grp_q:
-                # только группа: берём сам родитель и всех его детей
-                parents = Category.objects.filter(grp_q)
-                cats = Category.objects.filter(
-                    Q(id__in=parents) | Q(parent__in=parents)
-                )
-
-            qs = qs.filter(category__in=cats).distinct()
-
-        # ----- ФИЛЬТР ПО РАЗМЕРАМ -----
-        sizes = qp.get("sizes")
-        if sizes:
-            size_list = [s.strip() for s in sizes.split(",") if s.strip()]
-            if size_list:
-                qs = qs.filter(
-                    variants__is_active=True,
-                    variants__size_value__in=size_list,
-                ).distinct()
-
-        # ----- ХИТ / NEW / SALE -----
-        if truthy(qp.get("popular")) or truthy(qp.get("is_hit")):
-            qs = qs.filter(is_hit=True)
-
-        if truthy(qp.get("is_new")):
-            qs = qs.filter(is_new=True)
-
-        if truthy(qp.get("is_sale")):
-            qs = qs.filter(is_sale=True)
+        qs, self.cache_category_ids = filter_product_listing(qs, qp)
 
         # ----- LIMIT -----
+        # в keyset-режиме размер страницы задаёт page_size, срез здесь не нужен
         limit_raw = qp.get("limit")
-        if limit_raw:
+        if limit_raw and not keyset_requested(self.request):
             try:
                 limit = int(limit_raw)
                 if limit > 0:
@@ -148,6 +167,39 @@ class ProductListView(ListAPIView):
         return qs
 
 
+class ProductFacetsView(APIView):
+    """
+    Счётчики для фильтров каталога. Принимает те же параметры, что и список
+    товаров, и считает всё одним grouped-запросом по витрине.
+    """
+
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        etag, version = _catalog_list_etag(request)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        key = _catalog_list_cache_key("facets", request, version)
+        data = catalog_cache_get(key)
+        hit = data is not None
+        if not hit:
+            qs, category_ids = filter_product_listing(
+                get_product_listing_qs(user=None), request.query_params
+            )
+            data = product_listing_facets(qs)
+            if category_ids is None:
+                tags = [TAG_ALL_CATEGORIES]
+            else:
+                tags = [category_tag(cid) for cid in category_ids]
+            catalog_cache_set(key, data, tags=tags)
+        headers = {"X-Cache": "HIT" if hit else "MISS"}
+        if etag:
+            headers["ETag"] = etag
+        return Response(data, headers=headers)
+
+
 class ProductRetrieveView(RetrieveAPIView):
     authentication_classes = [JWTAuthentication, SessionAuthentication]
     permission_classes = [AllowAny]
@@ -155,29 +207,80 @@ class ProductRetrieveView(RetrieveAPIView):
     lookup_field = "slug"
 
     def get_queryset(self):
-        return get_product_detail_qs(user=self.request.user)
+        # is_favorited накладывается поверх закэшированного ответа, см. retrieve()
+        return get_product_detail_qs(user=None)
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
+        # версия товара — один лёгкий запрос; сериализатор нужен только при промахе
+        stamp = (
+            self.get_queryset()
+            .filter(**{self.lookup_field: kwargs[self.lookup_field]})
+            .values_list("id", "version")
+            .first()
+        )
+        etag = self._etag(request, *stamp) if stamp else None
+
         user_id = request.user.id if request.user.is_authenticated else None
         annon_id = (
             None
             if user_id
             else request.headers.get(settings.RECENTLY_VIEWED["ANON_HEADER"])
         )
-        add_recent_view(product_id=instance.id, user_id=user_id, annon_id=annon_id)
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
 
-
-class FavoriteListView(ListAPIView):
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            add_recent_view(product_id=stamp[0], user_id=user_id, annon_id=annon_id)
+            return not_modified
+
+        # версия в ключе: запись из кэша всегда соответствует отдаваемому ETag
+        kind = f"detail:{stamp[1]}" if stamp else "detail"
+        key = catalog_cache_key(kind, request)
+        data = catalog_cache_get(key)
+        hit = data is not None
+        if not hit:
+            instance = self.get_object()
+            data = self.get_serializer(instance).data
+            catalog_cache_set(key, data, tags=[product_tag(instance.id)])
+
+        add_recent_view(product_id=data["id"], user_id=user_id, annon_id=annon_id)
+        overlay_is_favorited([data], request.user)
+        headers = {"X-Cache": "HIT" if hit else "MISS"}
+        if etag:
+            headers["ETag"] = etag
+        return Response(data, headers=headers)
+
+    @staticmethod
+    def _etag(request, product_id, version):
+        client_id = _request_client_id(request)
+        versions = catalog_versions(client_id)
+        if versions is None:
+            return None
+        etag = f"p{product_id}.{version}.{versions['dims']}"
+        if client_id:
+            etag += f".f{versions['fav']}"
+        return f'"{etag}"'
+
+
+class FavoriteListView(KeysetOptInMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
     serializer_class = ProductListSerializer
 
     def get_queryset(self):
         client = get_request_client_or_raise(self.request)
-        return favorites_products_qs(client)
+        return favorites_ids_qs(client)
+
+    def list(self, request, *args, **kwargs):
+        # пагинируем только id, элементы — из кэша карточек одним MGET
+        page = self.paginate_queryset(self.get_queryset())
+        rows = page if page is not None else list(self.get_queryset())
+        cards = product_cards(p.id for p in rows)
+        items = [
+            {**cards[p.id], "is_favorited": True} for p in rows if p.id in cards
+        ]
+        if page is not None:
+            return self.get_paginated_response(items)
+        return Response(items)
 
 
 class FavoriteSetView(APIView):
@@ -207,8 +310,7 @@ class RecentlyViewedListView(ListAPIView):
     serializer_class = ProductListSerializer
     authentication_classes = [JWTAuthentication]
 
-    def get_queryset(self):
-        request = self.request
+    def list(self, request, *args, **kwargs):
         try:
             limit = int(request.query_params.get("limit", 10))
         except ValueError:
@@ -222,4 +324,13 @@ class RecentlyViewedListView(ListAPIView):
             annon_id = request.headers.get(settings.RECENTLY_VIEWED["ANON_HEADER"])
 
         ids = get_recent_ids(user_id=user_id, annon_id=annon_id, limit=limit)
-        return products_preserve_order(ids)
+        # порядок из Redis, карточки — одним MGET; неактивных товаров в кэше нет
+        cards = product_cards(ids)
+        items = [dict(cards[pid]) for pid in ids if pid in cards]
+
+        page = self.paginate_queryset(items)
+        if page is not None:
+            overlay_is_favorited(page, request.user)
+            return self.get_paginated_response(page)
+        overlay_is_favorited(items, request.user)
+        return Response(items)
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# под ASGI статус платежа обслуживают async-вьюхи (apps/payments/urls.py)
+os.environ.setdefault('T_BANK_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# снимок каталога для in-process движка (если включён CATALOG_ENGINE)
+from apps.products.engine import catalog_engine_warmup  # noqa: E402
+
+catalog_engine_warmup()
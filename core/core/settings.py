@@ -42,6 +42,7 @@ DJANGO_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 INSTALLED_APPS = DJANGO_APPS + DRF_APPS + LOCAL_APPS
@@ -83,9 +84,38 @@ RECENTLY_VIEWED = {
         os.getenv("RECENTLY_VIEWED_TTL_SECONDS", str(60 * 60 * 24 * 30))
     ),
     "MAX_LEN": int(os.getenv("RECENTLY_VIEWED_MAX_LEN", "50")),
+    # повторный просмотр того же товара в течение N секунд не пишем (0 — писать всегда)
+    "DEBOUNCE_SECONDS": int(os.getenv("RECENTLY_VIEWED_DEBOUNCE_SECONDS", "30")),
     "ANON_HEADER": "X-Anon-Id",
 }
 
+# Анонимная корзина (Redis, кэш "cart"): скользящий TTL продлевается при каждом обращении.
+# MAX_LINES держим не выше hash-max-listpack-entries (128 по умолчанию) —
+# тогда хэш остаётся в компактной кодировке listpack.
+ANON_CART = {
+    "TTL_SECONDS": int(os.getenv("ANON_CART_TTL_SECONDS", str(60 * 60 * 24 * 30))),
+    "MAX_LINES": int(os.getenv("ANON_CART_MAX_LINES", "100")),
+}
+
+# кэш ответов каталога (ProductListView / ProductRetrieveView) в CACHES["default"]
+CATALOG_CACHE = {
+    "ENABLED": os.getenv("CATALOG_CACHE_ENABLED", "1") == "1",
+    "TIMEOUT": int(os.getenv("CATALOG_CACHE_TIMEOUT", str(60 * 10))),
+}
+
+# In-process колоночный движок каталога (apps/products/engine.py):
+# анонимные фильтры списка товаров отвечаются из памяти воркера
+CATALOG_ENGINE = {
+    "ENABLED": os.getenv("CATALOG_ENGINE_ENABLED", "0") == "1",
+    # как часто (сек) воркер сверяет версию каталога с Redis
+    "CHECK_INTERVAL": float(os.getenv("CATALOG_ENGINE_CHECK_INTERVAL", "1.0")),
+}
+
+# Границы корзин цены для /api/products/facets/ (по min_price варианта)
+CATALOG_FACETS = {
+    "PRICE_BUCKETS": [1000, 3000, 5000, 10000, 20000, 50000],
+}
+
 _SCHEME = "rediss" if REDIS_TLS else "redis"
 
 
@@ -251,7 +281,57 @@ T_BANK = {
     "FAIL_URL": os.getenv(
         "PAY_FAIL_URL", "https://securepay.tinkoff.ru/html/payForm/fail.html"
     ),
+    # Init: сколько повторный запрос ждёт уже идущую попытку, и через сколько
+    # незавершённая попытка (упал воркер посреди запроса к банку) считается брошенной
+    "INIT_WAIT_SECONDS": float(os.getenv("T_BANK_INIT_WAIT_SECONDS", "10")),
+    "INIT_STALE_SECONDS": int(os.getenv("T_BANK_INIT_STALE_SECONDS", "60")),
+}
+# HTTP к T-Bank: пул соединений на процесс (sync — requests.Session, async — httpx).
+# DEADLINE_SECONDS — на весь вызов async-клиента, включая ожидание и повторы GetState.
+T_BANK_HTTP = {
+    "TIMEOUT": float(os.getenv("T_BANK_HTTP_TIMEOUT", "15")),
+    "DEADLINE_SECONDS": float(os.getenv("T_BANK_HTTP_DEADLINE_SECONDS", "20")),
+    "MAX_CONNECTIONS": int(os.getenv("T_BANK_HTTP_MAX_CONNECTIONS", "20")),
+    "KEEPALIVE_SECONDS": 30,
+    "CONCURRENCY": int(os.getenv("T_BANK_HTTP_CONCURRENCY", "10")),
+    "RETRIES": int(os.getenv("T_BANK_HTTP_RETRIES", "2")),
+    "BACKOFF_SECONDS": 0.2,
+}
+# Фоновый опрос незавершённых платежей (manage.py poll_payments).
+# Статусные ручки идут в банк сами, только если состояние старше STALE_SECONDS;
+# ?wait=N — long-poll не дольше MAX_WAIT_SECONDS.
+PAYMENT_POLLER = {
+    "INTERVAL_SECONDS": int(os.getenv("PAYMENT_POLLER_INTERVAL_SECONDS", "5")),
+    "STALE_SECONDS": int(os.getenv("PAYMENT_STATE_STALE_SECONDS", "20")),
+    "BATCH": int(os.getenv("PAYMENT_POLLER_BATCH", "200")),
+    "CONCURRENCY": int(os.getenv("PAYMENT_POLLER_CONCURRENCY", "10")),
+    "MAX_AGE_HOURS": int(os.getenv("PAYMENT_POLLER_MAX_AGE_HOURS", "24")),
+    "MAX_WAIT_SECONDS": 25,
 }
+# Входящие webhooks T-Bank: вьюха только пишет в WebhookInbox, обработка —
+# manage.py drain_webhooks. Повтор после ошибки — через BACKOFF_SECONDS * 2^(n-1)
+# (не больше MAX_BACKOFF_SECONDS); после MAX_ATTEMPTS ошибок уведомление
+# откладывается в сторону (failed_at) до ручного разбора.
+WEBHOOK_INBOX = {
+    "BATCH": int(os.getenv("WEBHOOK_INBOX_BATCH", "100")),
+    "POLL_SECONDS": float(os.getenv("WEBHOOK_INBOX_POLL_SECONDS", "1")),
+    "MAX_ATTEMPTS": int(os.getenv("WEBHOOK_INBOX_MAX_ATTEMPTS", "10")),
+    "BACKOFF_SECONDS": float(os.getenv("WEBHOOK_INBOX_BACKOFF_SECONDS", "2")),
+    "MAX_BACKOFF_SECONDS": float(os.getenv("WEBHOOK_INBOX_MAX_BACKOFF_SECONDS", "600")),
+}
+# SSE со статусом платежа/заказа (/api/payments/events/<ident>, только ASGI):
+# события приходят через Redis pub/sub (apps/orders/events.py)
+ORDER_EVENTS = {
+    "HEARTBEAT_SECONDS": int(os.getenv("ORDER_EVENTS_HEARTBEAT_SECONDS", "15")),
+    "MAX_STREAM_SECONDS": int(os.getenv("ORDER_EVENTS_MAX_STREAM_SECONDS", "300")),
+    # пауза перед переподключением EventSource
+    "RETRY_MS": int(os.getenv("ORDER_EVENTS_RETRY_MS", "3000")),
+    # события в очереди одного подписчика; лишние у медленного клиента отбрасываются
+    "QUEUE_SIZE": 32,
+}
+# async-вьюхи статуса платежа (core/asgi.py включает их по умолчанию)
+T_BANK_ASYNC_VIEWS = os.getenv("T_BANK_ASYNC_VIEWS", "0") == "1"
+
 if not T_BANK["TERMINAL_KEY"] or not T_BANK["PASSWORD"]:
     raise RuntimeError("T_BANK credentials are not set. Check .env")
 
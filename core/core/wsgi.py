@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# снимок каталога для in-process движка (если включён CATALOG_ENGINE)
+from apps.products.engine import catalog_engine_warmup  # noqa: E402
+
+catalog_engine_warmup()